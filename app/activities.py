@@ -0,0 +1,102 @@
+import sys
+from datetime import datetime
+from itertools import groupby
+
+import numpy as np
+from sqlalchemy import select, desc
+from sqlalchemy.orm import Session
+
+from business_hour_index import to_epoch_us
+from constants import ACTIVITY_BATCH_SIZE
+from metrics import count, COUNTER_ROWS_SCANNED
+from models import StoreActivity
+from store_filter import StoreFilter
+from vectorized import encode_statuses
+
+
+def get_activity_columns_query(start_time: datetime, end_time: datetime, store_ids: list = None,
+                               stores: StoreFilter = None):
+    """Core select of the (store_id, timestamp_utc, status) of the polls between end_time and start_time.
+
+    The polls are ordered by store_id and descending timestamp_utc, like get_activities_query, but are
+    fetched as plain tuples instead of StoreActivity instances.
+    """
+    query = select(StoreActivity.store_id, StoreActivity.timestamp_utc, StoreActivity.status).where(
+        StoreActivity.timestamp_utc >= end_time,
+        StoreActivity.timestamp_utc <= start_time
+    )
+    if store_ids is not None:
+        query = query.where(StoreActivity.store_id.in_(store_ids))
+    if stores:
+        query = query.where(*stores.where(StoreActivity.store_id))
+    return query.order_by(StoreActivity.store_id, desc(StoreActivity.timestamp_utc))
+
+
+class ActivityArrays:
+    """Polls of many stores packed into flat arrays, ordered by store and descending time.
+
+    A poll takes 9 bytes, an int64 timestamp in microseconds since the epoch and a uint8 status code.
+    Stores are interned to their index in store_ids, the polls of store i are those from offsets[i] to
+    offsets[i + 1], so the store of a poll does not have to be stored with it.
+    """
+
+    def __init__(self, store_ids: list, offsets: np.ndarray, ts: np.ndarray, codes: np.ndarray):
+        self.store_ids = store_ids
+        self.offsets = offsets
+        self.ts = ts
+        self.codes = codes
+
+    @classmethod
+    def from_rows(cls, rows) -> 'ActivityArrays':
+        """Pack (store_id, timestamp_utc, status) rows ordered by store_id."""
+        if not rows:
+            return cls([], np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8))
+
+        store_column, ts_column, status_column = zip(*rows)
+        store_ids, lengths = [], []
+        for store_id, store_rows in groupby(store_column):
+            store_ids.append(sys.intern(store_id))
+            lengths.append(sum(1 for _ in store_rows))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        return cls(store_ids, offsets, to_epoch_us(ts_column), encode_statuses(status_column))
+
+    def __len__(self) -> int:
+        return len(self.store_ids)
+
+    def store(self, index: int) -> tuple:
+        """Get the (store_id, ts, codes) of a store, ts and codes are views of the packed arrays."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.store_ids[index], self.ts[start:end], self.codes[start:end]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.store(index)
+
+
+def load_activity_arrays(db: Session, query) -> ActivityArrays:
+    """Fetch all the polls of a query at once and pack them."""
+    rows = db.execute(query).all()
+    count(COUNTER_ROWS_SCANNED, len(rows))
+    return ActivityArrays.from_rows(rows)
+
+
+def stream_activity_arrays(db: Session, query, batch_size: int = ACTIVITY_BATCH_SIZE):
+    """Yield the (store_id, ts, codes) of every store of a query, fetching batch_size polls at a time.
+
+    Only one batch of rows is kept in memory, the polls of a store spread over several batches are
+    joined before the store is yielded.
+    """
+    pending = None
+    for rows in db.execute(query.execution_options(yield_per=batch_size)).partitions():
+        count(COUNTER_ROWS_SCANNED, len(rows))
+        batch = ActivityArrays.from_rows(rows)
+        for index in range(len(batch)):
+            store_id, ts, codes = batch.store(index)
+            if pending is not None and pending[0] == store_id:
+                store_id, ts, codes = store_id, np.concatenate([pending[1], ts]), np.concatenate([pending[2], codes])
+            elif pending is not None:
+                yield pending
+            pending = store_id, ts, codes
+
+    if pending is not None:
+        yield pending
@@ -0,0 +1,21 @@
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from config import POSTGRES_DATABASE_URI, DATABASE_ECHO, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW
+
+# Async driver of every supported database, SQLite is used for tests
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+database_url = make_url(POSTGRES_DATABASE_URI)
+async_database_url = database_url.set(drivername=ASYNC_DRIVERS[database_url.get_backend_name()])
+
+pool_options = {}
+if database_url.get_backend_name() != 'sqlite':
+    pool_options = {'pool_size': DATABASE_POOL_SIZE, 'max_overflow': DATABASE_MAX_OVERFLOW}
+
+async_engine = create_async_engine(async_database_url, echo=DATABASE_ECHO, **pool_options)
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False,
+                                       expire_on_commit=False)
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta, time
+
+import numpy as np
+import pandas as pd
+
+from db import engine
+from models import StoreActivity, StoreBusinessHour, StoreTimezone
+from scripts.loader import write_chunk
+
+BENCHMARK_TIMEZONES = ['America/Chicago', 'America/New_York', 'America/Denver', 'America/Los_Angeles',
+                       'America/Phoenix', 'America/Anchorage', 'Pacific/Honolulu', 'Asia/Kolkata']
+
+# Stores whose activities are generated and written together
+STORES_PER_CHUNK = 1000
+# Fraction of the poll interval by which consecutive polls drift
+POLL_JITTER = 0.5
+
+
+def generate_store_ids(rng: np.random.Generator, stores: int) -> np.ndarray:
+    """Generate unique numeric store ids like those of the source data."""
+    return rng.choice(2 ** 62, size=stores, replace=False).astype(str)
+
+
+def generate_timezones(rng: np.random.Generator, store_ids: np.ndarray, timezones: list,
+                       missing_timezone_ratio: float) -> pd.DataFrame:
+    """Give every store a timezone drawn from timezones, except the stores missing from store_timezones."""
+    has_timezone = rng.random(len(store_ids)) >= missing_timezone_ratio
+    return pd.DataFrame({
+        'store_id': store_ids[has_timezone],
+        'timezone_str': rng.choice(timezones, size=has_timezone.sum())
+    })
+
+
+def to_times(seconds: np.ndarray) -> list:
+    """Convert seconds since midnight into local times, 86400 becomes 23:59:59."""
+    seconds = np.minimum(seconds, 86399)
+    return [time(second // 3600, second % 3600 // 60, second % 60) for second in seconds.tolist()]
+
+
+def generate_business_hours(rng: np.random.Generator, store_ids: np.ndarray, split_ratio: float,
+                            overnight_ratio: float, missing_hours_ratio: float) -> pd.DataFrame:
+    """Generate the weekly business hours of the stores.
+
+    A store has either no business hours at all (open 24*7), split hours with a break in the afternoon,
+    overnight hours that close after midnight, or regular hours, with one closed day for some of them.
+    """
+    kind = rng.random(len(store_ids))
+    overnight = kind < overnight_ratio
+    split = (kind >= overnight_ratio) & (kind < overnight_ratio + split_ratio)
+    regular = (kind >= overnight_ratio + split_ratio) & (kind < 1 - missing_hours_ratio)
+
+    # Seconds since midnight of the opening and closing of every store, in half hour steps
+    half_hours = rng.integers(0, 4, size=(len(store_ids), 4)) * 1800
+    ranges = [
+        (store_ids[regular], 6 * 3600 + half_hours[regular, 0], 20 * 3600 + 2 * half_hours[regular, 1]),
+        (store_ids[split], 9 * 3600 + half_hours[split, 0], 14 * 3600 + half_hours[split, 1]),
+        (store_ids[split], 17 * 3600 + half_hours[split, 2], 21 * 3600 + 2 * half_hours[split, 3]),
+        (store_ids[overnight], 18 * 3600 + half_hours[overnight, 0], half_hours[overnight, 1])
+    ]
+    # Regular stores closed on one day of the week, the others are open every day
+    closed_day = np.where(rng.random(regular.sum()) < 0.2, rng.integers(0, 7, size=regular.sum()), -1)
+
+    frames = []
+    for index, (range_store_ids, opens, closes) in enumerate(ranges):
+        for day_of_week in range(7):
+            open_on_day = closed_day != day_of_week if index == 0 else np.ones(len(range_store_ids), dtype=bool)
+            frames.append(pd.DataFrame({
+                'store_id': range_store_ids[open_on_day],
+                'day_of_week': day_of_week,
+                'start_time_local': to_times(opens[open_on_day]),
+                'end_time_local': to_times(closes[open_on_day])
+            }))
+    return pd.concat(frames, ignore_index=True).sort_values(['store_id', 'day_of_week'], kind='stable')
+
+
+def generate_activities(rng: np.random.Generator, store_ids: np.ndarray, as_of: datetime, days: int,
+                        poll_minutes: float):
+    """Yield the polls of the stores over the days before as_of, STORES_PER_CHUNK stores at a time.
+
+    Every store polls roughly every poll_minutes, and is active with its own probability.
+    """
+    polls_per_store = int(days * 24 * 60 / poll_minutes)
+    first_poll = np.datetime64(as_of - timedelta(days=days), 'us')
+    poll_us = poll_minutes * 60 * 10 ** 6
+
+    for chunk_start in range(0, len(store_ids), STORES_PER_CHUNK):
+        chunk_store_ids = store_ids[chunk_start:chunk_start + STORES_PER_CHUNK]
+        intervals = poll_us * (1 + POLL_JITTER * (rng.random((len(chunk_store_ids), polls_per_store)) - 0.5))
+        intervals[:, 0] *= rng.random(len(chunk_store_ids))
+        offsets = np.cumsum(intervals, axis=1).astype('int64')
+
+        uptime = rng.uniform(0.6, 1, size=(len(chunk_store_ids), 1))
+        active = rng.random(offsets.shape) < uptime
+
+        timestamps = first_poll + offsets.astype('timedelta64[us]')
+        within = timestamps <= np.datetime64(as_of, 'us')
+        yield pd.DataFrame({
+            'store_id': np.repeat(chunk_store_ids, polls_per_store)[within.ravel()],
+            'timestamp_utc': timestamps[within],
+            'status': np.where(active[within], 'active', 'inactive')
+        })
+
+
+def write_frames(table, frames) -> int:
+    """Write DataFrames into a table the way the import scripts do, returns the number of rows written."""
+    rows = 0
+    for frame in frames:
+        with engine.begin() as connection:
+            write_chunk(connection, table, frame)
+        rows += len(frame)
+    return rows
+
+
+def load_dataset(stores: int, as_of: datetime, days: int = 8, poll_minutes: float = 60,
+                 timezones: list = None, split_ratio: float = 0.2, overnight_ratio: float = 0.1,
+                 missing_hours_ratio: float = 0.1, missing_timezone_ratio: float = 0.05, seed: int = 0) -> dict:
+    """Generate a synthetic dataset and load it into the store tables, returns the rows loaded per table.
+
+    The same parameters and seed always generate the same dataset.
+    """
+    rng = np.random.default_rng(seed)
+    store_ids = generate_store_ids(rng, stores)
+
+    timezone_rows = generate_timezones(rng, store_ids, timezones or BENCHMARK_TIMEZONES, missing_timezone_ratio)
+    business_hour_rows = generate_business_hours(rng, store_ids, split_ratio, overnight_ratio, missing_hours_ratio)
+
+    return {
+        StoreTimezone.__tablename__: write_frames(StoreTimezone.__table__, [timezone_rows]),
+        StoreBusinessHour.__tablename__: write_frames(StoreBusinessHour.__table__, [business_hour_rows]),
+        StoreActivity.__tablename__: write_frames(
+            StoreActivity.__table__, generate_activities(rng, store_ids, as_of, days, poll_minutes))
+    }
@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import uuid
+import random
+import argparse
+import platform
+import statistics
+from pathlib import Path
+from datetime import datetime
+from time import perf_counter
+
+# Add the parent directory of the current script to the Python path
+current_dir = Path(__file__).resolve().parent
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+
+parser = argparse.ArgumentParser(description="Time the report pipeline on synthetic datasets.")
+parser.add_argument('--stores', type=int, nargs='+', default=[1000, 10000, 100000])
+parser.add_argument('--database-uri', default=f'sqlite:///{current_dir / "benchmark.db"}',
+                    help="Database the datasets are loaded into, its store and report tables are dropped.")
+parser.add_argument('--snapshot-filepath', default=str(current_dir / 'benchmark.snapshot'),
+                    help="Metadata snapshot of the benchmark database, kept apart from the one of the app.")
+parser.add_argument('--engines', nargs='+', default=['reference', 'vectorized', 'rollup', 'pushdown'])
+parser.add_argument('--workers', type=int, default=1, help="Worker processes of the vectorized engine.")
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument('--sample-stores', type=int, default=1000,
+                    help="Stores whose activities the hot functions are timed on.")
+parser.add_argument('--poll-minutes', type=float, default=60)
+parser.add_argument('--days', type=int, default=8)
+parser.add_argument('--timezones', nargs='+', default=None)
+parser.add_argument('--split-ratio', type=float, default=0.2)
+parser.add_argument('--overnight-ratio', type=float, default=0.1)
+parser.add_argument('--missing-hours-ratio', type=float, default=0.1)
+parser.add_argument('--missing-timezone-ratio', type=float, default=0.05)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--output', default='benchmark_results.json')
+parser.add_argument('--baseline', help="Results of a previous run to compare with.")
+parser.add_argument('--tolerance', type=float, default=0.2,
+                    help="Slowdown over the baseline median reported as a regression.")
+args = parser.parse_args()
+
+# The database is configured when db is first imported
+os.environ['DATABASE_URI'] = args.database_uri
+os.environ['DATABASE_ECHO'] = 'false'
+# The reports of the benchmark map a snapshot of the synthetic stores, not the one of the app
+os.environ['METADATA_SNAPSHOT_FILEPATH'] = args.snapshot_filepath
+
+from db import Base, Session, engine
+from constants import STATUS_RUNNING, ENGINE_ROLLUP
+from models import Report
+from rollup import backfill_hourly_uptime
+from report_store import delete_report_files
+from metadata_snapshot import build_metadata_snapshot, get_metadata_snapshot
+from report_output import remove_report_files
+from utils import (get_report_time_range, get_store_timezones, get_business_hours, get_activities_query,
+                   sort_business_hours, is_within_business_hours, interpolate_activities, generate_csv,
+                   generate_report)
+from benchmarks.generator import BENCHMARK_TIMEZONES, load_dataset
+
+
+def measure(function, repeat: int) -> dict:
+    """Call function repeat times, returns the seconds of every call with their minimum and median."""
+    seconds = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        seconds.append(perf_counter() - start)
+    return {'seconds': seconds, 'min': min(seconds), 'median': statistics.median(seconds)}
+
+
+def benchmark_hot_functions(db: Session, start_time: datetime, end_time: datetime) -> dict:
+    """Time the functions the reference engine spends its time in, on the activities of a sample of stores."""
+    store_ids = sorted(get_store_timezones(db))
+    sample_store_ids = random.Random(args.seed).sample(store_ids, min(args.sample_stores, len(store_ids)))
+
+    results = {
+        'get_store_timezones': measure(lambda: get_store_timezones(db), args.repeat),
+        'get_business_hours': measure(lambda: get_business_hours(db, get_store_timezones(db)), args.repeat),
+        'build_metadata_snapshot': measure(
+            lambda: build_metadata_snapshot(db, filepath=args.snapshot_filepath), args.repeat),
+        # The snapshot is mapped once per process, then only its version stamp is queried
+        'load_metadata_snapshot': measure(
+            lambda: get_metadata_snapshot(db, args.snapshot_filepath).get_business_hours(), args.repeat)
+    }
+
+    business_hours = sort_business_hours(get_business_hours(db, get_store_timezones(db)))
+    activities = get_activities_query(db, start_time, end_time, sample_store_ids).all()
+
+    def filter_activities():
+        return [activity for activity in activities
+                if is_within_business_hours(activity.store_id, activity.timestamp_utc, business_hours)]
+
+    results['is_within_business_hours'] = {'calls': len(activities), **measure(filter_activities, args.repeat)}
+
+    store_activities = {}
+    for activity in filter_activities():
+        store_activities.setdefault(activity.store_id, []).append(activity)
+
+    def interpolate_stores():
+        for store_id, activities_within_business_hours in store_activities.items():
+            interpolate_activities(activities_within_business_hours, start_time, end_time, business_hours[store_id])
+
+    results['interpolate_activities'] = {'calls': len(store_activities), **measure(interpolate_stores, args.repeat)}
+
+    activities_within_business_hours = filter_activities()
+
+    def write_csv():
+        report_id = uuid.uuid4()
+        generate_csv(report_id, start_time, end_time, activities_within_business_hours, business_hours)
+        remove_report_files(report_id)
+
+    results['generate_csv'] = {'calls': len(store_activities), **measure(write_csv, args.repeat)}
+    return results
+
+
+def benchmark_reports(db: Session) -> tuple:
+    """Time the end to end generation of a report with every engine, returns the results and report timings."""
+    results, report_timings = {}, {}
+
+    if ENGINE_ROLLUP in args.engines:
+        business_hours = get_business_hours(db, get_store_timezones(db))
+        results['backfill_hourly_uptime'] = measure(lambda: backfill_hourly_uptime(db, business_hours), 1)
+
+    for report_engine in args.engines:
+        reports = []
+
+        def generate():
+            report = Report(status=STATUS_RUNNING, engine=report_engine)
+            db.add(report)
+            db.commit()
+            generate_report(report.id, db, report_engine, workers=args.workers)
+            reports.append(report)
+            delete_report_files(db, report.id)
+
+        results[f'generate_report[{report_engine}]'] = measure(generate, args.repeat)
+        report_timings[report_engine] = reports[-1].timings
+    return results, report_timings
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """Get the benchmarks whose median got slower than the baseline by more than the tolerance."""
+    regressions = []
+    for stores, store_results in results['results'].items():
+        baseline_benchmarks = baseline['results'].get(stores, {}).get('benchmarks', {})
+        for name, result in store_results['benchmarks'].items():
+            if name in baseline_benchmarks:
+                ratio = result['median'] / max(baseline_benchmarks[name]['median'], 1e-9)
+                print(f"{stores} stores {name}: {result['median']:.4f}s, {ratio:.2f}x the baseline")
+                if ratio > 1 + args.tolerance:
+                    regressions.append((stores, name, ratio))
+    return regressions
+
+
+def main():
+    start_time, end_time = get_report_time_range()
+    # The database URI can hold credentials, only its dialect is recorded
+    parameters = {key: value for key, value in vars(args).items()
+                  if key not in ('database_uri', 'output', 'baseline')}
+    parameters['timezones'] = args.timezones or BENCHMARK_TIMEZONES
+    results = {
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'database': engine.dialect.name,
+        'parameters': parameters,
+        'results': {}
+    }
+
+    for stores in args.stores:
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+
+        load_start = perf_counter()
+        rows = load_dataset(stores, start_time, args.days, args.poll_minutes, args.timezones, args.split_ratio,
+                            args.overnight_ratio, args.missing_hours_ratio, args.missing_timezone_ratio, args.seed)
+        load_seconds = perf_counter() - load_start
+        print(f"Loaded {rows} for {stores} stores in {load_seconds:.1f} seconds")
+
+        db = Session()
+        try:
+            benchmarks = benchmark_hot_functions(db, start_time, end_time)
+            report_benchmarks, report_timings = benchmark_reports(db)
+            benchmarks.update(report_benchmarks)
+        finally:
+            db.close()
+
+        for name, result in benchmarks.items():
+            print(f"{stores} stores {name}: median {result['median']:.4f}s, min {result['min']:.4f}s")
+        results['results'][str(stores)] = {
+            'rows': rows, 'load_seconds': load_seconds, 'benchmarks': benchmarks, 'report_timings': report_timings
+        }
+
+    with open(args.output, mode='w') as output_file:
+        json.dump(results, output_file, indent=2, default=str)
+    print(f"Wrote the benchmark results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file))
+        for stores, name, ratio in regressions:
+            print(f"Regression: {name} with {stores} stores is {ratio:.2f}x slower than the baseline")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
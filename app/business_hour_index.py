@@ -0,0 +1,191 @@
+from datetime import datetime, timedelta
+from functools import lru_cache
+from collections.abc import Mapping
+
+import numpy as np
+import pytz
+
+from constants import DEFAULT_TIMEZONE, FULL_DAY
+
+# Local dates around the report window to expand, so that ranges crossing midnight
+# and timezones far from UTC are covered
+WINDOW_MARGIN = timedelta(days=2)
+# Local times whose UTC time is kept for the next stores and reports, the least recently used are dropped. A report
+# converts the distinct open and close times of every timezone on the days of its window and WINDOW_MARGIN.
+LOCAL_TO_UTC_CACHE_SIZE = 65536
+# Microseconds of a day and of a week, weekly intervals are measured from the local midnight starting Monday
+DAY_US = 24 * 60 * 60 * 10 ** 6
+WEEK_US = 7 * DAY_US
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_us(timestamps) -> np.ndarray:
+    """Convert naive UTC datetimes to int64 microseconds since the epoch."""
+    return np.array(timestamps, dtype='datetime64[us]').astype(np.int64)
+
+
+def get_store_schedule(store_id: str, business_hours: dict) -> dict:
+    """Return the business hours of a store, defaulting to open 24*7 in the default timezone."""
+    if store_id not in business_hours or not business_hours[store_id]:
+        return {'timezone': DEFAULT_TIMEZONE, **{day_of_week: FULL_DAY for day_of_week in range(7)}}
+    return business_hours[store_id]
+
+
+@lru_cache(maxsize=LOCAL_TO_UTC_CACHE_SIZE)
+def local_to_utc(timezone_str: str, local_time: datetime, is_dst: bool) -> datetime:
+    """Convert a naive local time to naive UTC, resolving DST gaps and overlaps with is_dst."""
+    localized = pytz.timezone(timezone_str).localize(local_time, is_dst=is_dst)
+    return localized.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def to_weekly_intervals(day_ranges: list) -> list:
+    """Compile the ranges of every day of a week into sorted weekly (open, close) intervals.
+
+    day_ranges holds the (start, end) ranges of every day in microseconds since local midnight, the intervals are
+    in microseconds since the local midnight starting Monday. A range whose end is before its start closes on the
+    next day, as in expand_store_hours.
+    """
+    intervals = []
+    for day_of_week, ranges in enumerate(day_ranges):
+        for start, end in ranges:
+            close_day = day_of_week + 1 if end < start else day_of_week
+            intervals.append((day_of_week * DAY_US + start, close_day * DAY_US + end))
+    return sorted(intervals)
+
+
+def local_to_utc_us(timezone_str: str, local_us: np.ndarray, is_dst: bool) -> np.ndarray:
+    """Convert naive local times in microseconds since the epoch to UTC, each distinct time once."""
+    unique, inverse = np.unique(local_us, return_inverse=True)
+    utc = to_epoch_us([local_to_utc(timezone_str, EPOCH + timedelta(microseconds=local), is_dst)
+                       for local in unique.tolist()])
+    return utc[inverse]
+
+
+def expand_weekly_intervals(store_ids: list, timezones: list, timezone_index: np.ndarray, offsets: np.ndarray,
+                            week_opens: np.ndarray, week_closes: np.ndarray, start_time: datetime,
+                            end_time: datetime) -> dict:
+    """Expand the weekly intervals of stores into merged, sorted UTC (open, close) boundaries by store_id.
+
+    The intervals of store i are week_opens[offsets[i]:offsets[i + 1]] and week_closes alike, compiled by
+    to_weekly_intervals, in the timezone timezones[timezone_index[i]]. The boundaries are those expand_store_hours
+    gets from the ranges of the store, for all the stores at once.
+    """
+    first_day = (start_time - WINDOW_MARGIN).date()
+    last_day = (end_time + WINDOW_MARGIN).date()
+    first_monday = first_day - timedelta(days=first_day.weekday())
+    weeks = (last_day - first_monday).days // 7 + 1
+
+    # Every weekly interval in every week around the window, kept when it opens on a day expand_store_hours expands
+    week_starts = (first_monday - EPOCH.date()).days * DAY_US + np.arange(weeks, dtype=np.int64) * WEEK_US
+    opens = (week_starts[:, None] + week_opens[None, :]).ravel()
+    closes = (week_starts[:, None] + week_closes[None, :]).ravel()
+    stores = np.tile(np.repeat(np.arange(len(store_ids)), np.diff(offsets)), weeks)
+    open_days = opens // DAY_US
+    expanded = (open_days >= (first_day - EPOCH.date()).days) & (open_days <= (last_day - EPOCH.date()).days)
+    opens, closes, stores = opens[expanded], closes[expanded], stores[expanded]
+
+    # Open at the earliest and close at the latest instant of an ambiguous local time
+    interval_timezones = np.asarray(timezone_index)[stores]
+    for index in np.unique(interval_timezones).tolist():
+        in_timezone = interval_timezones == index
+        opens[in_timezone] = local_to_utc_us(timezones[index], opens[in_timezone], True)
+        closes[in_timezone] = local_to_utc_us(timezones[index], closes[in_timezone], False)
+
+    order = np.lexsort((closes, opens, stores))
+    opens, closes, stores = opens[order], closes[order], stores[order]
+    if len(opens):
+        # An interval starts a new one unless it opens before the latest close of the previous intervals of its
+        # store, the stores are shifted apart so that the running maximum does not cross them
+        base = min(opens.min(), closes.min())
+        span = max(opens.max(), closes.max()) - base + 1
+        latest_close = np.maximum.accumulate(closes - base + stores * span)
+        starts = np.ones(len(opens), dtype=bool)
+        starts[1:] = (stores[1:] != stores[:-1]) | (opens[1:] - base + stores[1:] * span > latest_close[:-1])
+        positions = np.flatnonzero(starts)
+        opens, closes, stores = opens[starts], np.maximum.reduceat(closes, positions), stores[starts]
+
+    bounds = np.searchsorted(stores, np.arange(len(store_ids) + 1)).tolist()
+    return {store_id: (opens[bounds[index]:bounds[index + 1]], closes[bounds[index]:bounds[index + 1]])
+            for index, store_id in enumerate(store_ids)}
+
+
+class CompiledBusinessHours(Mapping):
+    """Business hours of stores as get_business_hours builds them, along with their weekly intervals.
+
+    BusinessHourIndex expands the weekly intervals instead of the ranges of every day.
+    """
+
+    def get_weekly_intervals(self) -> tuple:
+        """Get the arguments of expand_weekly_intervals before start_time and end_time."""
+        raise NotImplementedError
+
+
+def expand_store_hours(store_hours: dict, start_time: datetime, end_time: datetime) -> tuple:
+    """Expand a store's weekly hours into merged, sorted UTC (open, close) boundaries.
+
+    start_time and end_time are the naive UTC bounds of the report window. A range whose end is
+    before its start is open across midnight, until the end time of the next day.
+    """
+    timezone_str = store_hours['timezone']
+    intervals = []
+    day = (start_time - WINDOW_MARGIN).date()
+    while day <= (end_time + WINDOW_MARGIN).date():
+        for start, end in store_hours.get(day.weekday(), []):
+            close_day = day + timedelta(days=1) if end < start else day
+            # Open at the earliest and close at the latest instant of an ambiguous local time
+            intervals.append((
+                local_to_utc(timezone_str, datetime.combine(day, start), True),
+                local_to_utc(timezone_str, datetime.combine(close_day, end), False)
+            ))
+        day += timedelta(days=1)
+
+    merged = []
+    for open_time, close_time in sorted(intervals):
+        if merged and open_time <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], close_time)
+        else:
+            merged.append([open_time, close_time])
+
+    if not merged:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    opens, closes = zip(*merged)
+    return to_epoch_us(opens), to_epoch_us(closes)
+
+
+def locate_intervals(opens: np.ndarray, closes: np.ndarray, ts: np.ndarray) -> np.ndarray:
+    """Get the index of the (open, close) interval containing each timestamp, -1 if outside all of them."""
+    index = np.searchsorted(opens, ts, side='right') - 1
+    inside = (index >= 0) & (ts <= closes[np.maximum(index, 0)]) if len(opens) else index >= 0
+    return np.where(inside, index, -1)
+
+
+class BusinessHourIndex:
+    """Business hours of every store, compiled once per report into UTC open/close boundaries."""
+
+    def __init__(self, business_hours: dict, start_time: datetime, end_time: datetime):
+        # start_time and end_time are the naive UTC bounds of the report window
+        self.business_hours = business_hours
+        self.start_time = min(start_time, end_time)
+        self.end_time = max(start_time, end_time)
+        if isinstance(business_hours, CompiledBusinessHours):
+            self.intervals = expand_weekly_intervals(*business_hours.get_weekly_intervals(), self.start_time,
+                                                     self.end_time)
+        else:
+            self.intervals = {
+                store_id: expand_store_hours(store_hours, self.start_time, self.end_time)
+                for store_id, store_hours in business_hours.items() if store_hours
+            }
+
+    def get_intervals(self, store_id: str) -> tuple:
+        """Get the sorted (opens, closes) arrays of a store in epoch microseconds."""
+        if store_id not in self.intervals:
+            # Stores without business hours are open 24*7
+            store_hours = get_store_schedule(store_id, self.business_hours)
+            self.intervals[store_id] = expand_store_hours(store_hours, self.start_time, self.end_time)
+        return self.intervals[store_id]
+
+    def locate(self, store_id: str, ts: np.ndarray) -> np.ndarray:
+        """Get the index of the business hour interval containing each timestamp, -1 if closed."""
+        opens, closes = self.get_intervals(store_id)
+        return locate_intervals(opens, closes, ts)
@@ -0,0 +1,42 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReportCancelled(Exception):
+    """Raised in the process generating a report once the report is cancelled."""
+
+
+# Set once the report being generated in this process is cancelled, None outside of cancellable
+current_cancelled = None
+
+
+@contextmanager
+def cancellable(cancelled: threading.Event):
+    """Stop the report generated within the block at the next check_cancelled once cancelled is set.
+
+    The report worker sets it from its heartbeat thread when it sees the report cancelled.
+    """
+    global current_cancelled
+    previous, current_cancelled = current_cancelled, cancelled
+    try:
+        yield
+    finally:
+        current_cancelled = previous
+
+
+def check_cancelled():
+    """Raise ReportCancelled if the report being generated is cancelled, a no-op outside of cancellable."""
+    if current_cancelled is not None and current_cancelled.is_set():
+        raise ReportCancelled()
+
+
+def cancellable_rows(rows):
+    """Yield the rows of a report, checking for its cancellation before computing every row."""
+    iterator = iter(rows)
+    while True:
+        check_cancelled()
+        try:
+            row = next(iterator)
+        except StopIteration:
+            return
+        yield row
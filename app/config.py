@@ -0,0 +1,59 @@
+from dotenv import load_dotenv
+import os
+
+# Specify the path to your .env file
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+load_dotenv(dotenv_path)
+
+POSTGRES_DATABASE_URI = os.getenv("DATABASE_URI")
+# Log every SQL statement, set DATABASE_ECHO=false for bulk imports
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "true").lower() == "true"
+# Connections kept open by each database engine, and how many more can be opened under load
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", 10))
+
+# Number of worker processes generating a report, reports are generated in a single process when 1
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", 1))
+
+# Reports with the same time, parameters and data are reused for REPORT_CACHE_TTL seconds,
+# at most REPORT_CACHE_SIZE of them are kept, least recently requested first out
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", 3600))
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", 100))
+
+# Number of report worker processes started by worker.py, each generates one report at a time
+REPORT_JOB_CONCURRENCY = int(os.getenv("REPORT_JOB_CONCURRENCY", 2))
+# A running report whose worker has not sent a heartbeat for REPORT_JOB_TIMEOUT seconds is
+# considered crashed and queued again, up to REPORT_JOB_MAX_ATTEMPTS attempts
+REPORT_JOB_HEARTBEAT = int(os.getenv("REPORT_JOB_HEARTBEAT", 10))
+REPORT_JOB_TIMEOUT = int(os.getenv("REPORT_JOB_TIMEOUT", 60))
+REPORT_JOB_MAX_ATTEMPTS = int(os.getenv("REPORT_JOB_MAX_ATTEMPTS", 3))
+# Seconds between two checks for new rows and for the status of a report followed by /get_report?follow=true
+REPORT_FOLLOW_INTERVAL = float(os.getenv("REPORT_FOLLOW_INTERVAL", 0.5))
+# The files of completed reports take at most REPORT_STORE_MAX_BYTES and are kept REPORT_STORE_MAX_AGE seconds since
+# they were last downloaded, or generated, the least recently downloaded reports are evicted first
+REPORT_STORE_MAX_BYTES = int(os.getenv("REPORT_STORE_MAX_BYTES", 1024 ** 3))
+REPORT_STORE_MAX_AGE = int(os.getenv("REPORT_STORE_MAX_AGE", 7 * 24 * 3600))
+# A store is below the SLA in a report window when its uptime is below REPORT_SLA_UPTIME of the time it was observed
+REPORT_SLA_UPTIME = float(os.getenv("REPORT_SLA_UPTIME", 0.99))
+
+# Report workers read the store timezones and business hours from a memory-mapped snapshot rebuilt when the tables
+# change, set METADATA_SNAPSHOT=false to query them for every report
+METADATA_SNAPSHOT = os.getenv("METADATA_SNAPSHOT", "true").lower() == "true"
+# File of the snapshot, in the app directory by default since the import scripts run from the scripts folder
+METADATA_SNAPSHOT_FILEPATH = os.getenv("METADATA_SNAPSHOT_FILEPATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'snapshots', 'store_metadata.snapshot'))
+
+# Uptimes served by /stores/{store_id}/uptime are computed as of the start of STORE_UPTIME_BUCKET second buckets
+# and memoized per store and bucket, at most STORE_UPTIME_CACHE_SIZE of them, least recently requested first out
+STORE_UPTIME_BUCKET = int(os.getenv("STORE_UPTIME_BUCKET", 60))
+STORE_UPTIME_CACHE_SIZE = int(os.getenv("STORE_UPTIME_CACHE_SIZE", 10000))
+
+# Polls ingested by POST /activities are inserted INGEST_BATCH_SIZE at a time with a single executemany, the request
+# body is not read further while INGEST_MAX_PENDING_BATCHES batches wait for the database.
+# INGEST_REFRESH_ROLLUPS recomputes the hourly rollups of the rollup engine with every batch.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 5000))
+INGEST_MAX_PENDING_BATCHES = int(os.getenv("INGEST_MAX_PENDING_BATCHES", 2))
+INGEST_REFRESH_ROLLUPS = os.getenv("INGEST_REFRESH_ROLLUPS", "true").lower() == "true"
+
+# Worker processes parsing a CSV file in the import scripts, one per CPU by default
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", os.cpu_count() or 1))
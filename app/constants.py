@@ -1,11 +1,52 @@
-from datetime import time
+import os
+from datetime import time, timedelta
 
 DEFAULT_TIMEZONE = 'America/Chicago'
 FULL_DAY = [(time(0, 0), time(23, 59, 59))]
 REPORT_FOLDER = 'reports'
+REPORT_FILENAME = 'store_activity_report_{}.csv'
+# Files of the completed reports, stored once per content under the sha256 of their content
+REPORT_STORE_FOLDER = os.path.join(REPORT_FOLDER, 'store')
+# Resolution of the download time of a report, the least recently downloaded reports are evicted first
+DOWNLOADED_AT_RESOLUTION = timedelta(minutes=1)
+# Windows of the report as (name, duration, unit), ordered from the shortest to the longest. Every window adds
+# an uptime and a downtime column, the longest one sets how far back a report reads the store activities.
+REPORT_WINDOWS = [
+    ('last_hour', timedelta(hours=1), 'minutes'),
+    ('last_day', timedelta(days=1), 'hours'),
+    ('last_week', timedelta(weeks=1), 'hours'),
+]
+# Units of the report windows, in units per hour
+WINDOW_UNITS = {'minutes': 60, 'hours': 1}
+REPORT_CSV_HEADER = ['store_id'] + [
+    f'{column}_{name}({unit})' for name, _, unit in REPORT_WINDOWS for column in ('uptime', 'downtime')
+]
+# Output formats of a report, it is always written as CSV and also in its output format. Every CSV report is
+# stored gzip compressed, csv.gz is kept as another name of csv
+FORMAT_CSV = 'csv'
+FORMAT_CSV_GZIP = 'csv.gz'
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+REPORT_FORMATS = [FORMAT_CSV, FORMAT_CSV_GZIP, FORMAT_PARQUET, FORMAT_ARROW]
+DEFAULT_REPORT_FORMAT = FORMAT_CSV
 
+ENGINE_REFERENCE = 'reference'
+ENGINE_VECTORIZED = 'vectorized'
+ENGINE_ROLLUP = 'rollup'
+ENGINE_PUSHDOWN = 'pushdown'
+REPORT_ENGINES = [ENGINE_REFERENCE, ENGINE_VECTORIZED, ENGINE_PUSHDOWN]
+# Engines which may round a duration of exactly half a unit the other way, their reports are not interchangeable
+APPROXIMATE_REPORT_ENGINES = [ENGINE_ROLLUP]
+DEFAULT_ENGINE = ENGINE_REFERENCE
+ACTIVITY_BATCH_SIZE = 10000
+
+STATUS_QUEUED = "Queued"
 STATUS_RUNNING = "Running"
 STATUS_COMPLETED = "Completed"
+STATUS_FAILED = "Failed"
+STATUS_CANCELLED = "Cancelled"
+# A completed report whose files were removed from the report store
+STATUS_EVICTED = "Evicted"
 
 STORE_ACTIVITY_CSV = 'store status.csv'
 STORE_BUSINESS_HOUR_CSV = 'Menu hours.csv'
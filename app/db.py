@@ -1,15 +1,25 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
-import os
+from sqlalchemy.dialects import postgresql, sqlite
+from config import POSTGRES_DATABASE_URI, DATABASE_ECHO, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW
 
-# Specify the path to your .env file
-dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-load_dotenv(dotenv_path)
+pool_options = {}
+if make_url(POSTGRES_DATABASE_URI).get_backend_name() != 'sqlite':
+    pool_options = {'pool_size': DATABASE_POOL_SIZE, 'max_overflow': DATABASE_MAX_OVERFLOW}
 
-POSTGRES_DATABASE_URI = os.getenv("DATABASE_URI")
-engine = create_engine(POSTGRES_DATABASE_URI, echo=True)
+engine = create_engine(POSTGRES_DATABASE_URI, echo=DATABASE_ECHO, **pool_options)
 
 Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+
+def dialect_insert(table, dialect_name: str):
+    """INSERT into a table with the ON CONFLICT clauses of the PostgreSQL or SQLite dialect."""
+    return (postgresql.insert if dialect_name == 'postgresql' else sqlite.insert)(table)
+
+
+def insert_ignoring_duplicates(table, dialect_name: str):
+    """INSERT into a table that skips the rows whose natural key, a unique index of the table, is already stored."""
+    return dialect_insert(table, dialect_name).on_conflict_do_nothing()
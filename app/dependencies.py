@@ -1,4 +1,5 @@
 from db import Session
+from async_db import AsyncSessionLocal
 
 
 def get_db():
@@ -7,3 +8,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
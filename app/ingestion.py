@@ -0,0 +1,176 @@
+import csv
+import json
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import INGEST_BATCH_SIZE, INGEST_MAX_PENDING_BATCHES, INGEST_REFRESH_ROLLUPS
+from db import insert_ignoring_duplicates
+from models import StoreActivity
+from rollup import refresh_hourly_uptime
+from utils import get_store_timezones, get_business_hours
+from vectorized import STATUS_CODES
+
+CONTENT_TYPE_NDJSON = 'application/x-ndjson'
+CONTENT_TYPE_CSV = 'text/csv'
+INGEST_CONTENT_TYPES = [CONTENT_TYPE_NDJSON, CONTENT_TYPE_CSV]
+ACTIVITY_FIELDS = ('store_id', 'status', 'timestamp_utc')
+# Rejected rows whose error is returned, the others are only counted
+MAX_REPORTED_ERRORS = 10
+
+
+class IngestError(Exception):
+    """A stream that cannot be ingested at all, such as a CSV stream without its header."""
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse a timestamp such as '2023-01-22 12:09:39.388884 UTC' or any ISO 8601 one into naive UTC."""
+    timestamp = datetime.fromisoformat(value.strip().removesuffix(' UTC'))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def parse_activity(fields: dict) -> dict:
+    """Validate the store_id, status and timestamp_utc of a poll, returns the values to insert."""
+    store_id, status = fields.get('store_id'), fields.get('status')
+    if not isinstance(store_id, (str, int)) or not str(store_id).strip():
+        raise ValueError("store_id is missing")
+    if status not in STATUS_CODES:
+        raise ValueError(f"status must be one of {', '.join(STATUS_CODES)}")
+    if not isinstance(fields.get('timestamp_utc'), str):
+        raise ValueError("timestamp_utc is missing")
+    return {'store_id': str(store_id).strip(), 'status': status,
+            'timestamp_utc': parse_timestamp(fields['timestamp_utc'])}
+
+
+async def iter_lines(chunks):
+    """Split a stream of byte chunks into lines as they arrive."""
+    pending = b''
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def parse_activities(chunks, content_type: str):
+    """Yield (activity, error) for every non blank line of an NDJSON or CSV stream of polls.
+
+    CSV streams start with a header naming the store_id, status and timestamp_utc columns, in any order.
+    """
+    header = None
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        line = line.decode('utf-8', errors='replace').strip()
+        if not line:
+            continue
+
+        try:
+            if content_type == CONTENT_TYPE_NDJSON:
+                fields = json.loads(line)
+                if not isinstance(fields, dict):
+                    raise ValueError("expected a JSON object")
+            elif header is None:
+                header = next(csv.reader([line]))
+                missing = [field for field in ACTIVITY_FIELDS if field not in header]
+                if missing:
+                    raise IngestError(f"The CSV header is missing {', '.join(missing)}.")
+                continue
+            else:
+                fields = dict(zip(header, next(csv.reader([line]))))
+            yield parse_activity(fields), None
+        except ValueError as e:
+            yield None, f"line {line_number}: {e}"
+
+
+def refresh_rollups(db, activities: list):
+    """Recompute the hourly rollups of the hours the polls of a batch fall in, within its transaction."""
+    store_ids = list({activity['store_id'] for activity in activities})
+    business_hours = get_business_hours(db, get_store_timezones(db, store_ids), store_ids)
+    refresh_hourly_uptime(db, [(activity['store_id'], activity['timestamp_utc']) for activity in activities],
+                          business_hours)
+
+
+async def write_batches(db: AsyncSession, batches: asyncio.Queue):
+    """Insert and commit the batches of a queue until it yields None.
+
+    Every batch is a single executemany of a Core INSERT, compiled once and sent with the parameters of
+    the whole batch, and is committed on its own so that the batches written before a failure stay ingested.
+    Polls already stored are skipped, a batch can be sent again after a failure.
+    """
+    statement = None
+    while True:
+        activities = await batches.get()
+        if activities is None:
+            return
+        connection = await db.connection()
+        if statement is None:
+            statement = insert_ignoring_duplicates(StoreActivity.__table__, connection.dialect.name)
+        await connection.execute(statement, activities)
+        if INGEST_REFRESH_ROLLUPS:
+            await db.run_sync(refresh_rollups, activities)
+        await db.commit()
+
+
+async def put_batch(batches: asyncio.Queue, writer: asyncio.Task, activities):
+    """Queue a batch for the writer, waiting while INGEST_MAX_PENDING_BATCHES batches are pending.
+
+    While it waits the request body is not read, so a client faster than the database is slowed down
+    by TCP flow control. Raises the error of the writer if it failed.
+    """
+    put = asyncio.ensure_future(batches.put(activities))
+    await asyncio.wait({put, writer}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+    if writer.done():
+        writer.result()
+
+
+async def ingest_activities(db: AsyncSession, chunks, content_type: str, batch_size: int = INGEST_BATCH_SIZE) -> dict:
+    """Ingest a stream of polls in batches of batch_size, returns the accepted and rejected rows of every batch.
+
+    Parsing the stream overlaps with writing the previous batches.
+    """
+    batches = asyncio.Queue(maxsize=INGEST_MAX_PENDING_BATCHES)
+    writer = asyncio.ensure_future(write_batches(db, batches))
+    results, errors = [], []
+    activities, rejected = [], 0
+
+    async def flush():
+        nonlocal activities, rejected
+        if activities:
+            await put_batch(batches, writer, activities)
+        results.append({'accepted': len(activities), 'rejected': rejected})
+        activities, rejected = [], 0
+
+    try:
+        async for activity, error in parse_activities(chunks, content_type):
+            if error is not None:
+                rejected += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(error)
+                continue
+
+            activities.append(activity)
+            if len(activities) >= batch_size:
+                await flush()
+
+        if activities or rejected:
+            await flush()
+        await put_batch(batches, writer, None)
+        await writer
+    finally:
+        if not writer.done():
+            writer.cancel()
+
+    return {
+        'accepted': sum(result['accepted'] for result in results),
+        'rejected': sum(result['rejected'] for result in results),
+        'batches': results,
+        'errors': errors
+    }
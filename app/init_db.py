@@ -1,4 +1,4 @@
 from db import engine, Base
-from models import Report, StoreTimezone, StoreBusinessHour, StoreActivity
+from models import Report, ReportFile, StoreTimezone, StoreBusinessHour, StoreActivity, StoreHourlyUptime
 
 Base.metadata.create_all(bind=engine)
@@ -0,0 +1,292 @@
+import os
+import json
+import mmap
+import uuid
+import struct
+import logging
+from collections import defaultdict
+from datetime import time
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from config import METADATA_SNAPSHOT_FILEPATH
+from constants import FULL_DAY
+from business_hour_index import CompiledBusinessHours, to_weekly_intervals
+from models import StoreBusinessHour, StoreTimezone
+from store_filter import StoreFilter
+
+logger = logging.getLogger(__name__)
+
+# Start of a snapshot file, followed by the length of its JSON header and the header
+SNAPSHOT_MAGIC = b'STOREMETA\x00\x02\x00'
+HEADER_LENGTH = struct.Struct('<Q')
+# Offset of every array in the file is a multiple of ARRAY_ALIGNMENT bytes
+ARRAY_ALIGNMENT = 64
+
+# Snapshot mapped by this process as ((path, device, inode, mtime) of its file, MetadataSnapshot)
+loaded_snapshot = None
+
+
+def get_metadata_version(db: Session) -> list:
+    """Get the version stamp of store_timezones and store_business_hours: their row count and highest id.
+
+    Imports only add rows and deduplication deletes some, either changes the stamp.
+    """
+    return list(db.execute(select(
+        select(func.count()).select_from(StoreTimezone).scalar_subquery(),
+        select(func.max(StoreTimezone.id)).scalar_subquery(),
+        select(func.count()).select_from(StoreBusinessHour).scalar_subquery(),
+        select(func.max(StoreBusinessHour.id)).scalar_subquery()
+    )).one())
+
+
+def to_microseconds(value: time) -> int:
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 10 ** 6 + value.microsecond
+
+
+def to_time(microseconds: int) -> time:
+    seconds, microsecond = divmod(microseconds, 10 ** 6)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return time(hour, minute, second, microsecond)
+
+
+def align(size: int) -> int:
+    """Round a size up to a multiple of ARRAY_ALIGNMENT."""
+    return -(-size // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+def write_snapshot_file(filepath: str, header: dict, arrays: dict):
+    """Write a snapshot file: the magic, the JSON header and the arrays, with their dtype, shape and offset.
+
+    The file is written next to filepath and renamed over it, processes that mapped the previous snapshot
+    keep reading it until they map the new one.
+    """
+    specs = {}
+    offset = 0
+    for name, array in arrays.items():
+        specs[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += align(array.nbytes)
+    header_bytes = json.dumps({**header, 'arrays': specs}).encode()
+    data_start = align(len(SNAPSHOT_MAGIC) + HEADER_LENGTH.size + len(header_bytes))
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temporary_filepath = f'{filepath}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(temporary_filepath, 'wb') as file:
+            file.write(SNAPSHOT_MAGIC + HEADER_LENGTH.pack(len(header_bytes)) + header_bytes)
+            for name, array in arrays.items():
+                file.seek(data_start + specs[name]['offset'])
+                file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate(data_start + offset)
+        os.replace(temporary_filepath, filepath)
+    finally:
+        if os.path.exists(temporary_filepath):
+            os.remove(temporary_filepath)
+
+
+class MetadataSnapshot:
+    """Timezones and weekly business hours of every store, memory-mapped from a snapshot file.
+
+    Stores are sorted by store_id. The ranges of day d of the store at index i are
+    range_starts[day_offsets[7 * i + d]:day_offsets[7 * i + d + 1]], and range_ends alike, in microseconds
+    since local midnight. full_day marks the stores open 24*7, which have no business hours. The sorted weekly
+    intervals of the store at index i, compiled by to_weekly_intervals and open 24*7 for those of full_day, are
+    week_opens[week_offsets[i]:week_offsets[i + 1]] and week_closes alike.
+    """
+
+    def __init__(self, filepath: str = METADATA_SNAPSHOT_FILEPATH):
+        with open(filepath, 'rb') as file:
+            # The mapping stays valid once the file is closed, and is shared by every process mapping the file
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{filepath} is not a metadata snapshot of this version.")
+        header_start = len(SNAPSHOT_MAGIC) + HEADER_LENGTH.size
+        (header_length,) = HEADER_LENGTH.unpack_from(self.mmap, len(SNAPSHOT_MAGIC))
+        header = json.loads(self.mmap[header_start:header_start + header_length])
+        data_start = align(header_start + header_length)
+
+        self.version = header['version']
+        self.timezones = header['timezones']
+        arrays = {
+            name: np.frombuffer(self.mmap, dtype=spec['dtype'], count=int(np.prod(spec['shape'])),
+                                offset=data_start + spec['offset']).reshape(spec['shape'])
+            for name, spec in header['arrays'].items()
+        }
+        self.store_ids = arrays['store_ids']
+        self.timezone_index = arrays['timezone_index']
+        self.full_day = arrays['full_day']
+        self.day_offsets = arrays['day_offsets']
+        self.range_starts = arrays['range_starts']
+        self.range_ends = arrays['range_ends']
+        self.week_offsets = arrays['week_offsets']
+        self.week_opens = arrays['week_opens']
+        self.week_closes = arrays['week_closes']
+        # Local times of the ranges by their microseconds, few distinct times are shared by all the stores
+        self.times = {microseconds: to_time(microseconds) for microseconds in
+                      np.unique(np.concatenate([self.range_starts, self.range_ends])).tolist()}
+
+    def __len__(self) -> int:
+        return len(self.store_ids)
+
+    def select_stores(self, store_ids: list = None, stores: StoreFilter = None) -> np.ndarray:
+        """Get the indexes of the given or filtered stores, as selected by the queries of the store tables."""
+        selected = np.ones(len(self.store_ids), dtype=bool)
+        for selected_ids in (store_ids, stores.store_ids if stores else None):
+            if selected_ids is not None:
+                selected &= np.isin(self.store_ids, np.array([store_id.encode() for store_id in selected_ids],
+                                                              dtype=bytes))
+        if stores and (stores.timezones or stores.regions):
+            timezones = [index for index, timezone_str in enumerate(self.timezones)
+                         if stores.matches_timezone(timezone_str)]
+            selected &= np.isin(self.timezone_index, timezones)
+        return np.flatnonzero(selected)
+
+    def get_store_timezones(self, store_ids: list = None, stores: StoreFilter = None) -> dict:
+        """Get the timezone of every store, as get_store_timezones reads them from store_timezones."""
+        indexes = self.select_stores(store_ids, stores)
+        return {store_id.decode(): self.timezones[timezone_index] for store_id, timezone_index in
+                zip(self.store_ids[indexes].tolist(), self.timezone_index[indexes].tolist())}
+
+    def get_store_hours(self, index: int) -> dict:
+        """Get the business hours of the store at index, as get_business_hours builds those of a store."""
+        store_hours = defaultdict(list)
+        store_hours['timezone'] = self.timezones[self.timezone_index[index]]
+        if self.full_day[index]:
+            # If the business hour for a store is not mentioned, it is assumed to be open 24*7
+            for day_of_week in range(7):
+                store_hours[day_of_week] = FULL_DAY
+            return store_hours
+
+        for day_of_week in range(7):
+            start, end = self.day_offsets[7 * index + day_of_week], self.day_offsets[7 * index + day_of_week + 1]
+            if start < end:
+                store_hours[day_of_week] = [
+                    [self.times[start_time], self.times[end_time]] for start_time, end_time in
+                    zip(self.range_starts[start:end].tolist(), self.range_ends[start:end].tolist())
+                ]
+        return store_hours
+
+    def get_business_hours(self, store_ids: list = None, stores: StoreFilter = None) -> 'SnapshotBusinessHours':
+        """Get the business hours of every store, as get_business_hours builds them from store_business_hours."""
+        return SnapshotBusinessHours(self, self.select_stores(store_ids, stores))
+
+
+class SnapshotBusinessHours(CompiledBusinessHours):
+    """Business hours of the selected stores of a snapshot, the ranges of a store are only read once it is looked up.
+
+    The mapping is read only, the reference engine sorts a copy of it. BusinessHourIndex expands the weekly
+    intervals of the snapshot instead of the ranges.
+    """
+
+    def __init__(self, snapshot: MetadataSnapshot, indexes: np.ndarray):
+        self.snapshot = snapshot
+        self.indexes = indexes
+        self.positions = {store_id.decode(): index for store_id, index in
+                          zip(snapshot.store_ids[indexes].tolist(), indexes.tolist())}
+        self.store_hours = {}
+
+    def __getitem__(self, store_id: str) -> dict:
+        if store_id not in self.store_hours:
+            self.store_hours[store_id] = self.snapshot.get_store_hours(self.positions[store_id])
+        return self.store_hours[store_id]
+
+    def __contains__(self, store_id) -> bool:
+        return store_id in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def get_weekly_intervals(self) -> tuple:
+        snapshot = self.snapshot
+        starts, ends = snapshot.week_offsets[self.indexes], snapshot.week_offsets[self.indexes + 1]
+        offsets = np.concatenate([[0], np.cumsum(ends - starts)])
+        # The positions of the intervals of the selected stores in the arrays of the snapshot
+        positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], ends - starts)
+        return (list(self.positions), snapshot.timezones, snapshot.timezone_index[self.indexes], offsets,
+                snapshot.week_opens[positions], snapshot.week_closes[positions])
+
+
+def build_metadata_snapshot(db: Session, version: list = None,
+                            filepath: str = METADATA_SNAPSHOT_FILEPATH) -> MetadataSnapshot:
+    """Write the snapshot of store_timezones and store_business_hours, returns it once mapped.
+
+    The version stamp is read before the rows, a snapshot is never older than its stamp.
+    """
+    version = version or get_metadata_version(db)
+    store_timezones = dict(db.execute(
+        select(StoreTimezone.store_id, StoreTimezone.timezone_str).order_by(StoreTimezone.id)).all())
+    store_ranges = defaultdict(lambda: [[] for _ in range(7)])
+    for store_id, day_of_week, start_time, end_time in db.execute(select(
+            StoreBusinessHour.store_id, StoreBusinessHour.day_of_week, StoreBusinessHour.start_time_local,
+            StoreBusinessHour.end_time_local).order_by(StoreBusinessHour.id)):
+        # Only the business hours of stores with a timezone are kept
+        if store_timezones.get(store_id):
+            store_ranges[store_id][day_of_week].append((to_microseconds(start_time), to_microseconds(end_time)))
+
+    store_ids = sorted(store_timezones)
+    timezones = sorted(set(store_timezones.values()))
+    timezone_indexes = {timezone_str: index for index, timezone_str in enumerate(timezones)}
+    day_offsets = [0]
+    ranges = []
+    week_offsets = [0]
+    week_intervals = []
+    full_day = [[(to_microseconds(start), to_microseconds(end)) for start, end in FULL_DAY]] * 7
+    for store_id in store_ids:
+        for day_ranges in store_ranges.get(store_id, [[]] * 7):
+            ranges.extend(day_ranges)
+            day_offsets.append(len(ranges))
+        # The weekly intervals BusinessHourIndex expands, those of a store without business hours are open 24*7
+        week_intervals.extend(to_weekly_intervals(store_ranges.get(store_id, full_day)))
+        week_offsets.append(len(week_intervals))
+
+    arrays = {
+        'store_ids': np.array([store_id.encode() for store_id in store_ids], dtype=bytes),
+        'timezone_index': np.array([timezone_indexes[store_timezones[store_id]] for store_id in store_ids],
+                                   dtype=np.int32),
+        'full_day': np.array([store_id not in store_ranges for store_id in store_ids], dtype=bool),
+        'day_offsets': np.array(day_offsets, dtype=np.int64),
+        'range_starts': np.array([start for start, _ in ranges], dtype=np.int64),
+        'range_ends': np.array([end for _, end in ranges], dtype=np.int64),
+        'week_offsets': np.array(week_offsets, dtype=np.int64),
+        'week_opens': np.array([open_time for open_time, _ in week_intervals], dtype=np.int64),
+        'week_closes': np.array([close_time for _, close_time in week_intervals], dtype=np.int64),
+    }
+    write_snapshot_file(filepath, {'version': version, 'timezones': timezones}, arrays)
+    logger.info(f"Built the metadata snapshot of {len(store_ids)} stores and {len(ranges)} business hours, "
+                f"version {version}")
+    return open_metadata_snapshot(filepath)
+
+
+def open_metadata_snapshot(filepath: str = METADATA_SNAPSHOT_FILEPATH):
+    """Get the snapshot in filepath, mapped once per process and again when the file is replaced.
+
+    Returns None when there is no readable snapshot.
+    """
+    global loaded_snapshot
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    file_key = (filepath, stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+    if loaded_snapshot is None or loaded_snapshot[0] != file_key:
+        try:
+            loaded_snapshot = (file_key, MetadataSnapshot(filepath))
+        except (OSError, ValueError, KeyError):
+            logger.exception(f"Failed to read the metadata snapshot {filepath}")
+            return None
+    return loaded_snapshot[1]
+
+
+def get_metadata_snapshot(db: Session, filepath: str = METADATA_SNAPSHOT_FILEPATH) -> MetadataSnapshot:
+    """Get the snapshot of the current store metadata, rebuilt when the version stamp of the tables changed."""
+    version = get_metadata_version(db)
+    snapshot = open_metadata_snapshot(filepath)
+    if snapshot is None or snapshot.version != version:
+        snapshot = build_metadata_snapshot(db, version, filepath)
+    return snapshot
@@ -0,0 +1,218 @@
+import os
+import cProfile
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+
+from sqlalchemy import func, select
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+PHASE_LOAD_TIMEZONES = 'load_timezones'
+PHASE_LOAD_BUSINESS_HOURS = 'load_business_hours'
+PHASE_QUERY_ACTIVITIES = 'query_activities'
+PHASE_FILTER_BUSINESS_HOURS = 'filter_business_hours'
+PHASE_INTERPOLATE = 'interpolate'
+PHASE_WRITE_CSV = 'write_csv'
+PHASE_COMMIT = 'commit'
+PHASES = [PHASE_LOAD_TIMEZONES, PHASE_LOAD_BUSINESS_HOURS, PHASE_QUERY_ACTIVITIES, PHASE_FILTER_BUSINESS_HOURS,
+          PHASE_INTERPOLATE, PHASE_WRITE_CSV, PHASE_COMMIT]
+
+COUNTER_ROWS_SCANNED = 'rows_scanned'
+COUNTER_STORES_PROCESSED = 'stores_processed'
+COUNTERS = [COUNTER_ROWS_SCANNED, COUNTER_STORES_PROCESSED]
+
+# Number of allocation sites written to the memory profile of a report
+TRACEMALLOC_TOP = 25
+
+
+def get_worker_peak_rss() -> int:
+    """Get the peak resident set size in bytes of this process and its finished child processes.
+
+    It is the high water mark of the whole life of the worker process, not of a single report: a report only
+    raises it when it takes more memory than any report generated before it by the same worker.
+    """
+    if resource is None:
+        return 0
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class ReportTimings:
+    """Seconds spent in each phase of a report and counters of the work done.
+
+    Phases can be nested, the time of a nested phase is only counted in the nested phase, so that the
+    phase seconds add up to the time measured.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._phases = []
+        self._switched_at = perf_counter()
+
+    def _switch(self):
+        now = perf_counter()
+        if self._phases:
+            self.seconds[self._phases[-1]] += now - self._switched_at
+        self._switched_at = now
+
+    @contextmanager
+    def phase(self, name: str):
+        self._switch()
+        self._phases.append(name)
+        try:
+            yield
+        finally:
+            self._switch()
+            self._phases.pop()
+
+    def count(self, counter: str, value: int = 1):
+        self.counters[counter] += value
+
+    def merge(self, timings: dict):
+        """Add the timings of another process, as returned by as_dict."""
+        for name, seconds in timings['phases'].items():
+            self.seconds[name] += seconds
+        for counter in COUNTERS:
+            self.counters[counter] += timings.get(counter, 0)
+
+    def as_dict(self) -> dict:
+        return {
+            'phases': {name: round(self.seconds[name], 6) for name in PHASES if name in self.seconds},
+            **{counter: self.counters[counter] for counter in COUNTERS},
+            'worker_peak_rss_bytes': get_worker_peak_rss()
+        }
+
+
+# Timings of the report being generated in this process, None outside of collect_timings
+current_timings = None
+
+
+@contextmanager
+def collect_timings():
+    """Collect the phases and counters recorded by the report generated within the block."""
+    global current_timings
+    previous, current_timings = current_timings, ReportTimings()
+    try:
+        yield current_timings
+    finally:
+        current_timings = previous
+
+
+@contextmanager
+def phase(name: str):
+    """Time a phase of the report being generated, a no-op outside of collect_timings."""
+    if current_timings is None:
+        yield
+        return
+    with current_timings.phase(name):
+        yield
+
+
+def count(counter: str, value: int = 1):
+    if current_timings is not None:
+        current_timings.count(counter, value)
+
+
+def merge(timings: dict):
+    """Add the timings collected by another process to those of the report being generated."""
+    if current_timings is not None:
+        current_timings.merge(timings)
+
+
+def timed(iterable, name: str, counter: str = None):
+    """Iterate over iterable, counting the time spent producing every item in the phase name.
+
+    With a counter every item produced is also counted.
+    """
+    if current_timings is None:
+        yield from iterable
+        return
+
+    iterator = iter(iterable)
+    while True:
+        with current_timings.phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        if counter is not None:
+            current_timings.count(counter)
+        yield item
+
+
+@contextmanager
+def profile_report(report_id, folder: str):
+    """Profile the CPU time and memory allocations of a report into folder.
+
+    The cProfile stats are written to report_<id>.prof, to be read with pstats or snakeviz, and the
+    allocation sites holding the most memory to report_<id>_memory.txt.
+    """
+    os.makedirs(folder, exist_ok=True)
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(os.path.join(folder, f'report_{report_id}.prof'))
+        with open(os.path.join(folder, f'report_{report_id}_memory.txt'), mode='w') as memory_file:
+            memory_file.write(f"Traced memory: current {current} bytes, peak {peak} bytes\n\n")
+            for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+                memory_file.write(f"{stat}\n")
+
+
+def get_timings_totals_query(timings):
+    """Core select of the sums of the timings of all reports, and of their highest worker peak RSS.
+
+    timings is the JSON column the timings of the reports are saved in, as returned by ReportTimings.as_dict.
+    The database adds them up, /metrics does not read the timings of every report.
+    """
+    return select(
+        func.coalesce(func.sum(timings['total_seconds'].as_float()), 0).label('total_seconds'),
+        *(func.coalesce(func.sum(timings[('phases', name)].as_float()), 0).label(name) for name in PHASES),
+        *(func.coalesce(func.sum(timings[counter].as_integer()), 0).label(counter) for counter in COUNTERS),
+        func.coalesce(func.max(timings['worker_peak_rss_bytes'].as_integer()), 0).label('worker_peak_rss_bytes')
+    )
+
+
+def format_metrics(status_counts: dict, totals: dict) -> str:
+    """Format report counts by status and the totals of the timings of reports in the Prometheus text format.
+
+    totals holds the columns of get_timings_totals_query.
+    """
+    lines = ['# HELP report_generation_reports Number of reports by status.',
+             '# TYPE report_generation_reports gauge']
+    lines += [f'report_generation_reports{{status="{report_status}"}} {report_count}'
+              for report_status, report_count in sorted(status_counts.items())]
+
+    lines += ['# HELP report_generation_seconds_total Seconds spent generating reports.',
+              '# TYPE report_generation_seconds_total counter',
+              f'report_generation_seconds_total {totals["total_seconds"]}']
+
+    lines += ['# HELP report_generation_phase_seconds_total Seconds spent in each phase of report generation.',
+              '# TYPE report_generation_phase_seconds_total counter']
+    lines += [f'report_generation_phase_seconds_total{{phase="{name}"}} {totals[name]}' for name in PHASES]
+
+    for counter in COUNTERS:
+        lines += [f'# HELP report_generation_{counter}_total Total {counter.replace("_", " ")} by reports.',
+                  f'# TYPE report_generation_{counter}_total counter',
+                  f'report_generation_{counter}_total {totals[counter]}']
+
+    lines += ['# HELP report_worker_peak_rss_bytes Highest peak resident set size of a report worker process '
+              'over its life, measured at the end of its reports.',
+              '# TYPE report_worker_peak_rss_bytes gauge',
+              f'report_worker_peak_rss_bytes {totals["worker_peak_rss_bytes"]}']
+    return '\n'.join(lines) + '\n'
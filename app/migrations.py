@@ -0,0 +1,154 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from db import Base
+from models import StoreActivity
+
+logger = logging.getLogger(__name__)
+
+PARTITION_DAY = 'day'
+PARTITION_WEEK = 'week'
+PARTITION_INTERVALS = {PARTITION_DAY: timedelta(days=1), PARTITION_WEEK: timedelta(weeks=1)}
+PARTITION_PREFIXES = {PARTITION_DAY: 'd', PARTITION_WEEK: 'w'}
+
+# Partitions created ahead of the newest activity, so that new polls never land in the default partition
+PARTITIONS_AHEAD = 4
+
+ACTIVITIES_TABLE = StoreActivity.__tablename__
+# Plain indexes of databases created before the natural keys were unique, replaced by their unique indexes
+REPLACED_INDEXES = ['ix_store_activities_store_id_timestamp_utc', 'ix_store_timezones_store_id']
+
+
+def create_indexes(connection: Connection):
+    """Create the indexes declared on the models that are missing from an existing database."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+            logger.info(f"Index {index.name} is present on {table.name}")
+
+
+def deduplicate(connection: Connection):
+    """Delete the rows repeating the natural key of an earlier row, then make the natural keys unique.
+
+    The unique indexes of the natural keys replace the plain indexes of a database created before them.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if not index.unique or 'id' not in table.c:
+                continue
+            key = ', '.join(column.name for column in index.columns)
+            deleted = connection.execute(text(
+                f"DELETE FROM {table.name} WHERE id NOT IN (SELECT MIN(id) FROM {table.name} GROUP BY {key})"
+            )).rowcount
+            logger.info(f"Deleted {deleted} duplicate rows of ({key}) from {table.name}")
+
+    for name in REPLACED_INDEXES:
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    create_indexes(connection)
+
+
+def floor_partition(timestamp: datetime, interval: str) -> datetime:
+    """Get the start of the partition containing a timestamp, weeks start on Monday."""
+    start = datetime.combine(timestamp.date(), datetime.min.time())
+    if interval == PARTITION_WEEK:
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def get_partition_name(start: datetime, interval: str) -> str:
+    return f'{ACTIVITIES_TABLE}_{PARTITION_PREFIXES[interval]}{start:%Y%m%d}'
+
+
+def create_partitions(connection: Connection, start_time: datetime, end_time: datetime, interval: str):
+    """Create the partitions of store_activities covering start_time to end_time."""
+    partition_start = floor_partition(start_time, interval)
+    while partition_start <= end_time:
+        partition_end = partition_start + PARTITION_INTERVALS[interval]
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {get_partition_name(partition_start, interval)} "
+            f"PARTITION OF {ACTIVITIES_TABLE} "
+            f"FOR VALUES FROM ('{partition_start.isoformat()}') TO ('{partition_end.isoformat()}')"
+        ))
+        partition_start = partition_end
+
+
+def partition_store_activities(connection: Connection, interval: str = PARTITION_WEEK):
+    """Convert store_activities into a table range partitioned on timestamp_utc, PostgreSQL only.
+
+    The existing rows are copied into the new partitions, and a default partition catches polls
+    outside of every partition.
+    """
+    if connection.dialect.name != 'postgresql':
+        raise ValueError("Partitioning store_activities is only supported on PostgreSQL.")
+
+    unpartitioned = f'{ACTIVITIES_TABLE}_unpartitioned'
+    connection.execute(text(f"ALTER TABLE {ACTIVITIES_TABLE} RENAME TO {unpartitioned}"))
+    connection.execute(text(f"ALTER TABLE {unpartitioned} RENAME CONSTRAINT {ACTIVITIES_TABLE}_pkey "
+                            f"TO {unpartitioned}_pkey"))
+    for index in StoreActivity.__table__.indexes:
+        connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    # Keep the id sequence when the old table is dropped
+    connection.execute(text(f"ALTER SEQUENCE {ACTIVITIES_TABLE}_id_seq OWNED BY NONE"))
+
+    # The primary key of a partitioned table has to include the partition key
+    connection.execute(text(
+        f"CREATE TABLE {ACTIVITIES_TABLE} ("
+        f"id INTEGER NOT NULL DEFAULT nextval('{ACTIVITIES_TABLE}_id_seq'), "
+        f"store_id VARCHAR NOT NULL, "
+        f"timestamp_utc TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        f"status VARCHAR NOT NULL, "
+        f"PRIMARY KEY (id, timestamp_utc)"
+        f") PARTITION BY RANGE (timestamp_utc)"
+    ))
+    connection.execute(text(f"ALTER SEQUENCE {ACTIVITIES_TABLE}_id_seq OWNED BY {ACTIVITIES_TABLE}.id"))
+    connection.execute(text(f"CREATE TABLE {ACTIVITIES_TABLE}_default PARTITION OF {ACTIVITIES_TABLE} DEFAULT"))
+
+    oldest, newest = connection.execute(
+        text(f"SELECT MIN(timestamp_utc), MAX(timestamp_utc) FROM {unpartitioned}")
+    ).one()
+    oldest, newest = oldest or datetime.utcnow(), newest or datetime.utcnow()
+    create_partitions(connection, oldest, newest + PARTITIONS_AHEAD * PARTITION_INTERVALS[interval], interval)
+
+    connection.execute(text(
+        f"INSERT INTO {ACTIVITIES_TABLE} (id, store_id, timestamp_utc, status) "
+        f"SELECT id, store_id, timestamp_utc, status FROM {unpartitioned}"
+    ))
+    connection.execute(text(f"DROP TABLE {unpartitioned}"))
+
+    # Indexes created on the partitioned table are created on every partition
+    for index in StoreActivity.__table__.indexes:
+        index.create(connection)
+    logger.info(f"Partitioned {ACTIVITIES_TABLE} by {interval}")
+
+
+def get_partitions(connection: Connection) -> list:
+    """Get the (name, start, end) of the range partitions of store_activities."""
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = :table_name"
+    ), {'table_name': ACTIVITIES_TABLE}).scalars()
+
+    partitions = []
+    for name in names:
+        suffix = name[len(ACTIVITIES_TABLE) + 1:]
+        for interval, prefix in PARTITION_PREFIXES.items():
+            if suffix.startswith(prefix) and suffix[1:].isdigit():
+                start = datetime.strptime(suffix[1:], '%Y%m%d')
+                partitions.append((name, start, start + PARTITION_INTERVALS[interval]))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def drop_expired_partitions(connection: Connection, cutoff: datetime) -> list:
+    """Drop the partitions of store_activities that only hold polls older than cutoff."""
+    dropped = []
+    for name, _, end in get_partitions(connection):
+        if end <= cutoff:
+            connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+            logger.info(f"Dropped partition {name}")
+    return dropped
@@ -2,3 +2,6 @@ from .report import Report
 from .store_activity import StoreActivity
 from .store_business_hour import StoreBusinessHour
 from .store_timezone import StoreTimezone
+from .store_hourly_uptime import StoreHourlyUptime
+from .report_file import ReportFile
+from .stored_file import StoredFile
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, String
+from sqlalchemy import Column, String, DateTime, Integer, JSON
 from sqlalchemy.dialects.postgresql import UUID
 from db import Base
+from datetime import datetime
 import uuid
 
 
@@ -8,4 +9,24 @@ class Report(Base):
     __tablename__ = 'reports'
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
-    status = Column(String, nullable=False)
+    status = Column(String, nullable=False, index=True)
+    engine = Column(String, nullable=True)
+    # Hash of the report time, parameters and data watermark, cleared when evicted from the cache
+    cache_key = Column(String, nullable=True, unique=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Last download of the report, the least recently downloaded reports are evicted from the report store first
+    downloaded_at = Column(DateTime, nullable=True)
+    # Job state of the report worker that generates the report
+    attempts = Column(Integer, nullable=False, default=0)
+    heartbeat_at = Column(DateTime, nullable=True)
+    error = Column(String, nullable=True)
+    # Seconds spent in each phase of the generation, rows scanned, stores processed and peak RSS of the worker
+    timings = Column(JSON, nullable=True)
+    # Mergeable fleet statistics of the rows, see ReportSummary.as_dict
+    summary = Column(JSON, nullable=True)
+    # Report time and StoreFilter of the report, None for every store as of the default report time
+    as_of = Column(DateTime, nullable=True)
+    store_filter = Column(JSON, nullable=True)
+    # Format the report is written in besides CSV, None for CSV only
+    output_format = Column(String, nullable=True)
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from db import Base
+
+
+class ReportFile(Base):
+    __tablename__ = 'report_files'
+    __table_args__ = (
+        Index('uq_report_files_report_id_format', 'report_id', 'format', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    report_id = Column(UUID(as_uuid=True), ForeignKey('reports.id'), nullable=False)
+    # csv, parquet or arrow
+    format = Column(String, nullable=False)
+    # sha256 of the content of the report in the format, reports with the same content share a stored file
+    content_hash = Column(String, nullable=False, index=True)
+    # Bytes of the stored file, compressed at rest
+    size = Column(BigInteger, nullable=False)
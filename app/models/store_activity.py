@@ -1,9 +1,14 @@
 from db import Base
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index
 
 
 class StoreActivity(Base):
     __tablename__ = 'store_activities'
+    __table_args__ = (
+        # Natural key of a poll, imports skip the polls already stored. It serves the per store time range
+        # scans of the report and of get_store_activities_within_interval.
+        Index('uq_store_activities_store_id_timestamp_utc', 'store_id', 'timestamp_utc', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     store_id = Column(String, nullable=False)
@@ -1,13 +1,18 @@
 from db import Base
-from sqlalchemy import Column, Integer, String, Time
+from sqlalchemy import Column, Integer, String, Time, Index
 from datetime import time
 
 
 class StoreBusinessHour(Base):
     __tablename__ = 'store_business_hours'
+    __table_args__ = (
+        # Natural key of a business hour, imports skip the business hours already stored
+        Index('uq_store_business_hours_store_id_day_of_week_times',
+              'store_id', 'day_of_week', 'start_time_local', 'end_time_local', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    store_id = Column(String, nullable=False)
+    store_id = Column(String, nullable=False, index=True)
     day_of_week = Column(Integer, nullable=False)  # 0=Monday, 6=Sunday
     start_time_local = Column(Time, nullable=False, default=time(0, 0, 0))  # Default to 00:00:00
     end_time_local = Column(Time, nullable=False, default=time(23, 59, 59))  # Default to 23:59:59
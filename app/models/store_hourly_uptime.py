@@ -0,0 +1,13 @@
+from db import Base
+from sqlalchemy import Column, String, DateTime, Float, Integer
+
+
+class StoreHourlyUptime(Base):
+    __tablename__ = 'store_hourly_uptime'
+
+    store_id = Column(String, primary_key=True)
+    hour_utc = Column(DateTime, primary_key=True)
+    uptime_seconds = Column(Float, nullable=False, default=0)
+    downtime_seconds = Column(Float, nullable=False, default=0)
+    # Number of polls within business hours in the hour, to tell whether a report window has polls
+    polls = Column(Integer, nullable=False, default=0)
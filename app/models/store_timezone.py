@@ -1,9 +1,13 @@
 from db import Base
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index
 
 
 class StoreTimezone(Base):
     __tablename__ = 'store_timezones'
+    __table_args__ = (
+        # A store has a single timezone, imports keep the first one stored
+        Index('uq_store_timezones_store_id', 'store_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(String, nullable=False)
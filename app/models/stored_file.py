@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, Integer, BigInteger
+from db import Base
+
+
+class StoredFile(Base):
+    __tablename__ = 'stored_files'
+
+    # sha256 of the content and format of a file of the report store, see ReportFile
+    content_hash = Column(String, primary_key=True)
+    format = Column(String, primary_key=True)
+    # Bytes of the stored file, compressed at rest
+    size = Column(BigInteger, nullable=False)
+    # ReportFile rows referring to the file, it is removed with the row when no report refers to it anymore.
+    # Updating the count locks the row, storing and evicting the same content are serialized by it.
+    reference_count = Column(Integer, nullable=False, default=0)
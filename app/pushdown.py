@@ -0,0 +1,216 @@
+from datetime import datetime
+
+from sqlalchemy import (BigInteger, Column, Float, Index, Integer, MetaData, String, Table, and_, case, cast, func,
+                        insert, or_, select)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
+
+from business_hour_index import BusinessHourIndex, to_epoch_us
+from constants import REPORT_WINDOWS
+from metrics import phase, PHASE_LOAD_BUSINESS_HOURS, PHASE_QUERY_ACTIVITIES
+from models import StoreActivity
+from store_filter import StoreFilter
+from vectorized import STATUS_ACTIVE, STATUS_INACTIVE, STATUS_OTHER, format_report_row
+
+# The business hour intervals of the stores of a report, in UTC epoch microseconds. The table is temporary,
+# private to the connection of the report, and is dropped once the report rows are read.
+business_intervals = Table(
+    'report_business_intervals', MetaData(),
+    Column('store_id', String, nullable=False),
+    # Index of the interval among the store's intervals, polls in the same interval are interpolated
+    Column('range_index', Integer, nullable=False),
+    Column('open_us', BigInteger, nullable=False),
+    Column('close_us', BigInteger, nullable=False),
+    Index('ix_report_business_intervals_store_id_open_us', 'store_id', 'open_us'),
+    prefixes=['TEMPORARY']
+)
+
+
+class epoch_us(FunctionElement):
+    """Microseconds since the epoch of a naive UTC DateTime column, as a BIGINT."""
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(epoch_us)
+def compile_epoch_us(element, compiler, **kw):
+    return f"CAST(ROUND(EXTRACT(EPOCH FROM {compiler.process(element.clauses, **kw)}) * 1000000) AS BIGINT)"
+
+
+@compiles(epoch_us, 'sqlite')
+def compile_epoch_us_sqlite(element, compiler, **kw):
+    # SQLite stores DateTime columns as 'YYYY-MM-DD HH:MM:SS.ffffff' strings, strftime only has whole seconds
+    column = compiler.process(element.clauses, **kw)
+    return f"(CAST(strftime('%s', {column}) AS INTEGER) * 1000000 + CAST(substr({column}, 21, 6) AS INTEGER))"
+
+
+def get_report_store_ids(db: Session, start_time: datetime, end_time: datetime, stores: StoreFilter = None) -> list:
+    """Get the ids of the stores with polls between end_time and start_time."""
+    query = select(StoreActivity.store_id).distinct().where(
+        StoreActivity.timestamp_utc >= end_time,
+        StoreActivity.timestamp_utc <= start_time
+    )
+    if stores:
+        query = query.where(*stores.where(StoreActivity.store_id))
+    return db.execute(query).scalars().all()
+
+
+def upload_business_intervals(connection, store_ids: list, start_time: datetime, end_time: datetime,
+                              business_hours: dict):
+    """Fill the temporary business_intervals table with the intervals of the stores overlapping the report window.
+
+    The intervals are compiled by the BusinessHourIndex of the vectorized engine, the only part of the report
+    computed in Python: timezone rules are not available on every database.
+    """
+    business_intervals.drop(connection, checkfirst=True)
+    business_intervals.create(connection)
+
+    business_hour_index = BusinessHourIndex(business_hours, start_time, end_time)
+    window_start, window_end = (int(ts) for ts in to_epoch_us([end_time, start_time]))
+    intervals = []
+    for store_id in store_ids:
+        opens, closes = business_hour_index.get_intervals(store_id)
+        for range_index, (open_us, close_us) in enumerate(zip(opens.tolist(), closes.tolist())):
+            if close_us >= window_start and open_us <= window_end:
+                intervals.append({'store_id': store_id, 'range_index': range_index,
+                                  'open_us': open_us, 'close_us': close_us})
+    if intervals:
+        connection.execute(insert(business_intervals), intervals)
+
+
+def to_hours(duration_us):
+    """Hours of a duration in microseconds, as a double divided like vectorized.to_hours."""
+    return cast(duration_us, Float) / 10 ** 6 / 3600
+
+
+def split_hours(code, status: int, hours):
+    return case((code == status, hours), else_=0.0)
+
+
+def get_window_hours_query(start_time: datetime, end_time: datetime, stores: StoreFilter = None):
+    """Core select of the uptime and downtime hours of every store and report window, computed by the database.
+
+    It is interpolate_store as a query: the polls of every store are located in its business hour intervals
+    by a join, paired with the previous, newer, poll of the store with LAG() and the hours between them added
+    up with a running SUM() in descending order of time. The hours are doubles added in the order of the
+    cumulative sums of the vectorized engine, so that durations of exactly half a unit are rounded the same.
+    Returns the store_id and an uptime and downtime column for every window, with a row per store.
+    """
+    window_ends = [start_time - duration for _, duration, _ in REPORT_WINDOWS[:-1]] + [end_time]
+    start_us, *ends_us = (int(ts) for ts in to_epoch_us([start_time, *window_ends]))
+    intervals = business_intervals.c
+
+    # The interval containing the start time and the end of every window, NULL when closed
+    def containing(ts: int):
+        return func.max(case((and_(intervals.open_us <= ts, intervals.close_us >= ts), intervals.range_index)))
+
+    points = select(
+        intervals.store_id,
+        containing(start_us).label('start_range_index'),
+        *(containing(end_us).label(f'end_range_index_{window}') for window, end_us in enumerate(ends_us))
+    ).group_by(intervals.store_id).cte('points')
+
+    # The polls within business hours, with the interval they are in
+    ts = epoch_us(StoreActivity.timestamp_utc)
+    located = select(
+        StoreActivity.store_id,
+        ts.label('ts'),
+        case((StoreActivity.status == 'active', STATUS_ACTIVE), (StoreActivity.status == 'inactive', STATUS_INACTIVE),
+             else_=STATUS_OTHER).label('code'),
+        intervals.range_index,
+        intervals.open_us,
+        intervals.close_us
+    ).join(business_intervals, and_(
+        intervals.store_id == StoreActivity.store_id,
+        intervals.open_us <= ts,
+        intervals.close_us >= ts
+    )).where(
+        StoreActivity.timestamp_utc >= end_time,
+        StoreActivity.timestamp_utc <= start_time
+    )
+    if stores:
+        located = located.where(*stores.where(StoreActivity.store_id))
+    located = located.cte('located')
+
+    # Every poll with the newer poll before it and the older one after it, in descending order of time
+    store_order = {'partition_by': located.c.store_id, 'order_by': located.c.ts.desc()}
+    paired = select(
+        located,
+        func.lag(located.c.ts).over(**store_order).label('previous_ts'),
+        func.lag(located.c.code).over(**store_order).label('previous_code'),
+        func.lag(located.c.range_index).over(**store_order).label('previous_range_index'),
+        func.lag(located.c.open_us).over(**store_order).label('previous_open_us'),
+        func.lead(located.c.ts).over(**store_order).label('next_ts')
+    ).cte('paired')
+
+    poll = paired.c
+    first = poll.previous_ts.is_(None)
+    # The newest poll is preceded by the start time, with its own status
+    previous_ts = func.coalesce(poll.previous_ts, start_us)
+    previous_code = func.coalesce(poll.previous_code, poll.code)
+    previous_range_index = case((first, func.coalesce(points.c.start_range_index, -1)),
+                                else_=poll.previous_range_index)
+    gap = to_hours(previous_ts - poll.ts)
+    before = case((first, 0.0), else_=to_hours(previous_ts - poll.previous_open_us))
+    after = to_hours(poll.close_us - poll.ts)
+
+    def interpolated(status: int):
+        """The hours in status between a poll and the newer one."""
+        return case(
+            # Polls in the same interval as the newer one: the gap, split in halves if the status changed
+            (and_(previous_range_index == poll.range_index, previous_code != poll.code), gap / 2),
+            (previous_range_index == poll.range_index, split_hours(poll.code, status, gap)),
+            # Otherwise from the open of the newer poll's interval to it, and from the poll to its close
+            else_=split_hours(previous_code, status, before) + split_hours(poll.code, status, after)
+        )
+
+    terms = select(
+        paired,
+        *(points.c[f'end_range_index_{window}'] for window in range(len(ends_us))),
+        interpolated(STATUS_ACTIVE).label('uptime'),
+        interpolated(STATUS_INACTIVE).label('downtime')
+    ).join(points, points.c.store_id == poll.store_id).cte('terms')
+
+    cumulative = {'partition_by': terms.c.store_id, 'order_by': terms.c.ts.desc(), 'rows': (None, 0)}
+    running = select(
+        terms,
+        func.sum(terms.c.uptime).over(**cumulative).label('running_uptime'),
+        func.sum(terms.c.downtime).over(**cumulative).label('running_downtime')
+    ).cte('running')
+
+    poll = running.c
+    window_columns = []
+    for window, end_us in enumerate(ends_us):
+        # The hours up to the oldest poll within the window, plus those from the window end to it
+        oldest = and_(poll.ts >= end_us, or_(poll.next_ts.is_(None), poll.next_ts < end_us))
+        final = case((poll.range_index == func.coalesce(poll[f'end_range_index_{window}'], -1),
+                      to_hours(poll.ts - end_us)), else_=to_hours(poll.ts - poll.open_us))
+        for status, running_hours in ((STATUS_ACTIVE, poll.running_uptime), (STATUS_INACTIVE, poll.running_downtime)):
+            hours = func.coalesce(func.max(case((oldest, running_hours + split_hours(poll.code, status, final)))), 0.0)
+            if window < len(ends_us) - 1:
+                # Like generate_csv, a window is only interpolated once a poll older than the window is seen
+                hours = case((func.min(poll.ts) < end_us, hours), else_=0.0)
+            window_columns.append(hours)
+
+    return select(poll.store_id, *window_columns).group_by(poll.store_id).order_by(poll.store_id)
+
+
+def compute_pushdown_rows(db: Session, start_time: datetime, end_time: datetime, business_hours: dict,
+                          stores: StoreFilter = None) -> list:
+    """Get the CSV rows of the stores with polls within their business hours, computed in the database.
+
+    Only the business hour intervals are sent to the database and a row per store is read back, instead of
+    every poll of the week. The rows match those of the vectorized engine.
+    """
+    connection = db.connection()
+    with phase(PHASE_LOAD_BUSINESS_HOURS):
+        store_ids = get_report_store_ids(db, start_time, end_time, stores)
+        upload_business_intervals(connection, store_ids, start_time, end_time, business_hours)
+
+    with phase(PHASE_QUERY_ACTIVITIES):
+        results = connection.execute(get_window_hours_query(start_time, end_time, stores)).all()
+    # Left behind on failure, a failed report is rolled back and the next one drops it first
+    business_intervals.drop(connection)
+
+    return [format_report_row(store_id, list(zip(hours[::2], hours[1::2]))) for store_id, *hours in results]
@@ -0,0 +1,93 @@
+import json
+import hashlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import REPORT_CACHE_TTL, REPORT_CACHE_SIZE
+from constants import STATUS_QUEUED, STATUS_RUNNING, STATUS_COMPLETED, STATUS_FAILED
+from models import Report, StoreActivity, StoreBusinessHour, StoreTimezone
+from report_store import report_files_exist
+
+
+async def get_data_watermark(db: AsyncSession) -> dict:
+    """Get the highest id of every table a report is computed from, they only grow with ingestion."""
+    return {
+        model.__tablename__: await db.scalar(select(func.max(model.id)))
+        for model in (StoreActivity, StoreBusinessHour, StoreTimezone)
+    }
+
+
+async def get_report_cache_key(db: AsyncSession, as_of: datetime, parameters: dict) -> str:
+    """Hash the report time, the report parameters and the data watermark into a cache key."""
+    key = {'as_of': as_of.isoformat(), 'parameters': parameters, 'watermark': await get_data_watermark(db)}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def evict_report_cache(db: AsyncSession):
+    """Remove the expired and the least recently requested finished reports from the cache.
+
+    Evicted reports keep their rows and files, they are only no longer reused. Queued and running reports
+    stay cached however old they are, requests for them attach to them instead of queueing duplicates.
+    """
+    finished = Report.status.in_((STATUS_COMPLETED, STATUS_FAILED))
+    expired_before = datetime.utcnow() - timedelta(seconds=REPORT_CACHE_TTL)
+    await db.execute(update(Report).where(
+        Report.cache_key.isnot(None), finished, Report.created_at < expired_before
+    ).values(cache_key=None))
+
+    least_recently_used = (await db.scalars(select(Report.id).where(Report.cache_key.isnot(None), finished).order_by(
+        Report.last_accessed_at.desc()).offset(REPORT_CACHE_SIZE))).all()
+    if least_recently_used:
+        await db.execute(update(Report).where(Report.id.in_(least_recently_used)).values(cache_key=None))
+    await db.commit()
+
+
+async def find_cached_report(db: AsyncSession, cache_key: str):
+    """Get the queued, running or completed report with a cache key, or None."""
+    report = await db.scalar(select(Report).where(Report.cache_key == cache_key))
+    if report is None:
+        return None
+
+    if report.status in (STATUS_QUEUED, STATUS_RUNNING) or (
+            report.status == STATUS_COMPLETED and await report_files_exist(db, report)):
+        report.last_accessed_at = datetime.utcnow()
+        await db.commit()
+        return report
+
+    # A failed, cancelled or evicted report, or a completed one whose files are gone, is recomputed
+    report.cache_key = None
+    await db.commit()
+    return None
+
+
+async def get_or_create_report(db: AsyncSession, cache_key: str, engine: str, as_of: datetime = None,
+                               store_filter: dict = None, output_format: str = None) -> tuple:
+    """Get the cached report with a cache key or queue a new one, returns (report, created).
+
+    as_of, store_filter and output_format are saved on a new report for the report worker.
+
+    Concurrent requests with the same key all get the same report: the unique cache key lets a
+    single insert win, the others attach to the report it created.
+    """
+    await evict_report_cache(db)
+
+    report = await find_cached_report(db, cache_key)
+    if report is not None:
+        return report, False
+
+    report = Report(status=STATUS_QUEUED, engine=engine, cache_key=cache_key, as_of=as_of,
+                    store_filter=store_filter, output_format=output_format)
+    db.add(report)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        report = await find_cached_report(db, cache_key)
+        if report is None:
+            raise
+        return report, False
+
+    return report, True
@@ -0,0 +1,173 @@
+import os
+import csv
+import gzip
+import uuid
+
+from constants import (REPORT_FOLDER, REPORT_FILENAME, REPORT_CSV_HEADER, FORMAT_CSV, FORMAT_CSV_GZIP, FORMAT_PARQUET,
+                       FORMAT_ARROW, REPORT_FORMATS)
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    # The columnar formats are optional, pip install pyarrow
+    pa = None
+
+COLUMNAR_FORMATS = [FORMAT_PARQUET, FORMAT_ARROW]
+MEDIA_TYPE_CSV = 'text/csv'
+MEDIA_TYPE_PARQUET = 'application/vnd.apache.parquet'
+MEDIA_TYPE_ARROW = 'application/vnd.apache.arrow.file'
+# The media type a format is served as, a gzip compressed CSV is a CSV with a gzip content encoding
+MEDIA_TYPES = {FORMAT_PARQUET: MEDIA_TYPE_PARQUET, FORMAT_ARROW: MEDIA_TYPE_ARROW, FORMAT_CSV: MEDIA_TYPE_CSV}
+ENCODING_GZIP = 'gzip'
+# Rows of a record batch of the columnar formats, and of the rows written to the gzip compressed CSV at a time
+RECORD_BATCH_ROWS = 10000
+
+
+def get_report_filepath(report_id: uuid.UUID, report_format: str = FORMAT_CSV) -> str:
+    """Get the path of the file a report is written to in a format, store_activity_report_<id>.<format>.
+
+    The files are moved into the report store once the report is complete.
+    """
+    csv_filename = REPORT_FILENAME.format(report_id)
+    return os.path.join(REPORT_FOLDER, f'{os.path.splitext(csv_filename)[0]}.{report_format}')
+
+
+def remove_report_files(report_id: uuid.UUID):
+    """Remove the files a report is written to in every format."""
+    for report_format in REPORT_FORMATS:
+        filepath = get_report_filepath(report_id, report_format)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+def get_report_schema():
+    """Arrow schema of the report, the store_id and an int64 column for every uptime and downtime."""
+    store_id, *columns = REPORT_CSV_HEADER
+    return pa.schema([(store_id, pa.string())] + [(column, pa.int64()) for column in columns])
+
+
+class ReportWriter:
+    """Writes the rows of a report to its CSV file, a gzip compressed copy of it and the file of its output format.
+
+    The CSV file is line buffered so that clients following the report get every row as soon as it is computed.
+    The rows are also collected into batches of RECORD_BATCH_ROWS written to the gzip compressed CSV, kept in the
+    report store once the report is complete, and as record batches to the file of a parquet or arrow output
+    format, so that a report is compressed and converted once, as it is generated.
+    """
+
+    def __init__(self, report_id: uuid.UUID, report_format: str = FORMAT_CSV):
+        if report_format in COLUMNAR_FORMATS and pa is None:
+            raise ValueError(f"The {report_format} format requires pyarrow.")
+        os.makedirs(REPORT_FOLDER, exist_ok=True)
+
+        self.csvfile = open(get_report_filepath(report_id), mode='w', newline='', buffering=1)
+        self.csv_writer = csv.writer(self.csvfile)
+        self.csv_writer.writerow(REPORT_CSV_HEADER)
+
+        self.batch = []
+        self.gzip_file = gzip.open(get_report_filepath(report_id, FORMAT_CSV_GZIP), mode='wt', newline='',
+                                   compresslevel=6)
+        self.gzip_writer = csv.writer(self.gzip_file)
+        self.gzip_writer.writerow(REPORT_CSV_HEADER)
+
+        self.columnar_writer = None
+        output_filepath = get_report_filepath(report_id, report_format)
+        if report_format == FORMAT_PARQUET:
+            self.columnar_writer = pa.parquet.ParquetWriter(output_filepath, get_report_schema(), compression='zstd')
+        elif report_format == FORMAT_ARROW:
+            self.columnar_writer = pa.ipc.new_file(output_filepath, get_report_schema(),
+                                                   options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    def write_row(self, row: list):
+        self.csv_writer.writerow(row)
+        self.batch.append(row)
+        if len(self.batch) >= RECORD_BATCH_ROWS:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def flush(self):
+        """Write the collected rows to the gzip compressed CSV and to the file of the output format."""
+        if not self.batch:
+            return
+        self.gzip_writer.writerows(self.batch)
+        if self.columnar_writer is not None:
+            schema = get_report_schema()
+            # The rows of the sharded report are read back from CSV part files, their numbers are strings
+            columns = [pa.array(values).cast(field.type) for values, field in zip(zip(*self.batch), schema)]
+            self.columnar_writer.write_batch(pa.record_batch(columns, schema=schema))
+        self.batch = []
+
+    def close(self):
+        try:
+            self.flush()
+            if self.columnar_writer is not None:
+                self.columnar_writer.close()
+        finally:
+            self.gzip_file.close()
+            self.csvfile.close()
+
+    def __enter__(self) -> 'ReportWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_quality_values(header: str) -> dict:
+    """Parse an Accept or Accept-Encoding header into a dictionary of its lowercased values and their q values."""
+    quality_values = {}
+    for item in (header or '').split(','):
+        value, *parameters = [part.strip() for part in item.split(';')]
+        if not value:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            name, _, number = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        quality_values[value.lower()] = quality
+    return quality_values
+
+
+def get_media_type_quality(accept: dict, media_type: str) -> float:
+    """Get the q value of a media type in a parsed Accept header, from its most specific matching range."""
+    main_type = media_type.split('/')[0]
+    for media_range in (media_type, f'{main_type}/*', '*/*'):
+        if media_range in accept:
+            return accept[media_range]
+    return 0.0
+
+
+def get_served_formats(report_format: str) -> list:
+    """Get the formats a report written in report_format can be served in, its own output format first."""
+    return [FORMAT_CSV] if report_format in (FORMAT_CSV, FORMAT_CSV_GZIP) else [report_format, FORMAT_CSV]
+
+
+def negotiate_report_format(accept_header: str, report_format: str) -> str:
+    """Choose the format a report is served in from the Accept header, returns None if none is acceptable.
+
+    Without an Accept header, or between formats accepted as much, the report's own output format is preferred.
+    """
+    available = get_served_formats(report_format)
+    if not accept_header:
+        return available[0]
+
+    accept = parse_quality_values(accept_header)
+    # max keeps the first of the formats accepted as much
+    quality, chosen = max(((get_media_type_quality(accept, MEDIA_TYPES[available_format]), available_format)
+                           for available_format in available), key=lambda item: item[0])
+    return chosen if quality > 0 else None
+
+
+def accepts_gzip(accept_encoding_header: str) -> bool:
+    """Check if an Accept-Encoding header accepts gzip."""
+    accept_encoding = parse_quality_values(accept_encoding_header)
+    return accept_encoding.get(ENCODING_GZIP, accept_encoding.get('*', 0.0)) > 0
@@ -0,0 +1,198 @@
+import os
+import gzip
+import uuid
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import REPORT_STORE_MAX_BYTES, REPORT_STORE_MAX_AGE
+from constants import (REPORT_STORE_FOLDER, FORMAT_CSV, FORMAT_CSV_GZIP, FORMAT_PARQUET, FORMAT_ARROW, STATUS_COMPLETED,
+                       STATUS_EVICTED)
+from db import dialect_insert
+from models import Report, ReportFile, StoredFile
+from report_output import COLUMNAR_FORMATS, get_report_filepath
+
+logger = logging.getLogger(__name__)
+
+# Extension of the stored file of every format, CSV files are compressed at rest
+STORED_EXTENSIONS = {FORMAT_CSV: 'csv.gz', FORMAT_PARQUET: 'parquet', FORMAT_ARROW: 'arrow'}
+# Bytes read from a file at a time when hashing or decompressing it
+READ_SIZE = 1024 * 1024
+
+
+def get_stored_filepath(content_hash: str, report_format: str) -> str:
+    """Get the path of the stored file of a content, in a folder named after the first two digits of its hash."""
+    return os.path.join(REPORT_STORE_FOLDER, content_hash[:2], f'{content_hash}.{STORED_EXTENSIONS[report_format]}')
+
+
+def hash_file(filepath: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        while data := file.read(READ_SIZE):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def store_file(db: Session, report_id: uuid.UUID, report_format: str, content_filepath: str, filepath: str,
+               moved_filepaths: list) -> ReportFile:
+    """Add a reference to the stored file of a content, moving filepath into the store unless it is stored already.
+
+    content_filepath holds the content the file is addressed by, the uncompressed CSV of a gzip compressed one.
+    The reference count of the stored file is incremented first, which locks its row until the session is
+    committed: an eviction of the same content either removed the file before, and filepath is moved in, or
+    waits for the commit and finds the file referenced. filepath is left in place when the content is already
+    stored, it is only removed once the reference is committed. The path of a file moved in is appended to
+    moved_filepaths, to be removed by discard_stored_files when the session is rolled back.
+    """
+    content_hash = hash_file(content_filepath)
+    stored_filepath = get_stored_filepath(content_hash, report_format)
+    statement = dialect_insert(StoredFile.__table__, db.get_bind().dialect.name).values(
+        content_hash=content_hash, format=report_format, size=os.path.getsize(filepath), reference_count=1)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[StoredFile.content_hash, StoredFile.format],
+        set_={'reference_count': StoredFile.__table__.c.reference_count + 1}))
+    if not os.path.exists(stored_filepath):
+        os.makedirs(os.path.dirname(stored_filepath), exist_ok=True)
+        os.replace(filepath, stored_filepath)
+        moved_filepaths.append(stored_filepath)
+    return ReportFile(report_id=report_id, format=report_format, content_hash=content_hash,
+                      size=os.path.getsize(stored_filepath))
+
+
+def store_report(db: Session, report_id: uuid.UUID, output_format: str, moved_filepaths: list):
+    """Move the files written by a ReportWriter into the store and add their ReportFile rows to the session.
+
+    The gzip compressed CSV is stored under the hash of the CSV and the file of a columnar output format under
+    its own hash. The rows are committed with the completed status of the report, the files written by the
+    ReportWriter that were not moved are removed by remove_report_files after that. The paths of the files
+    moved into the store are appended to moved_filepaths as soon as they are moved.
+    """
+    csv_filepath = get_report_filepath(report_id)
+    report_files = [store_file(db, report_id, FORMAT_CSV, csv_filepath,
+                               get_report_filepath(report_id, FORMAT_CSV_GZIP), moved_filepaths)]
+    if output_format in COLUMNAR_FORMATS:
+        output_filepath = get_report_filepath(report_id, output_format)
+        report_files.append(store_file(db, report_id, output_format, output_filepath, output_filepath,
+                                       moved_filepaths))
+
+    db.add_all(report_files)
+
+
+def discard_stored_files(moved_filepaths: list):
+    """Remove the files moved into the store by a session that is about to be rolled back.
+
+    Their StoredFile rows are still locked by the session, a report storing the same content meanwhile waits
+    for the rollback and then moves its own copy in, so the files are removed before the rollback.
+    """
+    for stored_filepath in moved_filepaths:
+        if os.path.exists(stored_filepath):
+            os.remove(stored_filepath)
+    moved_filepaths.clear()
+
+
+def release_report_files(db: Session, report_id: uuid.UUID) -> int:
+    """Delete the ReportFile rows of a report and remove its stored files no other report refers to.
+
+    The reference count of every stored file is decremented in the transaction of the session, which locks its
+    row, and a file is removed before the transaction is committed, while it is locked: a report storing the
+    same content meanwhile waits for the commit and then moves its own copy in. Returns the bytes removed.
+    """
+    stored_files = StoredFile.__table__.c
+    removed_size = 0
+    for report_file in db.query(ReportFile).filter(ReportFile.report_id == report_id).all():
+        db.delete(report_file)
+        key = (stored_files.content_hash == report_file.content_hash, stored_files.format == report_file.format)
+        stored_file = db.execute(update(StoredFile.__table__).where(*key).values(
+            reference_count=stored_files.reference_count - 1).returning(stored_files.reference_count,
+                                                                         stored_files.size)).first()
+        if stored_file is None or stored_file.reference_count > 0:
+            continue
+
+        stored_filepath = get_stored_filepath(report_file.content_hash, report_file.format)
+        if os.path.exists(stored_filepath):
+            os.remove(stored_filepath)
+        db.execute(delete(StoredFile.__table__).where(*key))
+        removed_size += stored_file.size
+    return removed_size
+
+
+def evict_reports(db: Session, keep_report_id: uuid.UUID = None) -> list:
+    """Evict completed reports from the store until it is within REPORT_STORE_MAX_AGE and REPORT_STORE_MAX_BYTES.
+
+    Reports are evicted from the least recently downloaded, or generated when never downloaded, and only while
+    they are older than REPORT_STORE_MAX_AGE or the stored files take more than REPORT_STORE_MAX_BYTES. A file
+    shared by several reports is counted once and removed with the last of them. Evicted reports lose their
+    ReportFile rows and cache key and are marked as evicted, keep_report_id is never evicted. Every report is
+    evicted in its own transaction. Returns the ids of the evicted reports.
+    """
+    last_used = func.coalesce(Report.downloaded_at, Report.created_at)
+    candidates = db.query(Report.id, last_used).filter(
+        Report.status == STATUS_COMPLETED, Report.id.in_(select(ReportFile.report_id))
+    ).order_by(last_used, Report.id).all()
+    total_size = db.scalar(select(func.coalesce(func.sum(StoredFile.size), 0)))
+
+    expired_before = datetime.utcnow() - timedelta(seconds=REPORT_STORE_MAX_AGE)
+    evicted = []
+    # Ordered from the least recently used
+    for report_id, report_last_used in candidates:
+        if report_last_used >= expired_before and total_size <= REPORT_STORE_MAX_BYTES:
+            break
+        if report_id == keep_report_id:
+            continue
+
+        # Only evicted while still completed, the update locks the report against a concurrent eviction
+        if not db.query(Report).filter(Report.id == report_id, Report.status == STATUS_COMPLETED).update(
+                {Report.status: STATUS_EVICTED, Report.cache_key: None}, synchronize_session=False):
+            db.rollback()
+            continue
+        total_size -= release_report_files(db, report_id)
+        db.commit()
+        evicted.append(report_id)
+
+    if evicted:
+        logger.info(f"Evicted {len(evicted)} reports from the report store, {total_size} bytes are stored")
+    return evicted
+
+
+def delete_report_files(db: Session, report_id: uuid.UUID):
+    """Delete the ReportFile rows of a report, and its stored files no other report refers to."""
+    release_report_files(db, report_id)
+    db.commit()
+
+
+async def get_report_files(db: AsyncSession, report_id: uuid.UUID) -> dict:
+    """Get the ReportFile of every format of a report."""
+    report_files = await db.scalars(select(ReportFile).where(ReportFile.report_id == report_id))
+    return {report_file.format: report_file for report_file in report_files}
+
+
+async def report_files_exist(db: AsyncSession, report: Report) -> bool:
+    """Check that the stored files of a completed report, its CSV and its output format, are all present."""
+    report_files = await get_report_files(db, report.id)
+    formats = [FORMAT_CSV] + [report.output_format] if report.output_format in COLUMNAR_FORMATS else [FORMAT_CSV]
+    return all(report_format in report_files and os.path.exists(
+        get_stored_filepath(report_files[report_format].content_hash, report_format)) for report_format in formats)
+
+
+def read_stored_csv(stored_filepath: str, position: int = 0):
+    """Yield the uncompressed content of a stored CSV from a position, READ_SIZE bytes at a time."""
+    with gzip.open(stored_filepath, 'rb') as csvfile:
+        csvfile.seek(position)
+        while data := csvfile.read(READ_SIZE):
+            yield data
+
+
+def get_etag(content_hash: str, encoding: str = None) -> str:
+    """Get the strong ETag of a stored content, different for every content encoding it is served with."""
+    return f'"{content_hash}-{encoding}"' if encoding else f'"{content_hash}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Check if an If-None-Match header matches an ETag, with the weak comparison it uses."""
+    if if_none_match.strip() == '*':
+        return True
+    return etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
@@ -0,0 +1,85 @@
+import os
+import asyncio
+import uuid
+
+from sqlalchemy import select
+
+from async_db import AsyncSessionLocal
+from config import REPORT_FOLLOW_INTERVAL
+from constants import STATUS_QUEUED, STATUS_RUNNING, STATUS_COMPLETED, FORMAT_CSV
+from models import Report, ReportFile
+from report_store import get_stored_filepath, read_stored_csv
+
+# Bytes read from the report file at a time
+READ_SIZE = 64 * 1024
+
+
+class ReportStreamError(Exception):
+    """The followed report failed, was cancelled or restarted, the stream is cut short."""
+
+
+async def get_report_status(report_id: uuid.UUID) -> str:
+    # A session per check, the session of the request is closed once the response starts
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(Report.status).where(Report.id == report_id))
+
+
+async def get_stored_csv_filepath(report_id: uuid.UUID) -> str:
+    async with AsyncSessionLocal() as db:
+        content_hash = await db.scalar(select(ReportFile.content_hash).where(
+            ReportFile.report_id == report_id, ReportFile.format == FORMAT_CSV))
+    return content_hash and get_stored_filepath(content_hash, FORMAT_CSV)
+
+
+def read_report_csv(csv_filepath: str, position: int):
+    """Yield the content of the CSV a report is being written to from a position, nothing once it is moved away."""
+    try:
+        with open(csv_filepath, 'rb') as csvfile:
+            csvfile.seek(position)
+            while data := csvfile.read(READ_SIZE):
+                yield data
+    except FileNotFoundError:
+        # Moved into the report store right before the report is completed
+        return
+
+
+async def follow_report_csv(report_id: uuid.UUID, csv_filepath: str, interval: float = REPORT_FOLLOW_INTERVAL):
+    """Yield the rows of a report CSV as they are written, until the report is completed.
+
+    Only whole lines are sent, the partial last line of the file is kept until it is completed. Raises
+    ReportStreamError when the report does not complete, so that the client sees an aborted response
+    instead of a truncated report.
+    """
+    position = 0
+    pending = b''
+    while True:
+        # Checked before reading, everything written before completion is read below
+        report_status = await get_report_status(report_id)
+        if report_status not in (STATUS_QUEUED, STATUS_RUNNING, STATUS_COMPLETED):
+            raise ReportStreamError(f"Report {report_id} is {report_status}.")
+
+        if report_status == STATUS_COMPLETED:
+            # The CSV is moved into the report store before the report is completed, the rest is read from there
+            stored_filepath = await get_stored_csv_filepath(report_id)
+            if not stored_filepath or not os.path.exists(stored_filepath):
+                raise ReportStreamError(f"The file of report {report_id} was not found.")
+            chunks = read_stored_csv(stored_filepath, position)
+        elif os.path.exists(csv_filepath) and os.path.getsize(csv_filepath) < position:
+            # A retried report writes its file again from the start
+            raise ReportStreamError(f"Report {report_id} was restarted.")
+        else:
+            chunks = read_report_csv(csv_filepath, position)
+
+        for data in chunks:
+            position += len(data)
+            pending += data
+            lines_end = pending.rfind(b'\n') + 1
+            if lines_end:
+                yield pending[:lines_end]
+                pending = pending[lines_end:]
+
+        if report_status == STATUS_COMPLETED:
+            if pending:
+                yield pending
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,126 @@
+import math
+from collections import defaultdict
+
+from config import REPORT_SLA_UPTIME
+from constants import DEFAULT_TIMEZONE, REPORT_WINDOWS, WINDOW_UNITS
+
+# Percentiles of the uptime of every window served by /get_report_summary
+SUMMARY_PERCENTILES = [50, 95, 99]
+
+
+def get_histogram_size(window_index: int) -> int:
+    """Get the number of bins of the uptime histogram of a window, one per unit of its duration and one for 0.
+
+    Report values are whole units, so the histogram holds them exactly. Values above the duration of the
+    window are counted in its last bin.
+    """
+    _, duration, unit = REPORT_WINDOWS[window_index]
+    return round(duration.total_seconds() / 3600 * WINDOW_UNITS[unit]) + 1
+
+
+def get_store_timezone(business_hours: dict, store_id: str) -> str:
+    """Get the timezone of a store in its business hours, stores without a timezone are in DEFAULT_TIMEZONE."""
+    return (business_hours.get(store_id) or {}).get('timezone') or DEFAULT_TIMEZONE
+
+
+class ReportSummary:
+    """Fleet statistics of a report, updated with every row as it is written.
+
+    For every window it keeps a histogram of the uptime of the stores and the count of stores whose uptime is
+    below sla_uptime of the time they were observed, and for every timezone the count of stores with their
+    total uptime and downtime per window. Summaries of shards of stores are added up with merge.
+    """
+
+    def __init__(self, sla_uptime: float = REPORT_SLA_UPTIME):
+        self.sla_uptime = sla_uptime
+        self.stores = 0
+        self.histograms = [[0] * get_histogram_size(index) for index in range(len(REPORT_WINDOWS))]
+        self.below_sla = [0] * len(REPORT_WINDOWS)
+        self.timezones = defaultdict(lambda: {'stores': 0, 'uptime': [0] * len(REPORT_WINDOWS),
+                                              'downtime': [0] * len(REPORT_WINDOWS)})
+
+    def add(self, row: list, timezone_str: str):
+        """Add the CSV row of a store, its store_id followed by the uptime and downtime of every window."""
+        self.stores += 1
+        timezone_totals = self.timezones[timezone_str]
+        timezone_totals['stores'] += 1
+        for index, histogram in enumerate(self.histograms):
+            uptime, downtime = int(row[1 + 2 * index]), int(row[2 + 2 * index])
+            histogram[min(max(uptime, 0), len(histogram) - 1)] += 1
+            if uptime + downtime and uptime < self.sla_uptime * (uptime + downtime):
+                self.below_sla[index] += 1
+            timezone_totals['uptime'][index] += uptime
+            timezone_totals['downtime'][index] += downtime
+
+    def merge(self, summary: dict):
+        """Add the summary of another shard of stores, as returned by as_dict."""
+        self.stores += summary['stores']
+        for index, window in enumerate(summary['windows']):
+            self.histograms[index] = [count + other for count, other in
+                                      zip(self.histograms[index], window['histogram'])]
+            self.below_sla[index] += window['below_sla']
+        for timezone_str, totals in summary['timezones'].items():
+            timezone_totals = self.timezones[timezone_str]
+            timezone_totals['stores'] += totals['stores']
+            for column in ('uptime', 'downtime'):
+                timezone_totals[column] = [value + other for value, other in
+                                           zip(timezone_totals[column], totals[column])]
+
+    def as_dict(self) -> dict:
+        """Get the summary as saved on the report, it can be merged into another summary."""
+        return {
+            'stores': self.stores,
+            'sla_uptime': self.sla_uptime,
+            'windows': [{'histogram': histogram, 'below_sla': below_sla}
+                        for histogram, below_sla in zip(self.histograms, self.below_sla)],
+            'timezones': {timezone_str: totals for timezone_str, totals in sorted(self.timezones.items())}
+        }
+
+
+def summarize_rows(rows, summary: ReportSummary, business_hours: dict):
+    """Yield the rows of a report, adding each one to summary with the timezone of its store."""
+    for row in rows:
+        summary.add(row, get_store_timezone(business_hours, row[0]))
+        yield row
+
+
+def get_percentile(histogram: list, percentile: float) -> int:
+    """Get the nearest-rank percentile of the values counted in a histogram of whole units, None when empty."""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = max(math.ceil(percentile / 100 * total), 1)
+    cumulative = 0
+    for value, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= rank:
+            return value
+
+
+def format_report_summary(summary: dict) -> dict:
+    """Format a saved summary for /get_report_summary, with the uptime percentiles and totals of every window.
+
+    The histograms have a fixed number of bins, formatting does not depend on the number of stores.
+    """
+    windows = {}
+    for (name, _, unit), window in zip(REPORT_WINDOWS, summary['windows']):
+        windows[name] = {
+            'unit': unit,
+            'uptime_percentiles': {f'p{percentile}': get_percentile(window['histogram'], percentile)
+                                   for percentile in SUMMARY_PERCENTILES},
+            'stores_below_sla': window['below_sla']
+        }
+
+    timezones = {}
+    for timezone_str, totals in summary['timezones'].items():
+        timezones[timezone_str] = {'stores': totals['stores']}
+        for (name, _, unit), uptime, downtime in zip(REPORT_WINDOWS, totals['uptime'], totals['downtime']):
+            timezones[timezone_str][f'uptime_{name}({unit})'] = uptime
+            timezones[timezone_str][f'downtime_{name}({unit})'] = downtime
+
+    return {
+        'stores': summary['stores'],
+        'sla_uptime': summary['sla_uptime'],
+        'windows': windows,
+        'timezones': timezones
+    }
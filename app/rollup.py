@@ -0,0 +1,351 @@
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import (Column, DateTime, Index, MetaData, String, Table, and_, bindparam, case, delete, func, insert,
+                        select)
+
+from db import Session
+from models import StoreActivity, StoreHourlyUptime
+from store_filter import StoreFilter
+from constants import ACTIVITY_BATCH_SIZE, REPORT_WINDOWS, WINDOW_UNITS
+from business_hour_index import (BusinessHourIndex, expand_store_hours, get_store_schedule, locate_intervals,
+                                 to_epoch_us)
+from vectorized import STATUS_ACTIVE, STATUS_INACTIVE, encode_statuses, group_by_store
+
+HOUR_US = 3600 * 10 ** 6
+
+# The ranges of UTC time whose raw polls a rollup report reads, by store. The table is temporary, private to the
+# connection of the report, and is dropped once the polls are read.
+edge_ranges = Table(
+    'report_rollup_edge_ranges', MetaData(),
+    Column('store_id', String, nullable=False),
+    Column('lower_utc', DateTime, nullable=False),
+    Column('upper_utc', DateTime, nullable=False),
+    Index('ix_report_rollup_edge_ranges_store_id_lower_utc', 'store_id', 'lower_utc'),
+    prefixes=['TEMPORARY']
+)
+
+
+def floor_hour(ts: int) -> int:
+    return ts - ts % HOUR_US
+
+
+def ceil_hour(ts: int) -> int:
+    return floor_hour(ts + HOUR_US - 1)
+
+
+def to_datetime(ts: int) -> datetime:
+    """Convert epoch microseconds to a naive UTC datetime."""
+    return np.datetime64(int(ts), 'us').item()
+
+
+def status_segments(ts: np.ndarray, codes: np.ndarray, opens: np.ndarray, closes: np.ndarray) -> tuple:
+    """Split the business hour intervals containing polls into segments with the status of the nearest poll.
+
+    ts must be ascending. Within an interval the status changes halfway between polls, the first and
+    last polls extend to the open and close of the interval, intervals without polls have no status.
+    Returns the sorted, non overlapping (starts, ends, codes) of the segments.
+    """
+    index = locate_intervals(opens, closes, ts)
+    inside = index >= 0
+    ts, codes, index = ts[inside], codes[inside], index[inside]
+    if not len(ts):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.uint8)
+
+    midpoints = (ts[:-1] + ts[1:]) // 2
+    new_interval = index[1:] != index[:-1]
+    first = np.concatenate([[True], new_interval])
+    last = np.concatenate([new_interval, [True]])
+    starts = np.where(first, opens[index], np.concatenate([[0], midpoints]))
+    ends = np.where(last, closes[index], np.concatenate([midpoints, [0]]))
+    return starts, ends, codes
+
+
+def cumulative_durations(segments: tuple, points: np.ndarray) -> tuple:
+    """Get the uptime, downtime and total time covered by the segments before each point, in microseconds."""
+    starts, ends, codes = segments
+    if not len(starts):
+        zeros = np.zeros(len(points))
+        return zeros, zeros, zeros
+
+    lengths = ends - starts
+    index = np.searchsorted(starts, points, side='right') - 1
+    segment = np.maximum(index, 0)
+    partial = np.clip(points - starts[segment], 0, lengths[segment])
+
+    durations = []
+    for weights in (codes == STATUS_ACTIVE, codes == STATUS_INACTIVE, np.ones(len(codes), dtype=bool)):
+        before = np.concatenate([[0], np.cumsum(lengths * weights)])
+        durations.append(np.where(index >= 0, before[segment] + partial * weights[segment], 0))
+    return tuple(durations)
+
+
+def compute_hourly_rows(store_id: str, ts: np.ndarray, statuses: list, opens: np.ndarray, closes: np.ndarray,
+                        first_hour: int, last_hour: int) -> list:
+    """Compute the rollup rows of a store for the hours from first_hour up to last_hour.
+
+    ts and statuses are the polls of the store in ascending order, they must include every poll of
+    the business hour intervals overlapping these hours. Only hours with a known status or a poll get a row.
+    """
+    if not len(ts):
+        return []
+
+    codes = encode_statuses(statuses)
+    hours = np.arange(first_hour, last_hour + HOUR_US, HOUR_US)
+    uptime, downtime, covered = cumulative_durations(status_segments(ts, codes, opens, closes), hours)
+    # Number of polls within business hours in every hour
+    inside = locate_intervals(opens, closes, ts) >= 0
+    polls = np.diff(np.searchsorted(ts[inside], hours, side='left'))
+
+    rows = []
+    for i in np.flatnonzero((np.diff(covered) > 0) | (polls > 0)):
+        rows.append({
+            'store_id': store_id,
+            'hour_utc': to_datetime(hours[i]),
+            'uptime_seconds': float(uptime[i + 1] - uptime[i]) / 10 ** 6,
+            'downtime_seconds': float(downtime[i + 1] - downtime[i]) / 10 ** 6,
+            'polls': int(polls[i]),
+        })
+    return rows
+
+
+def refresh_hourly_uptime(db: Session, activities, business_hours: dict):
+    """Recompute the rollup rows of the hours affected by newly ingested (store_id, timestamp_utc) polls.
+
+    Every hour overlapping a business hour interval that received a poll is rewritten, the caller commits.
+    The polls of all the stores are read with a single query over the union of their ranges, and the
+    rewritten hours are deleted and inserted with one executemany each.
+    """
+    timestamps = defaultdict(list)
+    for store_id, timestamp_utc in activities:
+        timestamps[store_id].append(timestamp_utc)
+
+    # (store_id, opens, closes, first_hour, last_hour, first_poll, last_poll) of every store to recompute
+    stale = []
+    for store_id, store_timestamps in timestamps.items():
+        store_hours = get_store_schedule(store_id, business_hours)
+        opens, closes = expand_store_hours(store_hours, min(store_timestamps), max(store_timestamps))
+        index = locate_intervals(opens, closes, to_epoch_us(store_timestamps))
+        index = index[index >= 0]
+        if not len(index):
+            continue
+
+        first_hour, last_hour = floor_hour(opens[index.min()]), ceil_hour(closes[index.max()])
+        # The polls of every interval overlapping the hours are needed to recompute them
+        overlapping = (opens <= last_hour) & (closes >= first_hour)
+        stale.append((store_id, opens, closes, first_hour, last_hour,
+                      opens[overlapping].min(), closes[overlapping].max()))
+    if not stale:
+        return
+
+    polls = db.execute(select(StoreActivity.store_id, StoreActivity.timestamp_utc, StoreActivity.status).where(
+        StoreActivity.store_id.in_([store_id for store_id, *_ in stale]),
+        StoreActivity.timestamp_utc >= to_datetime(min(first_poll for *_, first_poll, _ in stale)),
+        StoreActivity.timestamp_utc <= to_datetime(max(last_poll for *_, last_poll in stale))
+    ).order_by(StoreActivity.store_id, StoreActivity.timestamp_utc))
+    polls = dict(group_by_store(polls))
+
+    rows = []
+    for store_id, opens, closes, first_hour, last_hour, first_poll, last_poll in stale:
+        store_polls = polls.get(store_id, [])
+        store_ts = to_epoch_us([poll.timestamp_utc for poll in store_polls])
+        first = int(np.searchsorted(store_ts, first_poll, side='left'))
+        last = int(np.searchsorted(store_ts, last_poll, side='right'))
+        rows.extend(compute_hourly_rows(
+            store_id, store_ts[first:last], [poll.status for poll in store_polls[first:last]],
+            opens, closes, first_hour, last_hour))
+
+    table = StoreHourlyUptime.__table__
+    db.connection().execute(delete(table).where(
+        table.c.store_id == bindparam('stale_store_id'),
+        table.c.hour_utc >= bindparam('first_hour'),
+        table.c.hour_utc < bindparam('last_hour')
+    ), [{'stale_store_id': store_id, 'first_hour': to_datetime(first_hour), 'last_hour': to_datetime(last_hour)}
+        for store_id, _, _, first_hour, last_hour, _, _ in stale])
+    if rows:
+        db.connection().execute(insert(table), rows)
+
+
+def backfill_hourly_uptime(db: Session, business_hours: dict, batch_size: int = ACTIVITY_BATCH_SIZE):
+    """Rebuild the whole rollup table from the raw polls, store by store.
+
+    The table is dropped and created again, so that it has the columns of the current model.
+    """
+    # The polls are streamed from db, the rows are written through a separate session so
+    # that committing does not close the server side cursor. SQLite locks out a second connection
+    # while the polls are read, there the rows are written through db and committed once.
+    sqlite = db.get_bind().dialect.name == 'sqlite'
+    writer = db if sqlite else Session()
+    try:
+        StoreHourlyUptime.__table__.drop(writer.connection(), checkfirst=True)
+        StoreHourlyUptime.__table__.create(writer.connection())
+        activities = db.query(StoreActivity.store_id, StoreActivity.timestamp_utc, StoreActivity.status).order_by(
+            StoreActivity.store_id, StoreActivity.timestamp_utc).yield_per(batch_size)
+
+        rows = []
+        for store_id, store_activities in group_by_store(activities):
+            timestamps = [activity.timestamp_utc for activity in store_activities]
+            opens, closes = expand_store_hours(
+                get_store_schedule(store_id, business_hours), timestamps[0], timestamps[-1])
+            if not len(opens):
+                continue
+
+            rows.extend(compute_hourly_rows(
+                store_id, to_epoch_us(timestamps), [activity.status for activity in store_activities],
+                opens, closes, floor_hour(opens[0]), ceil_hour(closes[-1])))
+            if len(rows) >= batch_size:
+                writer.execute(insert(StoreHourlyUptime), rows)
+                if not sqlite:
+                    writer.commit()
+                rows = []
+
+        if rows:
+            writer.execute(insert(StoreHourlyUptime), rows)
+        writer.commit()
+    finally:
+        if writer is not db:
+            writer.close()
+
+
+def get_edge_intervals(opens: np.ndarray, closes: np.ndarray, lower: int, upper: int) -> np.ndarray:
+    """Get the mask of the business hour intervals overlapping the window from lower to upper but not within its
+    whole hours, their rollups count polls outside the window or they overlap the partial hours at its edges.
+    """
+    overlapping = (opens <= upper) & (closes >= lower)
+    return overlapping & ((opens < ceil_hour(lower)) | (closes > floor_hour(upper)))
+
+
+def merge_ranges(ranges: list) -> list:
+    """Merge overlapping (lower, upper) ranges into sorted, disjoint ranges."""
+    merged = []
+    for lower, upper in sorted(ranges):
+        if merged and lower <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], upper)
+        else:
+            merged.append([lower, upper])
+    return merged
+
+
+def read_range_polls(connection, store_ranges: dict) -> dict:
+    """Get the polls of every store within its ranges of epoch microseconds, by store_id.
+
+    The ranges of a store must be disjoint. The ranges are written to the temporary edge_ranges table and joined to
+    the polls, so that only the polls of every store within its own ranges are read. Returns the ascending
+    (ts, statuses) of the polls of every store.
+    """
+    edge_ranges.drop(connection, checkfirst=True)
+    edge_ranges.create(connection)
+    rows = [{'store_id': store_id, 'lower_utc': to_datetime(lower), 'upper_utc': to_datetime(upper)}
+            for store_id, ranges in store_ranges.items() for lower, upper in ranges]
+    if rows:
+        connection.execute(insert(edge_ranges), rows)
+
+    polls = connection.execute(select(
+        StoreActivity.store_id, StoreActivity.timestamp_utc, StoreActivity.status
+    ).join(edge_ranges, and_(
+        edge_ranges.c.store_id == StoreActivity.store_id,
+        StoreActivity.timestamp_utc >= edge_ranges.c.lower_utc,
+        StoreActivity.timestamp_utc <= edge_ranges.c.upper_utc
+    )).order_by(StoreActivity.store_id, StoreActivity.timestamp_utc))
+    store_polls = {store_id: (to_epoch_us([poll.timestamp_utc for poll in store_activities]),
+                              [poll.status for poll in store_activities])
+                   for store_id, store_activities in group_by_store(polls)}
+    # Left behind on failure, a failed report is rolled back and the next one drops it first
+    edge_ranges.drop(connection)
+    return store_polls
+
+
+def compute_rollup_rows(db: Session, start_time: datetime, end_time: datetime, business_hours: dict,
+                        stores: StoreFilter = None):
+    """Yield the CSV report rows from the hourly rollups, optionally only of the filtered stores.
+
+    The whole hours of every window are summed in a single aggregate query. The business hour intervals crossing
+    the edges of a window are interpolated from their raw polls instead, the way the vectorized engine does with
+    only the polls within the window, and the raw polls of the partial hours at the edges of the windows are
+    counted with those of the whole hours to tell whether a window has polls, as the vectorized engine does.
+    """
+    as_of, week_start = (int(ts) for ts in to_epoch_us([start_time, end_time]))
+    # The start of every window, the longest one starts at end_time
+    window_starts = [int(ts) for ts in to_epoch_us(
+        [start_time - duration for _, duration, _ in REPORT_WINDOWS[:-1]] + [end_time])]
+    last_hour = floor_hour(as_of)
+
+    def sum_hours(column, first_hour: int, end_hour: int):
+        """Sum column over the whole hours from first_hour up to end_hour."""
+        in_hours = and_(StoreHourlyUptime.hour_utc >= to_datetime(first_hour),
+                        StoreHourlyUptime.hour_utc < to_datetime(end_hour))
+        return func.sum(case((in_hours, column), else_=0))
+
+    columns = []
+    for window_start in window_starts:
+        columns.append(sum_hours(StoreHourlyUptime.uptime_seconds, ceil_hour(window_start), last_hour))
+        columns.append(sum_hours(StoreHourlyUptime.downtime_seconds, ceil_hour(window_start), last_hour))
+    # The polls of the whole hours of the week, and of those before the start of every shorter window
+    columns.append(sum_hours(StoreHourlyUptime.polls, ceil_hour(week_start), last_hour))
+    columns += [sum_hours(StoreHourlyUptime.polls, ceil_hour(week_start), floor_hour(window_start))
+                for window_start in window_starts[:-1]]
+
+    # Only the stores with polls in the hours of the week have a row
+    hourly = db.query(StoreHourlyUptime.store_id, *columns).filter(
+        StoreHourlyUptime.hour_utc >= to_datetime(floor_hour(week_start)),
+        StoreHourlyUptime.hour_utc <= to_datetime(last_hour),
+        *(stores.where(StoreHourlyUptime.store_id) if stores else [])
+    ).group_by(StoreHourlyUptime.store_id).having(func.sum(StoreHourlyUptime.polls) > 0)
+    sums = {store_id: store_sums for store_id, *store_sums in hourly}
+
+    # The raw polls of the intervals at the edges of the windows and of the partial hours at their edges
+    business_hour_index = BusinessHourIndex(business_hours, start_time, end_time)
+    partial_hours = [(floor_hour(ts), ceil_hour(ts)) for ts in [*window_starts, as_of]]
+    store_ranges = {}
+    for store_id in sums:
+        opens, closes = business_hour_index.get_intervals(store_id)
+        edges = np.zeros(len(opens), dtype=bool)
+        for window_start in window_starts:
+            edges |= get_edge_intervals(opens, closes, window_start, as_of)
+        store_ranges[store_id] = merge_ranges(partial_hours + list(zip(opens[edges].tolist(), closes[edges].tolist())))
+    polls = read_range_polls(db.connection(), store_ranges)
+
+    empty = (np.empty(0, dtype=np.int64), [])
+    for store_id in sorted(sums):
+        opens, closes = business_hour_index.get_intervals(store_id)
+        ts, statuses = polls.get(store_id, empty)
+        codes = encode_statuses(statuses)
+        located = locate_intervals(opens, closes, ts)
+        inside_ts = ts[located >= 0]
+
+        def count_polls(lower: int, upper: int) -> int:
+            """Count the raw polls within business hours from lower up to upper, excluded."""
+            return int(np.searchsorted(inside_ts, upper, side='left') - np.searchsorted(inside_ts, lower, side='left'))
+
+        window_sums = sums[store_id][:2 * len(window_starts)]
+        week_polls, *older_polls = sums[store_id][2 * len(window_starts):]
+        # The polls of the partial hours at the edges of the week, up to the start time included
+        week_start_polls = count_polls(week_start, ceil_hour(week_start))
+        if not week_polls + week_start_polls + count_polls(last_hour, as_of + 1):
+            continue
+
+        row = [store_id]
+        for window, (window_start, (_, _, unit)) in enumerate(zip(window_starts, REPORT_WINDOWS)):
+            if window < len(older_polls) and not (older_polls[window] + week_start_polls +
+                                                  count_polls(floor_hour(window_start), window_start)):
+                # Like generate_csv, a window is only interpolated once a poll older than the window is seen
+                row += [0, 0]
+                continue
+
+            edges = np.isin(located, np.flatnonzero(get_edge_intervals(opens, closes, window_start, as_of)))
+            in_window = edges & (ts >= window_start) & (ts <= as_of)
+            # The edge intervals interpolated from their polls within the window, replacing their summed hours
+            uptime, downtime, _ = cumulative_durations(
+                status_segments(ts[in_window], codes[in_window], opens, closes), np.array([window_start, as_of]))
+            summed_uptime, summed_downtime, _ = cumulative_durations(
+                status_segments(ts[edges], codes[edges], opens, closes),
+                np.array([ceil_hour(window_start), max(ceil_hour(window_start), last_hour)]))
+
+            seconds_per_unit = 3600 / WINDOW_UNITS[unit]
+            window_uptime = window_sums[2 * window] + (np.diff(uptime)[0] - np.diff(summed_uptime)[0]) / 10 ** 6
+            window_downtime = (window_sums[2 * window + 1] +
+                               (np.diff(downtime)[0] - np.diff(summed_downtime)[0]) / 10 ** 6)
+            row += [round(window_uptime / seconds_per_unit), round(window_downtime / seconds_per_unit)]
+        yield row
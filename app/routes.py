@@ -1,13 +1,30 @@
-from fastapi import APIRouter, status, Depends, BackgroundTasks
-from constants import REPORT_FOLDER, STATUS_RUNNING, STATUS_COMPLETED
-from dependencies import get_db
+from fastapi import APIRouter, status, Depends, Request, Header
+from constants import (STATUS_QUEUED, STATUS_RUNNING, STATUS_COMPLETED, STATUS_CANCELLED, DEFAULT_ENGINE,
+                       REPORT_ENGINES, APPROXIMATE_REPORT_ENGINES, REPORT_WINDOWS, WINDOW_UNITS, REPORT_FORMATS,
+                       DEFAULT_REPORT_FORMAT, FORMAT_CSV, FORMAT_CSV_GZIP, DOWNLOADED_AT_RESOLUTION)
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from dependencies import get_db, get_async_db
 from db import Session
 from fastapi.exceptions import HTTPException
 from models import Report
-from schemas import ReportId
+from schemas import ReportId, ReportRequest
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, StreamingResponse, Response
+from starlette.concurrency import iterate_in_threadpool
 import uuid
-from fastapi.responses import JSONResponse, FileResponse
-from utils import generate_report
+from utils import get_report_time_range
+from report_cache import get_report_cache_key, get_or_create_report
+from metrics import format_metrics, get_timings_totals_query
+from store_uptime import get_store_uptime
+from store_filter import StoreFilter
+from ingestion import INGEST_CONTENT_TYPES, IngestError, ingest_activities
+from report_stream import follow_report_csv
+from metadata_snapshot import build_metadata_snapshot
+from report_summary import format_report_summary
+from report_output import (COLUMNAR_FORMATS, MEDIA_TYPES, ENCODING_GZIP, pa, get_report_filepath, get_served_formats,
+                           negotiate_report_format, accepts_gzip)
+from report_store import get_report_files, get_stored_filepath, read_stored_csv, get_etag, etag_matches
+from datetime import datetime, timezone
 import os
 
 app_router = APIRouter(
@@ -16,48 +33,251 @@ app_router = APIRouter(
 
 
 @app_router.post("/trigger_report", status_code=status.HTTP_200_OK)
-async def trigger_report(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    report_id = uuid.uuid4()
-    new_report = Report(id=report_id, status=STATUS_RUNNING)
-    db.add(new_report)
-    db.commit()
-    db.refresh(new_report)
+async def trigger_report(engine: str = DEFAULT_ENGINE, output_format: str = DEFAULT_REPORT_FORMAT,
+                         report_request: ReportRequest = None, db: AsyncSession = Depends(get_async_db)):
+    if engine not in REPORT_ENGINES + APPROXIMATE_REPORT_ENGINES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid engine. Must be one of {', '.join(REPORT_ENGINES + APPROXIMATE_REPORT_ENGINES)}."
+        )
+    if output_format not in REPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid output format. Must be one of {', '.join(REPORT_FORMATS)}."
+        )
+    if output_format == FORMAT_CSV_GZIP:
+        # Every CSV report is stored gzip compressed, csv.gz is another name for csv
+        output_format = FORMAT_CSV
+    if output_format in COLUMNAR_FORMATS and pa is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The {output_format} output format requires pyarrow to be installed."
+        )
+
+    # The body optionally selects the stores and the time of the report
+    report_request = (report_request or ReportRequest()).validate_timezones()
+    stores = StoreFilter(report_request.store_ids, report_request.timezones, report_request.regions)
+    as_of = report_request.as_of
+    if as_of is not None and as_of.tzinfo is not None:
+        as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
 
-    # Start the background task for report generation
-    background_tasks.add_task(generate_report, new_report.id, db)
+    # Reuse the report with the same time, parameters and data if it is queued, running or completed,
+    # otherwise the report is queued and generated by a report worker (worker.py)
+    start_time, _ = get_report_time_range(as_of)
+    parameters = {'engine': engine}
+    if stores:
+        parameters['store_filter'] = stores.as_dict()
+    if output_format != DEFAULT_REPORT_FORMAT:
+        parameters['output_format'] = output_format
+    cache_key = await get_report_cache_key(db, start_time, parameters)
+    report, _ = await get_or_create_report(db, cache_key, engine, as_of, stores.as_dict() if stores else None,
+                                           output_format)
 
-    return JSONResponse(content={'report_id': str(new_report.id)})
+    return JSONResponse(content={'report_id': str(report.id)})
 
 
 @app_router.get("/get_report", status_code=status.HTTP_200_OK)
-async def get_report(report_id: str, db: Session = Depends(get_db)):
+async def get_report(report_id: str, follow: bool = False, accept: str = Header(None),
+                     accept_encoding: str = Header(None), if_none_match: str = Header(None),
+                     db: AsyncSession = Depends(get_async_db)):
     # Validate uuid
     ReportId.validate_report_id(report_id)
 
-    report = db.query(Report).filter(Report.id == report_id).first()
+    report = await db.scalar(select(Report).where(Report.id == uuid.UUID(report_id)))
     if not report:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Report not found."
         )
 
-    if report.status == STATUS_RUNNING:
+    csv_filepath = get_report_filepath(report.id)
+    csv_filename = os.path.basename(csv_filepath)
+
+    if report.status in (STATUS_QUEUED, STATUS_RUNNING) and follow:
+        # Stream the rows already computed, then the rows of the report as they are written until it completes
+        return StreamingResponse(follow_report_csv(report.id, csv_filepath), media_type='text/csv',
+                                 headers={'Content-Disposition': f'attachment; filename="{csv_filename}"'})
+    elif report.status in (STATUS_QUEUED, STATUS_RUNNING):
         return {
-            "Report status": STATUS_RUNNING
+            "Report status": report.status
         }
     elif report.status == STATUS_COMPLETED:
-        folder_name = REPORT_FOLDER
-        csv_filename = f'store_activity_report_{report_id}.csv'
-        csv_filepath = os.path.join(folder_name, csv_filename)
+        # The report is served as CSV or in its output format, as the Accept header prefers
+        output_format = report.output_format or DEFAULT_REPORT_FORMAT
+        report_format = negotiate_report_format(accept, output_format)
+        if report_format is None:
+            media_types = [MEDIA_TYPES[served_format] for served_format in get_served_formats(output_format)]
+            raise HTTPException(
+                status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                detail=f"The report is available as {', '.join(media_types)}."
+            )
 
-        if os.path.exists(csv_filepath):
-            return FileResponse(path=csv_filepath, filename=csv_filename, media_type='text/csv')
-        else:
+        report_file = (await get_report_files(db, report.id)).get(report_format)
+        stored_filepath = report_file and get_stored_filepath(report_file.content_hash, report_format)
+        if not report_file or not os.path.exists(stored_filepath):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="CSV file not found."
+                detail="Report file not found."
             )
 
+        # CSV files are stored gzip compressed, sent as they are to clients accepting it
+        gzip_encoded = report_format == FORMAT_CSV and accepts_gzip(accept_encoding)
+        etag = get_etag(report_file.content_hash, ENCODING_GZIP if gzip_encoded else None)
+        headers = {'Vary': 'Accept, Accept-Encoding', 'ETag': etag}
+        # Reports are evicted from the store from the least recently downloaded. Repeated downloads and
+        # revalidations of a report commit a new download time once per DOWNLOADED_AT_RESOLUTION at most
+        now = datetime.utcnow()
+        if report.downloaded_at is None or now - report.downloaded_at >= DOWNLOADED_AT_RESOLUTION:
+            report.downloaded_at = now
+            await db.commit()
+
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        filename = os.path.basename(get_report_filepath(report.id, report_format))
+        if gzip_encoded:
+            headers['Content-Encoding'] = ENCODING_GZIP
+        elif report_format == FORMAT_CSV:
+            headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return StreamingResponse(iterate_in_threadpool(read_stored_csv(stored_filepath)),
+                                     media_type=MEDIA_TYPES[report_format], headers=headers)
+        return FileResponse(path=stored_filepath, filename=filename, media_type=MEDIA_TYPES[report_format],
+                            headers=headers)
+
     return {
         "Report status": report.status
     }
+
+
+@app_router.get("/get_report_summary", status_code=status.HTTP_200_OK)
+async def get_report_summary(report_id: str, db: AsyncSession = Depends(get_async_db)):
+    # Validate uuid
+    ReportId.validate_report_id(report_id)
+
+    report = await db.scalar(select(Report).where(Report.id == uuid.UUID(report_id)))
+    if not report:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report not found."
+        )
+
+    if report.summary is None:
+        if report.status == STATUS_COMPLETED:
+            # Reports completed before summaries were saved
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Report summary not found."
+            )
+        return {
+            "Report status": report.status
+        }
+
+    # The summary is saved with the report, evicted reports keep it
+    return {
+        "report_id": str(report.id),
+        **format_report_summary(report.summary)
+    }
+
+
+@app_router.post("/cancel_report", status_code=status.HTTP_200_OK)
+async def cancel_report(report_id: str, db: AsyncSession = Depends(get_async_db)):
+    # Validate uuid
+    ReportId.validate_report_id(report_id)
+
+    report = await db.scalar(select(Report).where(Report.id == uuid.UUID(report_id)))
+    if not report:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report not found."
+        )
+
+    # Only a queued or running report is cancelled, a worker completing it meanwhile keeps it completed. A worker
+    # generating the report sees it cancelled at its next heartbeat and stops before its next store.
+    cancelled = await db.execute(update(Report).where(
+        Report.id == report.id, Report.status.in_((STATUS_QUEUED, STATUS_RUNNING))
+    ).values(status=STATUS_CANCELLED, cache_key=None))
+    await db.commit()
+    if not cancelled.rowcount:
+        await db.refresh(report)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Report is already {report.status.lower()}."
+        )
+
+    return {
+        "Report status": STATUS_CANCELLED
+    }
+
+
+@app_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(db: AsyncSession = Depends(get_async_db)):
+    # Reports are generated by the report workers, their timings are read back from the reports table
+    status_counts = dict((await db.execute(select(Report.status, func.count()).group_by(Report.status))).all())
+    totals = (await db.execute(get_timings_totals_query(Report.timings))).one()._asdict()
+
+    return PlainTextResponse(format_metrics(status_counts, totals), media_type='text/plain; version=0.0.4')
+
+
+@app_router.post("/metadata_snapshot", status_code=status.HTTP_200_OK)
+def rebuild_metadata_snapshot(db: Session = Depends(get_db)):
+    # Business hours or timezones updated in place keep the version stamp of the tables, the snapshot the
+    # report workers map is rebuilt anyway
+    snapshot = build_metadata_snapshot(db)
+    return {
+        "version": snapshot.version,
+        "stores": len(snapshot)
+    }
+
+
+@app_router.get("/stores/{store_id}/uptime", status_code=status.HTTP_200_OK)
+def get_store_uptime_route(store_id: str, window: str = 'hour', as_of: datetime = None, db: Session = Depends(get_db)):
+    # Windows are named after the report windows without their last_ prefix: hour, day, week
+    windows = {name.removeprefix('last_'): index for index, (name, _, _) in enumerate(REPORT_WINDOWS)}
+    if window not in windows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid window. Must be one of {', '.join(windows)}."
+        )
+
+    if as_of is None:
+        as_of, _ = get_report_time_range()
+    elif as_of.tzinfo is not None:
+        as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
+
+    # A sync route, the interpolation runs in the thread pool instead of blocking the event loop
+    as_of, window_hours = get_store_uptime(db, store_id, as_of)
+    if window_hours is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No activities found for the store."
+        )
+
+    name, _, unit = REPORT_WINDOWS[windows[window]]
+    uptime, downtime = window_hours[windows[window]]
+    return {
+        "store_id": store_id,
+        "window": name,
+        "as_of": as_of.isoformat(),
+        "unit": unit,
+        "uptime": round(uptime * WINDOW_UNITS[unit]),
+        "downtime": round(downtime * WINDOW_UNITS[unit])
+    }
+
+
+@app_router.post("/activities", status_code=status.HTTP_200_OK)
+async def ingest_activities_route(request: Request, db: AsyncSession = Depends(get_async_db)):
+    content_type = request.headers.get('content-type', '').split(';')[0].strip()
+    if content_type not in INGEST_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Invalid content type. Must be one of {', '.join(INGEST_CONTENT_TYPES)}."
+        )
+
+    # The body is parsed as it is received, polls are written in batches while the rest of it arrives
+    try:
+        return await ingest_activities(db, request.stream(), content_type)
+    except IngestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
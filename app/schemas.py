@@ -1,6 +1,9 @@
 from fastapi import HTTPException, status
 from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
 import uuid
+import pytz
 
 
 class ReportId(BaseModel):
@@ -16,3 +19,21 @@ class ReportId(BaseModel):
                 detail="Invalid report_id. Must be a valid UUID."
             )
         return report_id
+
+
+class ReportRequest(BaseModel):
+    """Optional body of /trigger_report, a report of a subset of the stores or as of another time."""
+    store_ids: Optional[List[str]] = None
+    # Timezones such as America/Chicago, and regions, the part of a timezone before its first slash
+    timezones: Optional[List[str]] = None
+    regions: Optional[List[str]] = None
+    as_of: Optional[datetime] = None
+
+    def validate_timezones(self):
+        unknown = [timezone_str for timezone_str in self.timezones or [] if timezone_str not in pytz.all_timezones_set]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown timezones: {', '.join(unknown)}."
+            )
+        return self
@@ -0,0 +1,32 @@
+import sys
+import argparse
+from pathlib import Path
+
+# Add the parent directory of the current script to the Python path
+current_dir = Path(__file__).resolve().parent
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+
+from constants import REPORT_ENGINES, APPROXIMATE_REPORT_ENGINES, ENGINE_REFERENCE, ENGINE_VECTORIZED
+from scripts.scripts_db import get_scripts_db
+from utils import check_engine_parity
+
+parser = argparse.ArgumentParser(description="Check that report engines generate identical reports.")
+parser.add_argument('--engines', nargs='+', choices=REPORT_ENGINES + APPROXIMATE_REPORT_ENGINES,
+                    default=[ENGINE_REFERENCE, ENGINE_VECTORIZED])
+args = parser.parse_args()
+engines = ', '.join(args.engines)
+
+with get_scripts_db() as session:
+    mismatched, divergent = check_engine_parity(session, args.engines)
+
+if divergent:
+    # Documented differences of the reference engine, see get_reference_divergences
+    print(f"{len(divergent)} stores with business hours crossing midnight or a DST change in the report week "
+          f"were not compared, the reference engine reports them differently.")
+if mismatched:
+    print(f"The {engines} engines generated different rows for {len(mismatched)} stores: "
+          f"{', '.join(mismatched[:10])}{', ...' if len(mismatched) > 10 else ''}")
+    sys.exit(1)
+
+print(f"The {engines} engines generated identical reports.")
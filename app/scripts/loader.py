@@ -0,0 +1,159 @@
+import io
+import os
+import argparse
+import logging
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from sqlalchemy import Table, text
+
+from db import Base, engine, insert_ignoring_duplicates
+from config import IMPORT_WORKERS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bytes of the CSV file read by a worker at a time, each range is inserted in its own transaction
+CHUNK_BYTES = 16 * 1024 * 1024
+
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    # The C parser of pandas, pyarrow is optional
+    CSV_ENGINE = 'c'
+
+
+def parse_timestamps(values: pd.Series) -> pd.Series:
+    """Parse timestamps such as '2023-01-22 12:09:39.388884 UTC' into naive UTC datetimes."""
+    return pd.to_datetime(values.str.removesuffix(' UTC'), format='ISO8601', utc=True).dt.tz_localize(None)
+
+
+def parse_times(values: pd.Series, default: str) -> pd.Series:
+    """Parse HH:MM:SS local times, missing values are replaced by default."""
+    return pd.to_datetime(values.fillna(default), format='%H:%M:%S').dt.time
+
+
+def copy_chunk(connection, table: Table, chunk: pd.DataFrame) -> int:
+    """Stream a chunk into a PostgreSQL table with COPY ... FROM STDIN, skipping the rows already stored.
+
+    COPY cannot skip duplicates, the chunk is copied into a temporary table and moved into the table
+    with INSERT ... ON CONFLICT DO NOTHING. Returns the number of rows inserted.
+    """
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S.%f')
+    buffer.seek(0)
+
+    columns = ', '.join(chunk.columns)
+    staging = f'{table.name}_staging'
+    connection.execute(text(f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+                            f"SELECT {columns} FROM {table.name} WITH NO DATA"))
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+    return connection.execute(text(
+        f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {staging} ON CONFLICT DO NOTHING"
+    )).rowcount
+
+
+def insert_chunk(connection, table: Table, chunk: pd.DataFrame) -> int:
+    """Insert a chunk with a single executemany skipping the rows already stored, for databases without COPY."""
+    return connection.execute(insert_ignoring_duplicates(table, connection.dialect.name),
+                              chunk.astype(object).to_dict('records')).rowcount
+
+
+def write_chunk(connection, table: Table, chunk: pd.DataFrame) -> int:
+    """Write a chunk into a table, returns the number of rows inserted."""
+    if connection.dialect.name == 'postgresql':
+        return copy_chunk(connection, table, chunk)
+    return insert_chunk(connection, table, chunk)
+
+
+def get_byte_ranges(csv_file_path, chunk_bytes: int) -> tuple:
+    """Split a CSV file into (start, end) byte ranges of whole lines, returns its header and the ranges.
+
+    Quoted values spanning several lines are not supported, none of the imported files have them.
+    """
+    ranges = []
+    with open(csv_file_path, 'rb') as csv_file:
+        header = csv_file.readline().decode().strip().split(',')
+        start = csv_file.tell()
+        size = os.fstat(csv_file.fileno()).st_size
+        while start < size:
+            # Extend the range to the end of the line it stops in
+            csv_file.seek(min(start + chunk_bytes, size))
+            csv_file.readline()
+            end = min(csv_file.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def read_range(csv_file_path, start: int, end: int, header: list) -> pd.DataFrame:
+    """Read the lines of a byte range of a CSV file, every value as a string."""
+    with open(csv_file_path, 'rb') as csv_file:
+        csv_file.seek(start)
+        data = csv_file.read(end - start)
+    return pd.read_csv(io.BytesIO(data), names=header, header=None, dtype=str, engine=CSV_ENGINE)
+
+
+def init_import_worker():
+    """Drop the database connections inherited from the parent process."""
+    engine.dispose(close=False)
+
+
+def import_range(csv_file_path, start: int, end: int, header: list, table_name: str, convert_chunk, write: bool):
+    """Read and convert a byte range, returns the (rows, rows inserted) written with write or else the chunk."""
+    chunk = convert_chunk(read_range(csv_file_path, start, end, header))
+    if not write:
+        return chunk
+    with engine.begin() as connection:
+        return len(chunk), write_chunk(connection, Base.metadata.tables[table_name], chunk)
+
+
+def load_csv(csv_file_path, table: Table, convert_chunk, workers: int = IMPORT_WORKERS,
+             chunk_bytes: int = CHUNK_BYTES) -> int:
+    """Load a CSV file into a table in parallel byte ranges, returns the number of rows inserted.
+
+    convert_chunk turns a raw pandas chunk into a DataFrame whose columns are those of the table, it is
+    run in the worker processes and has to be a module level function. Rows whose natural key is already
+    stored are skipped, so an interrupted or repeated import can be run again. On SQLite, which has a
+    single writer, the workers only parse the ranges and the rows are written by this process.
+    """
+    header, ranges = get_byte_ranges(csv_file_path, chunk_bytes)
+    workers_write = engine.dialect.name != 'sqlite'
+
+    start_import = time()
+    rows_read = rows_inserted = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_import_worker) as executor:
+        futures = [executor.submit(import_range, csv_file_path, start, end, header, table.name, convert_chunk,
+                                   workers_write) for start, end in ranges]
+        for future in as_completed(futures):
+            if workers_write:
+                rows, inserted = future.result()
+            else:
+                chunk = future.result()
+                with engine.begin() as connection:
+                    rows, inserted = len(chunk), write_chunk(connection, table, chunk)
+            rows_read += rows
+            rows_inserted += inserted
+            logger.info(f"Read {rows_read} rows of {csv_file_path}, inserted {rows_inserted} into {table.name}")
+
+    elapsed = time() - start_import
+    logger.info(f"Imported {csv_file_path} into {table.name} in {elapsed:.1f} seconds with {workers} workers and "
+                f"the {CSV_ENGINE} parser, {rows_read / max(elapsed, 1e-9):.0f} rows/sec, "
+                f"{rows_read - rows_inserted} rows were already stored")
+    return rows_inserted
+
+
+def parse_import_args(default_csv_file_path) -> argparse.Namespace:
+    """Parse the command line arguments shared by the import scripts."""
+    parser = argparse.ArgumentParser(description="Import a CSV file, skipping the rows already imported.")
+    parser.add_argument('csv_file_path', nargs='?', default=default_csv_file_path)
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS, help="Worker processes parsing the file.")
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / 1024 / 1024,
+                        help="Megabytes of the file read by a worker at a time.")
+    return parser.parse_args()
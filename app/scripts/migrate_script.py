@@ -0,0 +1,57 @@
+import sys
+import argparse
+import logging
+from datetime import datetime
+from pathlib import Path
+
+# Add the parent directory of the current script to the Python path
+current_dir = Path(__file__).resolve().parent
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+
+from sqlalchemy import func
+
+from db import engine
+from models import StoreActivity
+from migrations import (PARTITION_WEEK, PARTITION_INTERVALS, PARTITIONS_AHEAD, create_indexes, create_partitions,
+                        partition_store_activities, drop_expired_partitions, deduplicate)
+from utils import get_report_time_range
+
+logging.basicConfig(level=logging.INFO)
+
+parser = argparse.ArgumentParser(description="Migrate the schema of the store monitoring database.")
+subparsers = parser.add_subparsers(dest='command', required=True)
+subparsers.add_parser('indexes', help="Create the missing indexes.")
+subparsers.add_parser('dedupe', help="Delete duplicate rows and make the natural keys unique.")
+partition_parser = subparsers.add_parser('partition', help="Range partition store_activities (PostgreSQL).")
+partition_parser.add_argument('--interval', choices=list(PARTITION_INTERVALS), default=PARTITION_WEEK)
+ahead_parser = subparsers.add_parser('create-partitions', help="Create the partitions ahead of the newest poll.")
+ahead_parser.add_argument('--interval', choices=list(PARTITION_INTERVALS), default=PARTITION_WEEK)
+retention_parser = subparsers.add_parser('retention', help="Drop the partitions older than the reporting horizon.")
+retention_parser.add_argument('--before', type=datetime.fromisoformat,
+                              help="Naive UTC time the partitions are dropped before, by default the longest "
+                                   "report window before the newest poll.")
+args = parser.parse_args()
+
+with engine.begin() as connection:
+    if args.command == 'indexes':
+        create_indexes(connection)
+    elif args.command == 'dedupe':
+        deduplicate(connection)
+    elif args.command == 'partition':
+        partition_store_activities(connection, args.interval)
+    elif args.command == 'create-partitions':
+        newest = connection.execute(func.max(StoreActivity.timestamp_utc).select()).scalar() or datetime.utcnow()
+        create_partitions(connection, newest, newest + PARTITIONS_AHEAD * PARTITION_INTERVALS[args.interval],
+                          args.interval)
+    elif args.command == 'retention':
+        # Reports only read the polls of the longest window before the report time, a report as of the newest
+        # poll reads those of the window before it
+        end_time = args.before
+        if end_time is None:
+            newest = connection.execute(func.max(StoreActivity.timestamp_utc).select()).scalar()
+            if newest is None:
+                sys.exit("There are no polls to retain, pass --before to drop the partitions anyway.")
+            _, end_time = get_report_time_range(newest)
+        dropped = drop_expired_partitions(connection, end_time)
+        print(f"Dropped {len(dropped)} partitions older than {end_time}.")
@@ -0,0 +1,34 @@
+import sys
+import argparse
+from pathlib import Path
+
+# Add the parent directory of the current script to the Python path
+current_dir = Path(__file__).resolve().parent
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+
+from constants import REPORT_ENGINES, APPROXIMATE_REPORT_ENGINES, DEFAULT_ENGINE, STATUS_RUNNING
+from metrics import profile_report
+from models import Report
+from scripts.scripts_db import get_scripts_db
+from utils import generate_report
+
+parser = argparse.ArgumentParser(description="Generate one report under cProfile and tracemalloc.")
+parser.add_argument('--engine', choices=REPORT_ENGINES + APPROXIMATE_REPORT_ENGINES, default=DEFAULT_ENGINE)
+parser.add_argument('--output', default='profiles', help="Folder the profile files are written to.")
+# Worker processes are not profiled, the report is generated in this process by default
+parser.add_argument('--workers', type=int, default=1)
+args = parser.parse_args()
+
+with get_scripts_db() as session:
+    report = Report(status=STATUS_RUNNING, engine=args.engine)
+    session.add(report)
+    session.commit()
+    report_id = report.id
+
+    with profile_report(report_id, args.output):
+        generate_report(report_id, session, args.engine, workers=args.workers)
+
+    print(f"Report {report_id} timings: {report.timings}")
+
+print(f"Wrote the profile of report {report_id} to {args.output}.")
@@ -6,27 +6,19 @@ current_dir = Path(__file__).resolve().parent
 parent_dir = current_dir.parent
 sys.path.append(str(parent_dir))
 
-import pandas as pd
 from models import StoreActivity
-from scripts.scripts_db import get_scripts_db
+from scripts.loader import load_csv, parse_timestamps, parse_import_args
 from constants import STORE_ACTIVITY_CSV
 
-BATCH_SIZE = 10000
 csv_file_path = parent_dir / 'data' / STORE_ACTIVITY_CSV
 
-chunks = pd.read_csv(csv_file_path, chunksize=BATCH_SIZE)
 
-with get_scripts_db() as session:
-    for chunk in chunks:
-        chunk['timestamp_utc'] = pd.to_datetime(chunk['timestamp_utc'], format='mixed')
-        store_activities = []
-        for index, row in chunk.iterrows():
-            store_activity = StoreActivity(
-                store_id=row['store_id'],
-                timestamp_utc=row['timestamp_utc'],
-                status=row['status']
-            )
-            store_activities.append(store_activity)
+def convert_chunk(chunk):
+    chunk['timestamp_utc'] = parse_timestamps(chunk['timestamp_utc'])
+    return chunk[['store_id', 'timestamp_utc', 'status']]
 
-        session.add_all(store_activities)
-        session.commit()
+
+if __name__ == '__main__':
+    args = parse_import_args(csv_file_path)
+    load_csv(args.csv_file_path, StoreActivity.__table__, convert_chunk, args.workers,
+             int(args.chunk_mb * 1024 * 1024))
@@ -1,41 +1,32 @@
 import sys
 from pathlib import Path
-from datetime import datetime
 
 # Add the parent directory of the current script to the Python path
 current_dir = Path(__file__).resolve().parent
 parent_dir = current_dir.parent
 sys.path.append(str(parent_dir))
 
-import pandas as pd
 from models import StoreBusinessHour
 from scripts.scripts_db import get_scripts_db
+from metadata_snapshot import build_metadata_snapshot
+from scripts.loader import load_csv, parse_times, parse_import_args
 from constants import STORE_BUSINESS_HOUR_CSV
 
-BATCH_SIZE = 10000
 csv_file_path = parent_dir / 'data' / STORE_BUSINESS_HOUR_CSV
 
-chunks = pd.read_csv(csv_file_path, chunksize=BATCH_SIZE)
 
-with get_scripts_db() as session:
-    for chunk in chunks:
-        chunk['start_time_local'].fillna('00:00:00', inplace=True)
-        chunk['end_time_local'].fillna('23:59:59', inplace=True)
+def convert_chunk(chunk):
+    chunk['day_of_week'] = chunk['day'].astype(int)
+    chunk['start_time_local'] = parse_times(chunk['start_time_local'], '00:00:00')
+    chunk['end_time_local'] = parse_times(chunk['end_time_local'], '23:59:59')
+    return chunk[['store_id', 'day_of_week', 'start_time_local', 'end_time_local']]
 
-        chunk['start_time_local'] = chunk['start_time_local'].apply(lambda x: datetime.strptime(x, '%H:%M:%S').time())
-        chunk['end_time_local'] = chunk['end_time_local'].apply(lambda x: datetime.strptime(x, '%H:%M:%S').time())
 
-        business_hours = []
-        for index, row in chunk.iterrows():
-            business_hour = StoreBusinessHour(
-                store_id=row['store_id'],
-                day_of_week=row['day'],
-                start_time_local=row['start_time_local'],
-                end_time_local=row['end_time_local']
-            )
-            business_hours.append(business_hour)
-
-        session.add_all(business_hours)
-        session.commit()
-
-print("Inserted data into store_business_hours table, including defaults for stores with missing data.")
+if __name__ == '__main__':
+    args = parse_import_args(csv_file_path)
+    load_csv(args.csv_file_path, StoreBusinessHour.__table__, convert_chunk, args.workers,
+             int(args.chunk_mb * 1024 * 1024))
+    print("Inserted data into store_business_hours table, including defaults for stores with missing data.")
+    # Report workers map the new snapshot instead of rebuilding it with their next report
+    with get_scripts_db() as session:
+        build_metadata_snapshot(session)
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+# Add the parent directory of the current script to the Python path
+current_dir = Path(__file__).resolve().parent
+parent_dir = current_dir.parent
+sys.path.append(str(parent_dir))
+
+from rollup import backfill_hourly_uptime
+from scripts.scripts_db import get_scripts_db
+from utils import get_store_timezones, get_business_hours
+
+with get_scripts_db() as session:
+    business_hours = get_business_hours(session, get_store_timezones(session))
+    backfill_hourly_uptime(session, business_hours)
+
+print("Rebuilt the store_hourly_uptime table from store_activities successfully.")
@@ -1,6 +1,5 @@
 import sys
 from pathlib import Path
-import pandas as pd
 
 # Add the parent directory of the current script to the Python path
 current_dir = Path(__file__).resolve().parent
@@ -9,26 +8,23 @@ sys.path.append(str(parent_dir))
 
 from models import StoreTimezone
 from scripts.scripts_db import get_scripts_db
-from constants import STORE_TIMEZONE_CSV
+from metadata_snapshot import build_metadata_snapshot
+from scripts.loader import load_csv, parse_import_args
+from constants import STORE_TIMEZONE_CSV, DEFAULT_TIMEZONE
 
 csv_file_path = parent_dir / 'data' / STORE_TIMEZONE_CSV
 
-BATCH_SIZE = 10000
 
-chunks = pd.read_csv(csv_file_path, chunksize=BATCH_SIZE)
+def convert_chunk(chunk):
+    chunk['timezone_str'] = chunk['timezone_str'].fillna(DEFAULT_TIMEZONE)
+    return chunk[['store_id', 'timezone_str']]
 
-with get_scripts_db() as session:
-    for chunk in chunks:
-        chunk['timezone_str'].fillna('America/Chicago', inplace=True)
-        store_timezones = []
-        for index, row in chunk.iterrows():
-            store_timezone = StoreTimezone(
-                store_id=row['store_id'],
-                timezone_str=row['timezone_str']
-            )
-            store_timezones.append(store_timezone)
 
-        session.add_all(store_timezones)
-        session.commit()
-
-print("Data migrated to store_timezones table successfully.")
+if __name__ == '__main__':
+    args = parse_import_args(csv_file_path)
+    load_csv(args.csv_file_path, StoreTimezone.__table__, convert_chunk, args.workers,
+             int(args.chunk_mb * 1024 * 1024))
+    print("Data migrated to store_timezones table successfully.")
+    # Report workers map the new snapshot instead of rebuilding it with their next report
+    with get_scripts_db() as session:
+        build_metadata_snapshot(session)
@@ -0,0 +1,55 @@
+from sqlalchemy import or_, select
+from sqlalchemy.orm import aliased
+
+from constants import DEFAULT_TIMEZONE
+from models import StoreTimezone
+
+
+class StoreFilter:
+    """The stores a report is generated for, by store id and by timezone or region.
+
+    A region is the part of a timezone before its first slash, such as America or Asia, and stores without
+    a timezone are in DEFAULT_TIMEZONE. A store has to match every given criterion, without any criteria
+    every store is selected.
+    """
+
+    def __init__(self, store_ids: list = None, timezones: list = None, regions: list = None):
+        self.store_ids = sorted(set(store_ids)) if store_ids else None
+        self.timezones = sorted(set(timezones)) if timezones else None
+        self.regions = sorted(set(regions)) if regions else None
+
+    def __bool__(self) -> bool:
+        return bool(self.store_ids or self.timezones or self.regions)
+
+    def matches_timezone(self, timezone_str: str) -> bool:
+        return bool(self.timezones and timezone_str in self.timezones
+                    or self.regions and timezone_str.split('/')[0] in self.regions)
+
+    def where(self, store_id_column) -> list:
+        """Get the conditions on a store_id column that select the rows of the filtered stores."""
+        conditions = []
+        if self.store_ids:
+            conditions.append(store_id_column.in_(self.store_ids))
+
+        if self.timezones or self.regions:
+            # Aliased so that the subqueries are not correlated with a query of store_timezones itself
+            store_timezone = aliased(StoreTimezone)
+            timezone_matches = [store_timezone.timezone_str.in_(self.timezones)] if self.timezones else []
+            timezone_matches += [store_timezone.timezone_str.startswith(f'{region}/', autoescape=True)
+                                 for region in self.regions or []]
+            in_timezones = store_id_column.in_(select(store_timezone.store_id).where(or_(*timezone_matches)))
+
+            if self.matches_timezone(DEFAULT_TIMEZONE):
+                without_timezone = aliased(StoreTimezone)
+                in_timezones = or_(in_timezones, ~select(without_timezone.id).where(
+                    without_timezone.store_id == store_id_column).exists())
+            conditions.append(in_timezones)
+
+        return conditions
+
+    def as_dict(self) -> dict:
+        return {'store_ids': self.store_ids, 'timezones': self.timezones, 'regions': self.regions}
+
+    @classmethod
+    def from_dict(cls, filters: dict) -> 'StoreFilter':
+        return cls(**(filters or {}))
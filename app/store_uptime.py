@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from db import Session
+from config import STORE_UPTIME_BUCKET, STORE_UPTIME_CACHE_SIZE
+from constants import REPORT_WINDOWS, DEFAULT_ENGINE, ENGINE_REFERENCE
+from models import StoreActivity, StoreBusinessHour, StoreTimezone
+from utils import (get_store_timezones, get_business_hours, get_store_activities_within_interval,
+                   sort_business_hours, is_within_business_hours, interpolate_windows)
+from activities import get_activity_columns_query, load_activity_arrays
+from business_hour_index import BusinessHourIndex, to_epoch_us
+from vectorized import interpolate_store_windows
+
+# Memoized uptimes by (store_id, as_of), as (activity_watermark, metadata_watermark, window_hours)
+store_uptimes = OrderedDict()
+# Business hours of a store by store_id, as (metadata_watermark, business_hours)
+store_metadata = OrderedDict()
+# Routes are run in a thread pool
+cache_lock = threading.Lock()
+
+
+def get_watermarks(db: Session) -> tuple:
+    """Get the highest id of store_activities, and those of store_business_hours and store_timezones.
+
+    Rows are only ever added, a cached value is stale once a newer row exists.
+    """
+    activity_watermark, business_hour_watermark, timezone_watermark = db.execute(select(
+        select(func.max(StoreActivity.id)).scalar_subquery(),
+        select(func.max(StoreBusinessHour.id)).scalar_subquery(),
+        select(func.max(StoreTimezone.id)).scalar_subquery()
+    )).one()
+    return activity_watermark, (business_hour_watermark, timezone_watermark)
+
+
+def floor_as_of(as_of: datetime) -> datetime:
+    """Floor as_of to the start of its STORE_UPTIME_BUCKET second bucket."""
+    if STORE_UPTIME_BUCKET <= 1:
+        return as_of
+    bucket = timedelta(seconds=STORE_UPTIME_BUCKET)
+    return datetime.min + (as_of - datetime.min) // bucket * bucket
+
+
+def cache(entries: OrderedDict, key, value):
+    with cache_lock:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > STORE_UPTIME_CACHE_SIZE:
+            entries.popitem(last=False)
+
+
+def get_store_business_hours(db: Session, store_id: str, metadata_watermark: tuple) -> dict:
+    """Get the business hours of a single store, cached until business hours or timezones are imported."""
+    with cache_lock:
+        cached = store_metadata.get(store_id)
+    if cached is not None and cached[0] == metadata_watermark:
+        return cached[1]
+
+    business_hours = sort_business_hours(get_business_hours(db, get_store_timezones(db, [store_id]), [store_id]))
+    cache(store_metadata, store_id, (metadata_watermark, business_hours))
+    return business_hours
+
+
+def has_new_activities(db: Session, store_id: str, activity_watermark) -> bool:
+    """Check if polls of a store were added after activity_watermark."""
+    query = db.query(StoreActivity.id).filter(StoreActivity.store_id == store_id)
+    if activity_watermark is not None:
+        query = query.filter(StoreActivity.id > activity_watermark)
+    return query.first() is not None
+
+
+def get_reference_window_hours(db: Session, store_id: str, as_of: datetime, window_ends: list,
+                               business_hours: dict) -> list:
+    """Interpolate the windows of a store like the reference engine, None when it has no polls within them."""
+    activities = get_store_activities_within_interval(store_id, window_ends[-1], as_of, db)
+    if not activities:
+        return None
+
+    # Polls outside of business hours only give zero hours, the store has no row in the report then
+    activities = [activity for activity in activities
+                  if is_within_business_hours(store_id, activity.timestamp_utc, business_hours)]
+    return interpolate_windows(activities, as_of, window_ends, business_hours[store_id])
+
+
+def get_vectorized_window_hours(db: Session, store_id: str, as_of: datetime, window_ends: list,
+                                business_hours: dict) -> list:
+    """Interpolate the windows of a store like the vectorized engine, None when it has no polls within them."""
+    # Indexed range scan of the polls of the store, newest first
+    activities = load_activity_arrays(db, get_activity_columns_query(as_of, window_ends[-1], [store_id]))
+    if not len(activities):
+        return None
+
+    _, ts, codes = activities.store(0)
+    business_hour_index = BusinessHourIndex(business_hours, as_of, window_ends[-1])
+    window_hours = interpolate_store_windows(store_id, ts, codes, business_hour_index,
+                                             to_epoch_us([as_of, *window_ends]))
+    # Polls outside of business hours only
+    return window_hours or [[0, 0] for _ in REPORT_WINDOWS]
+
+
+def get_store_uptime(db: Session, store_id: str, as_of: datetime) -> tuple:
+    """Get the (uptime, downtime) hours of a store for every report window as of the bucket of as_of.
+
+    Returns the start of the bucket, None instead of the windows when the store has no polls within the
+    longest window. The windows are computed like the row of the store in a report of DEFAULT_ENGINE generated
+    at that time, the other exact engines report the rows of the vectorized engine.
+    """
+    as_of = floor_as_of(as_of)
+    activity_watermark, metadata_watermark = get_watermarks(db)
+
+    with cache_lock:
+        cached = store_uptimes.get((store_id, as_of))
+    if cached is not None and cached[1] == metadata_watermark and (
+            cached[0] == activity_watermark or not has_new_activities(db, store_id, cached[0])):
+        cache(store_uptimes, (store_id, as_of), (activity_watermark, *cached[1:]))
+        return as_of, cached[2]
+
+    business_hours = get_store_business_hours(db, store_id, metadata_watermark)
+    window_ends = [as_of - duration for _, duration, _ in REPORT_WINDOWS]
+    if DEFAULT_ENGINE == ENGINE_REFERENCE:
+        window_hours = get_reference_window_hours(db, store_id, as_of, window_ends, business_hours)
+    else:
+        window_hours = get_vectorized_window_hours(db, store_id, as_of, window_ends, business_hours)
+
+    cache(store_uptimes, (store_id, as_of), (activity_watermark, metadata_watermark, window_hours))
+    return as_of, window_hours
@@ -0,0 +1,46 @@
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+
+import pytz
+
+
+class OffsetTable:
+    """The UTC offset transitions of a timezone, to convert UTC to local time without pytz.
+
+    transitions are the naive UTC times from which offsets apply, the first one is datetime.min. They are read
+    from the transition lists of pytz, which are not part of its public API: timezones without them are
+    converted by pytz itself, transitions and offsets are then None.
+    """
+
+    def __init__(self, timezone_str: str):
+        self.timezone = pytz.timezone(timezone_str)
+        transitions = getattr(self.timezone, '_utc_transition_times', None)
+        transition_info = getattr(self.timezone, '_transition_info', None)
+        if transitions and transition_info and len(transitions) == len(transition_info):
+            # DstTzInfo, the offsets of all its transitions are listed by pytz
+            self.transitions = list(transitions)
+            self.offsets = [transition[0] for transition in transition_info]
+        elif isinstance(self.timezone, pytz.tzinfo.StaticTzInfo) or self.timezone is pytz.utc:
+            # UTC and the StaticTzInfo zones have a single offset
+            self.transitions = [datetime.min]
+            self.offsets = [self.timezone.utcoffset(datetime.min)]
+        else:
+            self.transitions = self.offsets = None
+
+    def to_local(self, timestamp: datetime) -> datetime:
+        """Convert a naive UTC datetime to a naive local datetime."""
+        if self.transitions is None:
+            return pytz.utc.localize(timestamp).astimezone(self.timezone).replace(tzinfo=None)
+        return timestamp + self.offsets[bisect_right(self.transitions, timestamp) - 1]
+
+
+@lru_cache(maxsize=None)
+def get_offset_table(timezone_str: str) -> OffsetTable:
+    """Get the offset table of a timezone, built once per process and shared by every report."""
+    return OffsetTable(timezone_str)
+
+
+def to_local(timezone_str: str, timestamp: datetime) -> datetime:
+    """Convert a naive UTC datetime to the naive local time of a timezone."""
+    return get_offset_table(timezone_str).to_local(timestamp)
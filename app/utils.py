@@ -1,19 +1,38 @@
 import os
 import csv
+import zlib
 import uuid
+import heapq
 import logging
 from collections import defaultdict
-from datetime import datetime, timedelta, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from time import time as time2
 
-import pytz
 from sqlalchemy import and_, desc
 from sqlalchemy.exc import NoResultFound
 
-from db import Session
+from db import Session, engine as db_engine
+from config import REPORT_WORKERS, METADATA_SNAPSHOT
 from models import Report, StoreActivity, StoreBusinessHour, StoreTimezone
-from constants import DEFAULT_TIMEZONE, STATUS_COMPLETED, FULL_DAY, REPORT_FOLDER
+from constants import (DEFAULT_TIMEZONE, STATUS_RUNNING, STATUS_COMPLETED, STATUS_FAILED, FULL_DAY, REPORT_FOLDER,
+                       ENGINE_REFERENCE, ENGINE_VECTORIZED, ENGINE_ROLLUP, ENGINE_PUSHDOWN, DEFAULT_ENGINE,
+                       REPORT_WINDOWS, DEFAULT_REPORT_FORMAT)
 from fastapi import HTTPException, status
+from vectorized import compute_store_rows, format_report_row
+from activities import get_activity_columns_query, load_activity_arrays, stream_activity_arrays
+from rollup import compute_rollup_rows
+from pushdown import compute_pushdown_rows
+from report_output import ReportWriter, get_report_filepath, remove_report_files
+from report_store import store_report, discard_stored_files, evict_reports
+from cancellation import ReportCancelled, cancellable_rows, check_cancelled
+from metadata_snapshot import get_metadata_snapshot
+from report_summary import ReportSummary, get_store_timezone, summarize_rows
+from timezones import get_offset_table, to_local
+from store_filter import StoreFilter
+from metrics import (ReportTimings, collect_timings, phase, count, merge, timed, PHASE_LOAD_TIMEZONES,
+                     PHASE_LOAD_BUSINESS_HOURS, PHASE_QUERY_ACTIVITIES, PHASE_FILTER_BUSINESS_HOURS,
+                     PHASE_INTERPOLATE, PHASE_WRITE_CSV, PHASE_COMMIT, COUNTER_ROWS_SCANNED, COUNTER_STORES_PROCESSED)
 
 
 # Configure logging
@@ -21,27 +40,38 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_store_timezones(db: Session) -> dict:
-    """Fetch store timezones in a single query."""
-    return {tz.store_id: tz.timezone_str for tz in db.query(StoreTimezone).all()}
+def get_store_timezones(db: Session, store_ids: list = None, stores: StoreFilter = None) -> dict:
+    """Fetch store timezones in a single query, optionally only for the given or filtered stores."""
+    query = db.query(StoreTimezone)
+    if store_ids is not None:
+        query = query.filter(StoreTimezone.store_id.in_(store_ids))
+    if stores:
+        query = query.filter(*stores.where(StoreTimezone.store_id))
+    return {tz.store_id: tz.timezone_str for tz in query.all()}
 
 
 def get_store_activities_within_interval(store_id: uuid.UUID, start_time: datetime, end_time: datetime, db: Session):
-    """Query store activities within the specified time interval."""
+    """Query store activities within the specified time interval, in descending order of timestamp_utc."""
     return db.query(StoreActivity).filter(
         and_(
             StoreActivity.store_id == store_id,
             StoreActivity.timestamp_utc >= start_time,
             StoreActivity.timestamp_utc <= end_time
         )
-    ).all()
+    ).order_by(desc(StoreActivity.timestamp_utc)).all()
 
 
-def get_business_hours(db: Session, store_timezones: dict) -> dict:
-    """Fetch business hours for each store."""
+def get_business_hours(db: Session, store_timezones: dict, store_ids: list = None, stores: StoreFilter = None) -> dict:
+    """Fetch business hours for each store, optionally only for the given or filtered stores."""
     business_hours = defaultdict(lambda: defaultdict(list))
 
-    for business_hour in db.query(StoreBusinessHour).all():
+    query = db.query(StoreBusinessHour)
+    if store_ids is not None:
+        query = query.filter(StoreBusinessHour.store_id.in_(store_ids))
+    if stores:
+        query = query.filter(*stores.where(StoreBusinessHour.store_id))
+
+    for business_hour in query.all():
         store_id = business_hour.store_id
         day_of_week = business_hour.day_of_week
         store_timezone = store_timezones.get(store_id)
@@ -62,6 +92,27 @@ def get_business_hours(db: Session, store_timezones: dict) -> dict:
     return business_hours
 
 
+def load_store_metadata(db: Session, store_ids: list = None, stores: StoreFilter = None) -> tuple:
+    """Get the timezones and business hours of the given or filtered stores, returns (store_timezones, business_hours).
+
+    With METADATA_SNAPSHOT they are read from the memory-mapped metadata snapshot, rebuilt first when the tables
+    changed, instead of being queried.
+    """
+    if METADATA_SNAPSHOT:
+        with phase(PHASE_LOAD_TIMEZONES):
+            snapshot = get_metadata_snapshot(db)
+            store_timezones = snapshot.get_store_timezones(store_ids, stores)
+        with phase(PHASE_LOAD_BUSINESS_HOURS):
+            business_hours = snapshot.get_business_hours(store_ids, stores)
+        return store_timezones, business_hours
+
+    with phase(PHASE_LOAD_TIMEZONES):
+        store_timezones = get_store_timezones(db, store_ids, stores)
+    with phase(PHASE_LOAD_BUSINESS_HOURS):
+        business_hours = get_business_hours(db, store_timezones, store_ids, stores)
+    return store_timezones, business_hours
+
+
 def get_business_time_range(timestamp: datetime, business_hours: dict) -> list:
     """Get the business time range for a given timestamp."""
     timestamp_time = timestamp.time()
@@ -201,9 +252,9 @@ def interpolate_activities(activities: list, start_time: datetime, end_time: dat
     uptime, downtime = 0, 0
 
     # Converting the start_time and end_time to the local time of the store
-    store_timezone = pytz.timezone(business_hours['timezone'])
-    start_time = start_time.astimezone(store_timezone)
-    end_time = end_time.astimezone(store_timezone)
+    offset_table = get_offset_table(business_hours['timezone'])
+    start_time = offset_table.to_local(start_time)
+    end_time = offset_table.to_local(end_time)
 
     previous_activity_timestamp = start_time
     previous_activity_status = activities[0].status
@@ -211,7 +262,7 @@ def interpolate_activities(activities: list, start_time: datetime, end_time: dat
     for index, current_activity in enumerate(activities):
         current_activity_status = current_activity.status
         # Converting the timestamp_utc to the local time of the store
-        current_activity_timestamp = current_activity.timestamp_utc.astimezone(store_timezone)
+        current_activity_timestamp = offset_table.to_local(current_activity.timestamp_utc)
 
         # Interpolation of uptime and downtime between current and previous activities.
         up, down = process_activity_ranges(
@@ -232,6 +283,19 @@ def interpolate_activities(activities: list, start_time: datetime, end_time: dat
     return [uptime, downtime]
 
 
+def sort_business_hours(business_hours) -> dict:
+    """Copy business_hours with the time ranges of every day of every store sorted.
+
+    The reference engine sorts them once per report, get_business_time_range returns the earliest range of a day
+    containing a time. The copy is completed by is_within_business_hours, business_hours may be read only.
+    """
+    sorted_hours = defaultdict(lambda: defaultdict(list))
+    for store_id, store_hours in business_hours.items():
+        for key, value in store_hours.items():
+            sorted_hours[store_id][key] = value if key == 'timezone' else sorted(value)
+    return sorted_hours
+
+
 def is_within_business_hours(store_id: uuid.UUID, timestamp: datetime, business_hours: dict) -> bool:
     """Check if a given timestamp falls within business hours."""
     if store_id not in business_hours or not business_hours[store_id]:
@@ -242,84 +306,367 @@ def is_within_business_hours(store_id: uuid.UUID, timestamp: datetime, business_
             business_hours[store_id][day_of_week] = FULL_DAY
         return True
 
-    store_timezone = pytz.timezone(business_hours[store_id]['timezone'])
-    store_timestamp = timestamp.astimezone(store_timezone)
+    store_timestamp = to_local(business_hours[store_id]['timezone'], timestamp)
     weekday = store_timestamp.weekday()
 
     if weekday in business_hours[store_id]:
-        business_hours[store_id][weekday] = sorted(business_hours[store_id][weekday])
         for start_time, end_time in business_hours[store_id][weekday]:
             if start_time <= store_timestamp.time() <= end_time:
                 return True
     return False
 
 
-def generate_csv(report_id: uuid.UUID, start_time: datetime, end_time: datetime,
-                 activities: list, business_hours: dict) -> bool:
-    """Generate a CSV report for store activities."""
-    if not os.path.exists(REPORT_FOLDER):
-        os.makedirs(REPORT_FOLDER)
-
-    csv_filename = f'store_activity_report_{report_id}.csv'
-    csv_filepath = os.path.join(REPORT_FOLDER, csv_filename)
-
-    # Calculate the end time for last hour and last day
-    end_time_last_hour = start_time - timedelta(hours=1)
-    end_time_last_day = start_time - timedelta(days=1)
-
-    with open(csv_filepath, mode='w', newline='') as csvfile:
-        csv_writer = csv.writer(csvfile)
-        csv_writer.writerow([
-            'store_id', 'uptime_last_hour(minutes)', 'downtime_last_hour(minutes)',
-            'uptime_last_day(hours)', 'downtime_last_day(hours)',
-            'uptime_last_week(hours)', 'downtime_last_week(hours)'
-        ])
+def interpolate_windows(activities: list, start_time: datetime, window_ends: list, business_hours: dict) -> list:
+    """Interpolate the uptime and downtime of every window in a single sweep of a store's activities.
+
+    activities are in descending order of time and window_ends are ordered from the newest to the oldest.
+    The result of a window is that of interpolate_activities on the activities newer than its end, which
+    is only computed once an older activity is seen, except for the last window that gets all of them.
+    """
+    window_hours = [[0, 0] for _ in window_ends]
+    if not activities:
+        return window_hours
 
+    uptime, downtime = 0, 0
+
+    # Converting the start_time and the window ends to the local time of the store, once for all the windows
+    offset_table = get_offset_table(business_hours['timezone'])
+    local_window_ends = [offset_table.to_local(window_end) for window_end in window_ends]
+
+    previous_activity_timestamp = offset_table.to_local(start_time)
+    previous_activity_status = activities[0].status
+    window = 0
+
+    for index, current_activity in enumerate(activities):
+        # Every window ending after this activity has all of its activities, finalize it
+        while window < len(window_ends) - 1 and current_activity.timestamp_utc < window_ends[window]:
+            if index:
+                up, down = finalize_uptime_downtime(local_window_ends[window], previous_activity_timestamp,
+                                                    previous_activity_status, business_hours)
+                window_hours[window] = [uptime + up, downtime + down]
+            window += 1
+
+        current_activity_status = current_activity.status
+        current_activity_timestamp = offset_table.to_local(current_activity.timestamp_utc)
+
+        up, down = process_activity_ranges(
+            current_activity_timestamp, current_activity_status,
+            previous_activity_timestamp, previous_activity_status, business_hours, index)
+
+        uptime += up
+        downtime += down
+
+        previous_activity_timestamp = current_activity_timestamp
+        previous_activity_status = current_activity_status
+
+    # The last window gets the duration between the final activity and its end.
+    up, down = finalize_uptime_downtime(local_window_ends[-1], previous_activity_timestamp,
+                                        previous_activity_status, business_hours)
+    window_hours[-1] = [uptime + up, downtime + down]
+
+    return window_hours
+
+
+def generate_csv(report_id: uuid.UUID, start_time: datetime, end_time: datetime,
+                 activities: list, business_hours: dict, report_format: str = DEFAULT_REPORT_FORMAT,
+                 summary: ReportSummary = None) -> bool:
+    """Generate a CSV report for store activities, also written in report_format and added to summary."""
+    # Calculate the end time of every window, the longest one ends at end_time
+    window_ends = [start_time - duration for _, duration, _ in REPORT_WINDOWS[:-1]] + [end_time]
+
+    # Every row can be streamed to clients following the report as soon as it is computed
+    with ReportWriter(report_id, report_format) as report_writer:
         index = 0
         while index < len(activities):
+            check_cancelled()
             current_store_id = activities[index].store_id
-            current_store_activities = []
-            previous_hour_activity_hours = [0, 0]
-            previous_day_activity_hours = [0, 0]
-            calculated_for_hour = False
-            calculated_for_day = False
+            first_store_activity = index
 
-            #  Store all the activities for a particular store in current_store_activities.
+            # Find all the activities of a particular store.
             while index < len(activities) and activities[index].store_id == current_store_id:
-                current_activity_timestamp = activities[index].timestamp_utc
-
-                # If all the activities for the last hour are collected, interpolate for last hour.
-                if current_activity_timestamp < end_time_last_hour and not calculated_for_hour:
-                    calculated_for_hour = True
-                    previous_hour_activity_hours = interpolate_activities(
-                        current_store_activities, start_time, end_time_last_hour, business_hours[current_store_id])
-
-                # If all the activities for the last day are collected, interpolate for last day.
-                if current_activity_timestamp < end_time_last_day and not calculated_for_day:
-                    calculated_for_day = True
-                    previous_day_activity_hours = interpolate_activities(
-                        current_store_activities, start_time, end_time_last_day, business_hours[current_store_id])
-                current_store_activities.append(activities[index])
                 index += 1
 
-            # Finally interpolate uptime and downtime for the last week.
-            previous_week_activity_hours = interpolate_activities(
-                current_store_activities, start_time, end_time, business_hours[current_store_id])
+            # Interpolate uptime and downtime for all the windows at once.
+            window_hours = interpolate_windows(
+                activities[first_store_activity:index], start_time, window_ends, business_hours[current_store_id])
+
+            row = format_report_row(current_store_id, window_hours)
+            if summary is not None:
+                summary.add(row, get_store_timezone(business_hours, current_store_id))
+            report_writer.write_row(row)
+
+    return True
+
+
+def write_report_csv(report_id: uuid.UUID, rows, report_format: str = DEFAULT_REPORT_FORMAT,
+                     summary: ReportSummary = None, business_hours: dict = None) -> bool:
+    """Write the header and the rows of a report to its CSV file, and to the file of report_format.
+
+    The rows are also added to summary when given, with the timezones of the stores in business_hours.
+    """
+    # The rows are computed while they are written, producing them is timed as interpolation. Every row
+    # can be streamed to clients following the report as soon as it is computed.
+    # A cancelled report stops before its next store
+    rows = cancellable_rows(timed(rows, PHASE_INTERPOLATE, COUNTER_STORES_PROCESSED))
+    if summary is not None:
+        rows = summarize_rows(rows, summary, business_hours)
+    with phase(PHASE_WRITE_CSV), ReportWriter(report_id, report_format) as report_writer:
+        report_writer.write_rows(rows)
+
+    return True
+
 
-            uptime_last_hour, downtime_last_hour = previous_hour_activity_hours
-            uptime_last_day, downtime_last_day = previous_day_activity_hours
-            uptime_last_week, downtime_last_week = previous_week_activity_hours
+def get_report_time_range(as_of: datetime = None) -> tuple:
+    """Get the start_time and end_time of the report, end_time being a week before start_time.
+
+    start_time is as_of when given, a naive UTC datetime.
+    """
+    current_time_str = '2023-01-25 14:11:45.290'  # Using the example timestamp, current time has to be used
+
+    current_time = as_of or datetime.strptime(current_time_str, '%Y-%m-%d %H:%M:%S.%f')
+    # start_time is the time at which the generation of report started and end_time will be the start of
+    # the longest report window, a week back.
+    return current_time, current_time - REPORT_WINDOWS[-1][1]
+
+
+def get_activities_query(db: Session, start_time: datetime, end_time: datetime, store_ids: list = None,
+                         stores: StoreFilter = None):
+    """Query the activities between end_time and start_time ordered by store_id and descending timestamp_utc."""
+    query = db.query(StoreActivity).filter(
+        StoreActivity.timestamp_utc >= end_time,
+        StoreActivity.timestamp_utc <= start_time
+    )
+    if store_ids is not None:
+        query = query.filter(StoreActivity.store_id.in_(store_ids))
+    if stores:
+        query = query.filter(*stores.where(StoreActivity.store_id))
+    return query.order_by(StoreActivity.store_id, desc(StoreActivity.timestamp_utc))
+
+
+def get_store_shards(db: Session, start_time: datetime, end_time: datetime, shard_count: int,
+                     stores: StoreFilter = None) -> list:
+    """Split the stores with activities in the report time range into shards by the hash of their store_id."""
+    shards = [[] for _ in range(shard_count)]
+    store_ids = db.query(StoreActivity.store_id).filter(
+        StoreActivity.timestamp_utc >= end_time,
+        StoreActivity.timestamp_utc <= start_time
+    )
+    if stores:
+        store_ids = store_ids.filter(*stores.where(StoreActivity.store_id))
+    store_ids = store_ids.distinct()
+
+    for (store_id,) in store_ids:
+        # crc32 is stable across processes, unlike the builtin hash of a string
+        shards[zlib.crc32(store_id.encode()) % shard_count].append(store_id)
+
+    return [shard for shard in shards if shard]
 
-            csv_writer.writerow([
-                current_store_id, round(uptime_last_hour * 60), round(downtime_last_hour * 60),
-                round(uptime_last_day), round(downtime_last_day),
-                round(uptime_last_week), round(downtime_last_week)
-            ])
+
+def init_report_worker():
+    """Drop the database connections inherited from the parent process."""
+    db_engine.dispose(close=False)
+
+
+def generate_shard_csv(csv_filepath: str, store_ids: list, start_time: datetime, end_time: datetime) -> tuple:
+    """Write the rows of a shard of stores, without header and sorted by store_id, to a CSV part file.
+
+    Returns the timings and the summary of the shard, to be added to those of the report.
+    """
+    summary = ReportSummary()
+    with collect_timings() as timings:
+        db = Session()
+        try:
+            _, business_hours = load_store_metadata(db, store_ids)
+            store_activities = timed(stream_activity_arrays(
+                db, get_activity_columns_query(start_time, end_time, store_ids)), PHASE_QUERY_ACTIVITIES)
+            rows = timed(compute_store_rows(start_time, end_time, store_activities, business_hours),
+                         PHASE_INTERPOLATE, COUNTER_STORES_PROCESSED)
+            rows = sorted(summarize_rows(rows, summary, business_hours), key=lambda row: row[0])
+        finally:
+            db.close()
+
+        with phase(PHASE_WRITE_CSV), open(csv_filepath, mode='w', newline='') as csvfile:
+            csv.writer(csvfile).writerows(rows)
+
+    return timings.as_dict(), summary.as_dict()
+
+
+def generate_csv_sharded(report_id: uuid.UUID, db: Session, start_time: datetime, end_time: datetime,
+                         workers: int, stores: StoreFilter = None, report_format: str = DEFAULT_REPORT_FORMAT,
+                         summary: ReportSummary = None) -> bool:
+    """Generate the CSV report with the vectorized engine, with the stores split across worker processes.
+
+    The summaries of the shards are merged into summary, the merged rows are not summarized again.
+    """
+    os.makedirs(REPORT_FOLDER, exist_ok=True)
+
+    csv_filepath = get_report_filepath(report_id)
+    # The shards only hold filtered stores, the workers select them by store_id
+    shards = get_store_shards(db, start_time, end_time, workers, stores)
+    if METADATA_SNAPSHOT:
+        # Rebuilt once here if needed rather than by every worker, which map the same file
+        get_metadata_snapshot(db)
+    part_filepaths = [f'{csv_filepath}.part{index}' for index in range(len(shards))]
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_report_worker) as executor:
+            futures = [executor.submit(generate_shard_csv, part_filepath, shard, start_time, end_time)
+                       for part_filepath, shard in zip(part_filepaths, shards)]
+            try:
+                # The shards are checked for cancellation as they complete, the pending ones are not started
+                shard_results = []
+                for future in futures:
+                    shard_results.append(future.result())
+                    check_cancelled()
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+        # The shards run in parallel, their phase seconds add up to more than the elapsed time
+        for timings, shard_summary in shard_results:
+            merge(timings)
+            if summary is not None:
+                summary.merge(shard_summary)
+
+        # Every part is sorted by store_id, merge them into the report in store_id order
+        part_files = [open(part_filepath, newline='') for part_filepath in part_filepaths]
+        try:
+            with phase(PHASE_WRITE_CSV), ReportWriter(report_id, report_format) as report_writer:
+                report_writer.write_rows(cancellable_rows(
+                    heapq.merge(*map(csv.reader, part_files), key=lambda row: row[0])))
+        finally:
+            for part_file in part_files:
+                part_file.close()
+    finally:
+        for part_filepath in part_filepaths:
+            if os.path.exists(part_filepath):
+                os.remove(part_filepath)
 
     return True
 
 
-def generate_report(report_id: uuid.UUID, db: Session):
+def generate_report_csv(report_id: uuid.UUID, db: Session, engine: str = DEFAULT_ENGINE,
+                        streaming: bool = True, workers: int = REPORT_WORKERS, as_of: datetime = None,
+                        stores: StoreFilter = None, report_format: str = DEFAULT_REPORT_FORMAT,
+                        summary: ReportSummary = None) -> tuple:
+    """Compute the report with the given engine and write its CSV, returns the report time range.
+
+    With streaming the vectorized engine reads the activities store by store instead of loading the whole week,
+    with more than one worker the stores are split across as many processes. The report is computed as of as_of
+    instead of the default report time when given, and only for the stores selected by stores. The report is
+    also written in report_format, and its rows are added to summary when given.
+    """
+    start_time, end_time = get_report_time_range(as_of)
+
+    if engine == ENGINE_VECTORIZED and workers > 1:
+        # Each worker loads the timezones, business hours and activities of its own shard of stores
+        generate_csv_sharded(report_id, db, start_time, end_time, workers, stores, report_format, summary)
+        return start_time, end_time
+
+    # Fetch all the stores and their timezones that are present in the store timezones table, and their
+    # business hours by store and day, only for the filtered stores
+    _, business_hours = load_store_metadata(db, stores=stores)
+
+    # Get all the activities between start_time and end_time in stored on the basis of
+    # store_id and descending order od timestamp_utc
+    activities = get_activities_query(db, start_time, end_time, stores=stores)
+
+    if engine == ENGINE_VECTORIZED:
+        # The vectorized engine reads plain column tuples and packs them into arrays instead of StoreActivity objects
+        activities = get_activity_columns_query(start_time, end_time, stores=stores)
+        if streaming:
+            # Fetch the activities in batches through a server side cursor, only the activities
+            # of the store being interpolated are kept in memory
+            store_activities = timed(stream_activity_arrays(db, activities), PHASE_QUERY_ACTIVITIES)
+        else:
+            with phase(PHASE_QUERY_ACTIVITIES):
+                store_activities = load_activity_arrays(db, activities)
+        # The vectorized engine filters the activities to business hours itself
+        write_report_csv(report_id, compute_store_rows(start_time, end_time, store_activities, business_hours),
+                         report_format, summary, business_hours)
+    elif engine == ENGINE_ROLLUP:
+        # The rollup engine only reads the raw activities of the business hours at the edges of the windows
+        write_report_csv(report_id, compute_rollup_rows(db, start_time, end_time, business_hours, stores),
+                         report_format, summary, business_hours)
+    elif engine == ENGINE_PUSHDOWN:
+        # The pushdown engine interpolates the activities in the database, only a row per store is read back
+        write_report_csv(report_id, compute_pushdown_rows(db, start_time, end_time, business_hours, stores),
+                         report_format, summary, business_hours)
+    elif engine == ENGINE_REFERENCE:
+        with phase(PHASE_QUERY_ACTIVITIES):
+            activities = activities.all()
+        count(COUNTER_ROWS_SCANNED, len(activities))
+        # Filtering activities that are within the business hours
+        with phase(PHASE_FILTER_BUSINESS_HOURS):
+            business_hours = sort_business_hours(business_hours)
+            activities_within_business_hours = [
+                activity for activity in activities
+                if is_within_business_hours(activity.store_id, activity.timestamp_utc, business_hours)
+            ]
+        count(COUNTER_STORES_PROCESSED, len({activity.store_id for activity in activities_within_business_hours}))
+
+        # Start generating the csv report, the rows are written as they are interpolated
+        with phase(PHASE_INTERPOLATE):
+            generate_csv(report_id, start_time, end_time, activities_within_business_hours, business_hours,
+                         report_format, summary)
+    else:
+        raise ValueError(f"Unknown report engine: {engine}")
+
+    return start_time, end_time
+
+
+def get_reference_divergences(business_hours: dict, store_ids, start_time: datetime, end_time: datetime) -> set:
+    """Get the stores whose report the reference engine is known to compute differently from the other engines.
+
+    The reference engine skips business hours that cross midnight and measures durations in local time, the
+    other engines count those business hours and measure real time: stores with such business hours, or whose
+    timezone changes its UTC offset between end_time and start_time, are reported differently.
+    """
+    divergent = set()
+    for store_id in store_ids:
+        store_hours = business_hours.get(store_id) or {}
+        timezone_str = get_store_timezone(business_hours, store_id)
+        crosses_midnight = any(start > end for day_of_week in range(7)
+                               for start, end in store_hours.get(day_of_week, []))
+        offset_changes = to_local(timezone_str, start_time) - start_time != to_local(timezone_str, end_time) - end_time
+        if crosses_midnight or offset_changes:
+            divergent.add(store_id)
+    return divergent
+
+
+def check_engine_parity(db: Session, engines: tuple = (ENGINE_REFERENCE, ENGINE_VECTORIZED)) -> tuple:
+    """Generate the report with every engine and compare the row of every store with that of the first engine.
+
+    When the reference engine is compared to another engine, the stores of get_reference_divergences are left
+    out of the comparison. Returns (mismatched, divergent), the sorted ids of the stores whose rows differ or
+    are missing from a report, and of the stores left out.
+    """
+    reports = []
+    for engine in engines:
+        report_id = uuid.uuid4()
+        generate_report_csv(report_id, db, engine)
+        with open(get_report_filepath(report_id), newline='') as csvfile:
+            reports.append({row[0]: row for row in list(csv.reader(csvfile))[1:]})
+        remove_report_files(report_id)
+
+    store_ids = set().union(*reports)
+    divergent = set()
+    if ENGINE_REFERENCE in engines and len(set(engines)) > 1:
+        _, business_hours = load_store_metadata(db, list(store_ids))
+        start_time, end_time = get_report_time_range()
+        divergent = get_reference_divergences(business_hours, store_ids, start_time, end_time)
+
+    mismatched = {store_id for store_id in store_ids - divergent
+                  if any(report.get(store_id) != reports[0].get(store_id) for report in reports[1:])}
+    return sorted(mismatched), sorted(divergent)
+
+
+def get_report_timings(timings: ReportTimings, start_report_generation: float) -> dict:
+    """Get the timings of a report as saved on it, with the total seconds since generation started."""
+    return {'total_seconds': round(time2() - start_report_generation, 6), **timings.as_dict()}
+
+
+def generate_report(report_id: uuid.UUID, db: Session, engine: str = DEFAULT_ENGINE, streaming: bool = True,
+                    workers: int = REPORT_WORKERS):
     """Generate a report for store activities."""
     start_report_generation = time2()
     try:
@@ -330,39 +677,52 @@ def generate_report(report_id: uuid.UUID, db: Session):
             status_code=status.HTTP_404_NOT_FOUND
         )
 
-    # Fetch all the stores and their timezones that are present in the store timezones table
-    store_timezones = get_store_timezones(db)
-    # Get the business hours and store them in a dictionary so that the business hours
-    # so that the business hours of a particular store and day can be fetched in less time
-    business_hours = get_business_hours(db, store_timezones)
-
-    current_time_str = '2023-01-25 14:11:45.290'  # Using the example timestamp, current time has to be used
-
-    current_time = datetime.strptime(current_time_str, '%Y-%m-%d %H:%M:%S.%f')
-    # start_time is the time at which the generation of report started and end_time will be a week back.
-    end_time = current_time - timedelta(weeks=1)
-    start_time = current_time
+    # Files moved into the report store by this report, removed again when the report is rolled back
+    moved_filepaths = []
+    with collect_timings() as timings:
+        try:
+            output_format = report.output_format or DEFAULT_REPORT_FORMAT
+            summary = ReportSummary()
+            start_time, end_time = generate_report_csv(report_id, db, engine, streaming, workers, report.as_of,
+                                                       StoreFilter.from_dict(report.store_filter), output_format,
+                                                       summary)
+            # The files are moved into the report store, their rows are committed with the completed status
+            with phase(PHASE_WRITE_CSV):
+                store_report(db, report_id, output_format, moved_filepaths)
+            # Only a running report is completed, one cancelled meanwhile stays cancelled. The summary is served
+            # by /get_report_summary without reading the rows again.
+            completed = db.query(Report).filter(Report.id == report_id, Report.status == STATUS_RUNNING).update(
+                {Report.status: STATUS_COMPLETED, Report.summary: summary.as_dict()}, synchronize_session=False)
+            if not completed:
+                raise ReportCancelled()
+            with phase(PHASE_COMMIT):
+                db.commit()
+        except Exception:
+            # A failed report is not reused by the report cache, a cancelled one is not failed. Nothing refers to
+            # the files it moved into the report store once the references are rolled back.
+            discard_stored_files(moved_filepaths)
+            db.rollback()
+            db.query(Report).filter(Report.id == report_id, Report.status == STATUS_RUNNING).update(
+                {Report.status: STATUS_FAILED, Report.timings: get_report_timings(timings, start_report_generation)},
+                synchronize_session=False)
+            db.commit()
+            raise
+
+        # The copies of the files whose content was already stored are removed once the references are committed
+        remove_report_files(report_id)
 
-    # Get all the activities between start_time and end_time in stored on the basis of
-    # store_id and descending order od timestamp_utc
-    activities = db.query(StoreActivity).filter(
-        StoreActivity.timestamp_utc >= end_time,
-        StoreActivity.timestamp_utc <= start_time
-    ).order_by(StoreActivity.store_id, desc(StoreActivity.timestamp_utc)).all()
-
-    # Filtering activities that are within the business hours
-    activities_within_business_hours = [
-        activity for activity in activities
-        if is_within_business_hours(activity.store_id, activity.timestamp_utc, business_hours)
-    ]
-
-    # Start generating the csv report.
-    generate_csv(report_id, start_time, end_time, activities_within_business_hours, business_hours)
-
-    report.status = STATUS_COMPLETED
+    end_report_generation = time2()
+    # The duration of the commit is only known once it is done, it is saved with a second update
+    report.timings = get_report_timings(timings, start_report_generation)
     db.commit()
 
-    end_report_generation = time2()
+    # The report itself is kept even when it does not fit in the report store on its own
+    try:
+        evict_reports(db, report_id)
+    except Exception:
+        db.rollback()
+        logger.exception("Failed to evict reports from the report store")
 
     logger.info(f"Timestamp range: {start_time} -- -- -- {end_time}")
     logger.info(f"Time taken to generate report: {end_report_generation - start_report_generation} seconds")
+    logger.info(f"Report timings: {report.timings}")
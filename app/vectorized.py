@@ -0,0 +1,163 @@
+from datetime import datetime
+from itertools import groupby
+from operator import attrgetter
+
+import numpy as np
+
+from constants import REPORT_WINDOWS, WINDOW_UNITS
+from business_hour_index import BusinessHourIndex, to_epoch_us
+from metrics import phase, PHASE_FILTER_BUSINESS_HOURS
+
+STATUS_INACTIVE = 0
+STATUS_ACTIVE = 1
+STATUS_OTHER = 2
+STATUS_CODES = {'inactive': STATUS_INACTIVE, 'active': STATUS_ACTIVE}
+
+
+def encode_statuses(statuses) -> np.ndarray:
+    """Encode status strings as uint8 codes."""
+    return np.fromiter((STATUS_CODES.get(s, STATUS_OTHER) for s in statuses), dtype=np.uint8)
+
+
+class StoreTimeline:
+    """Business hour intervals containing a store's timestamps."""
+
+    def __init__(self, ts: np.ndarray, store_id: str, business_hour_index: BusinessHourIndex):
+        opens, closes = business_hour_index.get_intervals(store_id)
+        self.ts = ts
+        # Index of the interval containing each timestamp, -1 if outside business hours
+        self.range_index = business_hour_index.locate(store_id, ts)
+        inside = self.range_index >= 0
+        self.range_start = np.where(inside, opens[self.range_index] if len(opens) else ts, ts)
+        self.range_end = np.where(inside, closes[self.range_index] if len(closes) else ts, ts)
+
+    def __getitem__(self, item):
+        timeline = object.__new__(StoreTimeline)
+        for name in ('ts', 'range_index', 'range_start', 'range_end'):
+            setattr(timeline, name, getattr(self, name)[item])
+        return timeline
+
+
+def split_hours(codes: np.ndarray, hours: np.ndarray) -> tuple:
+    """Split hours spent in a single status into uptime and downtime."""
+    return np.where(codes == STATUS_ACTIVE, hours, 0.0), np.where(codes == STATUS_INACTIVE, hours, 0.0)
+
+
+def to_hours(duration_us: np.ndarray) -> np.ndarray:
+    return duration_us / 10 ** 6 / 3600
+
+
+def interpolate_store(timeline: StoreTimeline, codes: np.ndarray,
+                      start: StoreTimeline, end: StoreTimeline) -> list:
+    """Vectorized equivalent of utils.interpolate_activities for one store.
+
+    timeline and codes hold the store's activities in descending order of time, start and end are
+    single element timelines for the start_time and end_time of the interval. Durations are measured
+    in UTC between the business hour boundaries of the BusinessHourIndex.
+    """
+    if not len(codes):
+        return [0, 0]
+
+    def shifted(values, first):
+        return np.concatenate([first, values[:-1]])
+
+    previous_ts = shifted(timeline.ts, start.ts)
+    previous_range_index = shifted(timeline.range_index, start.range_index)
+    previous_range_start = shifted(timeline.range_start, start.range_start)
+    previous_codes = shifted(codes, codes[:1])
+
+    # Activities in the same business hour interval as their predecessor: interpolate the gap
+    same_range = previous_range_index == timeline.range_index
+    gap = to_hours(previous_ts - timeline.ts)
+    changed = previous_codes != codes
+    same_up, same_down = split_hours(codes, gap)
+    same_up = np.where(changed, gap / 2, same_up)
+    same_down = np.where(changed, gap / 2, same_down)
+
+    # Otherwise interpolate from the start of the predecessor's range and up to the end of the current range
+    before = to_hours(previous_ts - previous_range_start)
+    before[0] = 0
+    before_up, before_down = split_hours(previous_codes, before)
+    after_up, after_down = split_hours(codes, to_hours(timeline.range_end - timeline.ts))
+
+    uptime = np.cumsum(np.where(same_range, same_up, before_up + after_up))[-1]
+    downtime = np.cumsum(np.where(same_range, same_down, before_down + after_down))[-1]
+
+    # The duration between the final activity and the end time
+    last = timeline[-1:]
+    if last.range_index[0] == end.range_index[0]:
+        final = to_hours(last.ts - end.ts)
+    else:
+        final = to_hours(last.ts - last.range_start)
+    final_up, final_down = split_hours(codes[-1:], final)
+
+    return [float(uptime + final_up[0]), float(downtime + final_down[0])]
+
+
+def interpolate_window(timeline: StoreTimeline, codes: np.ndarray, start: StoreTimeline, end: StoreTimeline) -> list:
+    """Interpolate the activities newer than end, the way generate_csv does for the last hour and day."""
+    # The reversed view of the descending timestamps is in ascending order
+    count = len(codes) - int(np.searchsorted(timeline.ts[::-1], end.ts[0], side='left'))
+    if count == len(codes):
+        # generate_csv only interpolates a window once it sees an activity older than the window
+        return [0, 0]
+    return interpolate_store(timeline[:count], codes[:count], start, end)
+
+
+def group_by_store(activities):
+    """Yield (store_id, activities) for each store of an iterable of activities ordered by store_id."""
+    for store_id, store_activities in groupby(activities, key=attrgetter('store_id')):
+        yield store_id, list(store_activities)
+
+
+def format_report_row(store_id: str, window_hours: list) -> list:
+    """Format the (uptime, downtime) hours of every report window into a CSV row, in the unit of the window."""
+    row = [store_id]
+    for (_, _, unit), (uptime, downtime) in zip(REPORT_WINDOWS, window_hours):
+        row += [round(uptime * WINDOW_UNITS[unit]), round(downtime * WINDOW_UNITS[unit])]
+    return row
+
+
+def interpolate_store_windows(store_id: str, ts: np.ndarray, codes: np.ndarray,
+                              business_hour_index: BusinessHourIndex, boundaries: np.ndarray) -> list:
+    """Interpolate the (uptime, downtime) hours of every report window of a store, in the order of REPORT_WINDOWS.
+
+    ts are the polls of the store in microseconds since the epoch in descending order, boundaries the start time
+    of the report followed by the end of every window. Returns None when no poll is within business hours.
+    """
+    with phase(PHASE_FILTER_BUSINESS_HOURS):
+        timeline = StoreTimeline(ts, store_id, business_hour_index)
+
+        # Keep only the activities within business hours
+        within_business_hours = timeline.range_index >= 0
+        if not within_business_hours.any():
+            return None
+        if not within_business_hours.all():
+            codes, timeline = codes[within_business_hours], timeline[within_business_hours]
+
+    points = StoreTimeline(boundaries, store_id, business_hour_index)
+    start = points[0:1]
+
+    window_hours = [interpolate_window(timeline, codes, start, points[window:window + 1])
+                    for window in range(1, len(boundaries) - 1)]
+    window_hours.append(interpolate_store(timeline, codes, start, points[-1:]))
+    return window_hours
+
+
+def compute_store_rows(start_time: datetime, end_time: datetime, store_activities, business_hours: dict):
+    """Yield the CSV row of every store with activities within its business hours.
+
+    store_activities yields the (store_id, ts, codes) of every store, ts being its polls in microseconds since
+    the epoch in descending order, as ActivityArrays and stream_activity_arrays do. A row is yielded as soon as
+    the polls of its store are consumed. Unlike generate_csv they are filtered to business hours here, per store,
+    instead of beforehand.
+    """
+    # The end of every window, the longest one ends at end_time
+    window_ends = [start_time - duration for _, duration, _ in REPORT_WINDOWS[:-1]] + [end_time]
+    boundaries = to_epoch_us([start_time, *window_ends])
+    business_hour_index = BusinessHourIndex(business_hours, start_time, end_time)
+
+    for store_id, ts, codes in store_activities:
+        window_hours = interpolate_store_windows(store_id, ts, codes, business_hour_index, boundaries)
+        if window_hours is not None:
+            yield format_report_row(store_id, window_hours)
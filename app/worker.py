@@ -0,0 +1,148 @@
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+
+from db import Session, engine as db_engine
+from config import REPORT_JOB_CONCURRENCY, REPORT_JOB_HEARTBEAT, REPORT_JOB_TIMEOUT, REPORT_JOB_MAX_ATTEMPTS
+from constants import STATUS_QUEUED, STATUS_RUNNING, STATUS_FAILED, STATUS_CANCELLED, DEFAULT_ENGINE
+from models import Report
+from report_output import remove_report_files
+from cancellation import ReportCancelled, cancellable
+from utils import generate_report
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between two polls of the queue when it is empty
+POLL_INTERVAL = 1
+
+
+def requeue_stale_jobs(db: Session):
+    """Queue again the running reports whose worker stopped sending heartbeats, fail them after the last attempt."""
+    stale_before = datetime.utcnow() - timedelta(seconds=REPORT_JOB_TIMEOUT)
+    stale = db.query(Report).filter(Report.status == STATUS_RUNNING, Report.heartbeat_at < stale_before)
+
+    stale.filter(Report.attempts < REPORT_JOB_MAX_ATTEMPTS).update(
+        {Report.status: STATUS_QUEUED}, synchronize_session=False)
+    stale.filter(Report.attempts >= REPORT_JOB_MAX_ATTEMPTS).update(
+        {Report.status: STATUS_FAILED, Report.cache_key: None, Report.error: "Report worker crashed."},
+        synchronize_session=False)
+    db.commit()
+
+
+def claim_next_job(db: Session):
+    """Claim the oldest queued report, or return None when the queue is empty.
+
+    The claim only succeeds if the report is still queued, so that concurrent workers never
+    generate the same report.
+    """
+    while True:
+        candidate = db.query(Report.id).filter(Report.status == STATUS_QUEUED).order_by(Report.created_at).first()
+        if candidate is None:
+            return None
+
+        claimed = db.query(Report).filter(Report.id == candidate.id, Report.status == STATUS_QUEUED).update({
+            Report.status: STATUS_RUNNING,
+            Report.attempts: Report.attempts + 1,
+            Report.heartbeat_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return db.query(Report).filter(Report.id == candidate.id).one()
+
+
+def send_heartbeats(report_id, stop: threading.Event, cancelled: threading.Event):
+    """Refresh the heartbeat of a running report, and set cancelled once it gets cancelled."""
+    while not stop.wait(REPORT_JOB_HEARTBEAT):
+        db = Session()
+        try:
+            updated = db.query(Report).filter(Report.id == report_id, Report.status == STATUS_RUNNING).update(
+                {Report.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            if not updated and db.query(Report.status).filter(Report.id == report_id).scalar() == STATUS_CANCELLED:
+                # The report stops before its next store
+                cancelled.set()
+                return
+        finally:
+            db.close()
+
+
+def run_job(report: Report, db: Session):
+    """Generate a claimed report, with heartbeats sent from a background thread."""
+    stop = threading.Event()
+    cancelled = threading.Event()
+    heartbeat = threading.Thread(target=send_heartbeats, args=(report.id, stop, cancelled), daemon=True)
+    heartbeat.start()
+    try:
+        with cancellable(cancelled):
+            generate_report(report.id, db, report.engine or DEFAULT_ENGINE)
+    except ReportCancelled:
+        logger.info(f"Report {report.id} was cancelled")
+        remove_report_files(report.id)
+    except Exception as e:
+        # generate_report has marked the report as failed
+        logger.exception(f"Report {report.id} failed")
+        db.query(Report).filter(Report.id == report.id).update({Report.error: str(e)}, synchronize_session=False)
+        db.commit()
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def work():
+    """Generate queued reports one at a time until the process is terminated."""
+    # Connections inherited from the supervisor must not be shared
+    db_engine.dispose(close=False)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    while True:
+        db = Session()
+        report = None
+        try:
+            try:
+                requeue_stale_jobs(db)
+                report = claim_next_job(db)
+            except Exception:
+                # The database may be unavailable for a while, the queue is polled again after POLL_INTERVAL
+                logger.exception("Failed to claim a report")
+            if report is not None:
+                logger.info(f"Generating report {report.id}, attempt {report.attempts}")
+                run_job(report, db)
+        finally:
+            db.close()
+
+        if report is None:
+            time.sleep(POLL_INTERVAL)
+
+
+def supervise(concurrency: int = REPORT_JOB_CONCURRENCY):
+    """Keep concurrency worker processes running, replacing those that exit or crash."""
+    workers = []
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        workers = [worker for worker in workers if worker.is_alive()]
+        while len(workers) < concurrency:
+            worker = multiprocessing.Process(target=work)
+            worker.start()
+            workers.append(worker)
+        time.sleep(POLL_INTERVAL)
+
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    supervise()
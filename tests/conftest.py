@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+# The database is configured when db is first imported, the tests use a SQLite database of their own and
+# query the store metadata instead of writing a snapshot into the 'app' directory
+test_dir = tempfile.mkdtemp(prefix='store_monitoring_tests_')
+os.environ['DATABASE_URI'] = f'sqlite:///{os.path.join(test_dir, "test.db")}'
+os.environ['DATABASE_ECHO'] = 'false'
+os.environ['METADATA_SNAPSHOT'] = 'false'
+
+# The modules of the app import each other from the 'app' directory
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'app'))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from constants import ENGINE_VECTORIZED  # noqa: E402
+from db import Base, Session, engine  # noqa: E402
+from main import app  # noqa: E402
+from utils import get_report_time_range  # noqa: E402
+from worker import claim_next_job, run_job  # noqa: E402
+from benchmarks.generator import load_dataset  # noqa: E402
+
+# Stores of the synthetic dataset, a few of them have split, overnight or missing business hours
+TEST_STORES = 40
+
+
+@pytest.fixture(scope='session', autouse=True)
+def dataset():
+    """Load the synthetic dataset of the week before the default report time, reports are written to test_dir."""
+    working_dir = os.getcwd()
+    os.chdir(test_dir)
+    Base.metadata.create_all(bind=engine)
+    start_time, _ = get_report_time_range()
+    try:
+        yield load_dataset(TEST_STORES, start_time)
+    finally:
+        os.chdir(working_dir)
+
+
+@pytest.fixture
+def db():
+    session = Session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def trigger_report(client):
+    """Queue a report through the API as of hours_ago hours before the default report time, returns its id.
+
+    Reports of different times are not shared through the report cache, every test uses its own hours_ago.
+    """
+    def trigger(hours_ago: int, engine: str = ENGINE_VECTORIZED) -> str:
+        start_time, _ = get_report_time_range()
+        response = client.post('/trigger_report', params={'engine': engine},
+                               json={'as_of': (start_time - timedelta(hours=hours_ago)).isoformat()})
+        assert response.status_code == 200
+        return response.json()['report_id']
+    return trigger
+
+
+@pytest.fixture
+def run_queued_reports():
+    """Generate the queued reports as a report worker does."""
+    def run():
+        with Session() as session:
+            while (report := claim_next_job(session)) is not None:
+                run_job(report, session)
+    return run
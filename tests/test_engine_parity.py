@@ -0,0 +1,10 @@
+from constants import ENGINE_REFERENCE, ENGINE_VECTORIZED
+from utils import check_engine_parity
+
+
+def test_vectorized_engine_matches_reference(db):
+    mismatched, divergent = check_engine_parity(db, [ENGINE_REFERENCE, ENGINE_VECTORIZED])
+
+    assert mismatched == []
+    # The overnight business hours of the dataset are left out of the comparison
+    assert divergent
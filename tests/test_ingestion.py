@@ -0,0 +1,38 @@
+import json
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from models import StoreActivity
+from utils import get_report_time_range
+
+
+def test_ingest_activities(client, db):
+    start_time, _ = get_report_time_range()
+    polls = [{'store_id': 'ingested-store', 'status': status,
+              'timestamp_utc': f'{start_time + timedelta(minutes=minutes)} UTC'}
+             for minutes, status in ((1, 'active'), (2, 'inactive'))]
+    invalid_poll = {'store_id': 'ingested-store', 'status': 'open'}
+    body = '\n'.join(json.dumps(poll) for poll in [*polls, invalid_poll])
+
+    response = client.post('/activities', content=body, headers={'Content-Type': 'application/x-ndjson'})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result['accepted'], result['rejected']) == (2, 1)
+    assert len(result['errors']) == 1 and result['errors'][0].startswith('line 3: status must be one of')
+
+    statuses = db.scalars(select(StoreActivity.status).where(StoreActivity.store_id == 'ingested-store')
+                          .order_by(StoreActivity.timestamp_utc)).all()
+    assert statuses == ['active', 'inactive']
+
+    # Polls already stored are skipped
+    csv_body = 'store_id,status,timestamp_utc\n' + '\n'.join(
+        f"{poll['store_id']},{poll['status']},{poll['timestamp_utc']}" for poll in polls)
+    response = client.post('/activities', content=csv_body, headers={'Content-Type': 'text/csv'})
+    assert response.status_code == 200
+    assert db.query(StoreActivity).filter(StoreActivity.store_id == 'ingested-store').count() == 2
+
+
+def test_ingest_activities_of_an_unsupported_content_type(client):
+    response = client.post('/activities', content='{}', headers={'Content-Type': 'application/json'})
+    assert response.status_code == 415
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from business_hour_index import BusinessHourIndex
+from metadata_snapshot import build_metadata_snapshot
+from utils import get_business_hours, get_store_timezones, get_report_time_range
+
+
+@pytest.mark.parametrize('as_of', [None, datetime(2023, 3, 12, 9), datetime(2023, 11, 5, 7)])
+def test_snapshot_index_matches_business_hours_index(db, tmp_path, as_of):
+    snapshot = build_metadata_snapshot(db, filepath=str(tmp_path / 'store_metadata.snapshot'))
+    business_hours = get_business_hours(db, get_store_timezones(db))
+    snapshot_hours = snapshot.get_business_hours()
+    assert {store_id: dict(store_hours) for store_id, store_hours in snapshot_hours.items()} == \
+        {store_id: dict(store_hours) for store_id, store_hours in business_hours.items()}
+
+    # The weekly intervals of the snapshot expand into the intervals of the ranges of every day, around the DST
+    # changes of the dataset timezones too
+    start_time, end_time = get_report_time_range(as_of)
+    index = BusinessHourIndex(business_hours, start_time, end_time)
+    snapshot_index = BusinessHourIndex(snapshot_hours, start_time, end_time)
+    assert snapshot_index.intervals.keys() == index.intervals.keys()
+    for store_id, (opens, closes) in index.intervals.items():
+        snapshot_opens, snapshot_closes = snapshot_index.intervals[store_id]
+        np.testing.assert_array_equal(snapshot_opens, opens)
+        np.testing.assert_array_equal(snapshot_closes, closes)
@@ -0,0 +1,15 @@
+import sqlite3
+
+import pytest
+
+from constants import ENGINE_VECTORIZED, ENGINE_PUSHDOWN
+from utils import check_engine_parity
+
+
+@pytest.mark.skipif(sqlite3.sqlite_version_info >= (3, 43),
+                    reason="SQLite 3.43 and later sum with error compensation, ties may be rounded the other way")
+def test_pushdown_engine_matches_vectorized(db):
+    mismatched, divergent = check_engine_parity(db, [ENGINE_VECTORIZED, ENGINE_PUSHDOWN])
+
+    assert mismatched == []
+    assert divergent == []
@@ -0,0 +1,6 @@
+def test_get_report_in_an_unavailable_format_is_not_acceptable(client, trigger_report, run_queued_reports):
+    report_id = trigger_report(hours_ago=2)
+    run_queued_reports()
+
+    response = client.get('/get_report', params={'report_id': report_id}, headers={'Accept': 'application/json'})
+    assert response.status_code == 406
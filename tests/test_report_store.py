@@ -0,0 +1,53 @@
+import os
+import uuid
+
+from sqlalchemy import select
+
+import utils
+from constants import REPORT_STORE_FOLDER, STATUS_CANCELLED
+from db import Session
+from models import Report, StoredFile
+from report_store import store_report
+
+
+def list_stored_filepaths() -> list:
+    return sorted(os.path.join(folder, filename) for folder, _, filenames in os.walk(REPORT_STORE_FOLDER)
+                  for filename in filenames)
+
+
+def test_get_report_revalidates_its_etag(client, trigger_report, run_queued_reports):
+    report_id = trigger_report(hours_ago=1)
+    run_queued_reports()
+
+    response = client.get('/get_report', params={'report_id': report_id})
+    assert response.status_code == 200
+    assert response.text.startswith('store_id,')
+    etag = response.headers['ETag']
+
+    revalidated = client.get('/get_report', params={'report_id': report_id}, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
+    assert not revalidated.content
+
+    changed = client.get('/get_report', params={'report_id': report_id}, headers={'If-None-Match': '"other"'})
+    assert changed.status_code == 200
+
+
+def test_cancelled_report_leaves_no_stored_file(monkeypatch, client, trigger_report, run_queued_reports):
+    report_id = trigger_report(hours_ago=6)
+
+    def cancel_and_store(db, *args):
+        # Cancelled while its files are moved into the store, the report sees it when it is completed
+        assert client.post('/cancel_report', params={'report_id': report_id}).status_code == 200
+        store_report(db, *args)
+
+    with Session() as db:
+        stored_files = db.scalars(select(StoredFile.content_hash)).all()
+    stored_filepaths = list_stored_filepaths()
+    monkeypatch.setattr(utils, 'store_report', cancel_and_store)
+    run_queued_reports()
+
+    with Session() as db:
+        assert db.scalar(select(Report.status).where(Report.id == uuid.UUID(report_id))) == STATUS_CANCELLED
+        assert db.scalars(select(StoredFile.content_hash)).all() == stored_files
+    assert list_stored_filepaths() == stored_filepaths
@@ -0,0 +1,29 @@
+import csv
+import uuid
+
+from constants import ENGINE_VECTORIZED, ENGINE_ROLLUP
+from report_output import get_report_filepath, remove_report_files
+from rollup import backfill_hourly_uptime
+from utils import generate_report_csv, load_store_metadata
+
+
+def generate_rows(db, engine: str) -> dict:
+    """Generate the report of an engine, returns its rows by store_id."""
+    report_id = uuid.uuid4()
+    generate_report_csv(report_id, db, engine)
+    with open(get_report_filepath(report_id), newline='') as csvfile:
+        rows = {row[0]: row[1:] for row in list(csv.reader(csvfile))[1:]}
+    remove_report_files(report_id)
+    return rows
+
+
+def test_rollup_engine_only_rounds_half_units_differently(db):
+    _, business_hours = load_store_metadata(db)
+    backfill_hourly_uptime(db, business_hours)
+
+    vectorized = generate_rows(db, ENGINE_VECTORIZED)
+    rollup = generate_rows(db, ENGINE_ROLLUP)
+
+    assert rollup.keys() == vectorized.keys()
+    for store_id, row in vectorized.items():
+        assert all(abs(int(value) - int(other)) <= 1 for value, other in zip(row, rollup[store_id])), store_id
@@ -0,0 +1,30 @@
+import csv
+import uuid
+
+from sqlalchemy import select
+
+from constants import DEFAULT_ENGINE
+from models import StoreTimezone
+from report_output import get_report_filepath, remove_report_files
+from store_uptime import floor_as_of, get_store_uptime
+from utils import generate_report_csv, get_report_time_range
+from vectorized import format_report_row
+
+
+def test_store_uptime_matches_default_engine_report(db):
+    as_of = floor_as_of(get_report_time_range()[0])
+    report_id = uuid.uuid4()
+    generate_report_csv(report_id, db, DEFAULT_ENGINE, as_of=as_of)
+    with open(get_report_filepath(report_id), newline='') as csvfile:
+        rows = {row[0]: row for row in list(csv.reader(csvfile))[1:]}
+    remove_report_files(report_id)
+
+    assert rows
+    for store_id in db.scalars(select(StoreTimezone.store_id)).all():
+        store_as_of, window_hours = get_store_uptime(db, store_id, as_of)
+        assert store_as_of == as_of
+        if store_id in rows:
+            assert [str(value) for value in format_report_row(store_id, window_hours)] == rows[store_id]
+        else:
+            # A store without a row in the report has no polls within its business hours
+            assert window_hours is None or not any(map(any, window_hours))
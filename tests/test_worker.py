@@ -0,0 +1,70 @@
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+import worker
+from constants import STATUS_COMPLETED, STATUS_CANCELLED
+from db import Session
+from models import Report
+from worker import claim_next_job, run_job
+
+
+def get_report_status(report_id: str) -> str:
+    with Session() as db:
+        return db.scalar(select(Report.status).where(Report.id == uuid.UUID(report_id)))
+
+
+def test_cancel_queued_report(client, trigger_report, run_queued_reports):
+    report_id = trigger_report(hours_ago=3)
+
+    response = client.post('/cancel_report', params={'report_id': report_id})
+    assert response.status_code == 200
+    assert response.json() == {'Report status': STATUS_CANCELLED}
+
+    # A cancelled report is not generated, and cannot be cancelled again
+    run_queued_reports()
+    assert get_report_status(report_id) == STATUS_CANCELLED
+    assert client.post('/cancel_report', params={'report_id': report_id}).status_code == 409
+
+
+def test_cancel_running_report(client, trigger_report, run_queued_reports):
+    report_id = trigger_report(hours_ago=4)
+    with Session() as db:
+        report = claim_next_job(db)
+        assert str(report.id) == report_id
+
+        # Cancelled after the worker claimed it, the worker does not complete it
+        assert client.post('/cancel_report', params={'report_id': report_id}).status_code == 200
+        run_job(report, db)
+
+    assert get_report_status(report_id) == STATUS_CANCELLED
+    assert client.get('/get_report', params={'report_id': report_id}).json() == {'Report status': STATUS_CANCELLED}
+
+
+def test_cancel_completed_report_conflicts(client, trigger_report, run_queued_reports):
+    report_id = trigger_report(hours_ago=5)
+    run_queued_reports()
+
+    assert client.post('/cancel_report', params={'report_id': report_id}).status_code == 409
+    assert get_report_status(report_id) == STATUS_COMPLETED
+
+
+def test_worker_keeps_polling_when_claiming_fails(monkeypatch, caplog):
+    class Stop(Exception):
+        pass
+
+    def fail(db):
+        raise RuntimeError("database unavailable")
+
+    def stop(seconds):
+        raise Stop()
+
+    monkeypatch.setattr(worker, 'claim_next_job', fail)
+    monkeypatch.setattr(worker.time, 'sleep', stop)
+    monkeypatch.setattr(worker.signal, 'signal', lambda signum, handler: None)
+
+    # The claim failure is logged and the worker waits before polling the queue again
+    with pytest.raises(Stop):
+        worker.work()
+    assert "Failed to claim a report" in caplog.text